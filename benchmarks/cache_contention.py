@@ -0,0 +1,61 @@
+"""Compare the throughput of the in-memory caches under thread contention.
+
+    PYTHONPATH=. python benchmarks/cache_contention.py --threads 64 --operations 20000
+
+Every thread reads a shared set of keys, and stores one for every
+``--write-ratio`` reads, like API workers sharing a cache.
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from tweepy_mastodon.cache import BoundedMemoryCache, MemoryCache, ShardedMemoryCache
+
+
+def run(cache, threads, operations, keys, write_ratio):
+    for key in range(keys):
+        cache.store(key, key)
+    start = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        start.wait()
+        for i in range(operations):
+            key = rng.randrange(keys)
+            if i % write_ratio == 0:
+                cache.store(key, key)
+            else:
+                cache.get(key)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * operations / (time.perf_counter() - began)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--operations', type=int, default=20000, help='operations per thread')
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--write-ratio', type=int, default=10, help='reads per write, plus one')
+    args = parser.parse_args()
+
+    caches = {
+        'MemoryCache': MemoryCache(timeout=600),
+        'BoundedMemoryCache': BoundedMemoryCache(timeout=600, maxsize=args.keys),
+        'ShardedMemoryCache': ShardedMemoryCache(timeout=600),
+    }
+    for name, cache in caches.items():
+        throughput = run(cache, args.threads, args.operations, args.keys, args.write_ratio)
+        print(f'{name:20} {throughput:12,.0f} ops/s')
+
+
+if __name__ == '__main__':
+    main()
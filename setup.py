@@ -57,8 +57,16 @@ setup(
             "pytest>=7.2.1",
             "pytest_mock>=3.10.0"
         ],
+        "msgpack": ["msgpack>=1.0.0,<2"],
         "socks": ["requests[socks]>=2.27.0,<3"],
-        "test": ["vcrpy>=1.10.3"],
+        "test": [
+            "mongomock>=4.1.0,<5",
+            # mongomock does not support the bulk writes of pymongo 4.9
+            "pymongo>=4.0,<4.9",
+            "vcrpy>=1.10.3",
+            "websocket-client>=1.0.0,<2",
+        ],
+        "websocket": ["websocket-client>=1.0.0,<2"],
     },
     test_suite="tests",
     keywords="mastodon library",
@@ -189,3 +189,17 @@ def test_destroy_block(twitter_api: tweepy.API):
 
     with pytest.raises(Exception):
         twitter_api.destroy_block(user_id=-1)
+
+
+def test_connection_pool(mocker):
+    auth = mocker.Mock(client_id='id', client_secret='secret', access_token='token',
+                       api_base_url='https://mastodon.example')
+    mastodon = mocker.patch('tweepy_mastodon.api.Mastodon')
+
+    with tweepy.API(auth, pool_maxsize=4, pool_block=True) as api:
+        adapter = api.session.get_adapter('https://mastodon.example')
+        assert adapter._pool_maxsize == 4
+        assert adapter._pool_block
+        assert mastodon.call_args.kwargs['session'] is api.session
+        close = mocker.spy(api.session, 'close')
+    close.assert_called_once_with()
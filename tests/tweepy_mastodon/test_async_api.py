@@ -0,0 +1,133 @@
+import asyncio
+import copy
+import io
+
+from mastodon import MastodonNotFoundError
+from mastodon.utility import AttribAccessDict
+import pytest
+from yarl import URL
+
+from tests.tweepy_mastodon.test_utils import mastodon_status
+from tweepy_mastodon.asynchronous import AsyncAPI, AsyncClient
+from tweepy_mastodon.asynchronous.api import RATE_LIMIT_BACKOFF, RATE_LIMIT_RETRIES
+from tweepy_mastodon.errors import NotFound, TooManyRequests
+from tweepy_mastodon.utils import pagination_params
+
+
+def test_async_home_timeline(mocker, mastodon_status):
+    reply = copy.deepcopy(mastodon_status)
+    reply['in_reply_to_account_id'] = 1
+    deleted_reply = copy.deepcopy(mastodon_status)
+    deleted_reply['in_reply_to_account_id'] = 2
+    response = mocker.Mock(links={
+        'next': {'url': URL('https://async.example/api/v1/timelines/home?max_id=100')},
+    })
+
+    async def request(method, endpoint, *, params=None, data=None):
+        if endpoint == '/api/v1/timelines/home':
+            return [mastodon_status, reply, reply, deleted_reply], response
+        if endpoint == '/api/v1/instance':
+            return AttribAccessDict({'version': '4.2.10'}), None
+        if endpoint == '/api/v1/accounts/1':
+            return AttribAccessDict({'id': 1, 'username': 'Gargron', 'acct': 'Gargron'}), None
+        raise NotFound(mocker.Mock(status=404, reason='Not Found'), response_json={})
+
+    auth = mocker.Mock(api_base_url='async.example/')
+    api = AsyncAPI(auth)
+    mocker.patch.object(api, 'request', side_effect=request)
+
+    statuses = asyncio.run(api.home_timeline())
+
+    assert api.api_base_url == 'https://async.example'
+    assert [status.in_reply_to_screen_name for status in statuses] == ['shuuji3', 'Gargron', 'Gargron', None]
+    assert 'status' not in statuses[0].user
+    assert pagination_params(statuses) == {'max_id': 100}
+    assert [call.args[1] for call in api.request.call_args_list] == [
+        '/api/v1/timelines/home', '/api/v1/instance', '/api/v1/accounts/1', '/api/v1/accounts/2'
+    ]
+
+
+def test_async_lookup_statuses(mocker, mastodon_status):
+    statuses = []
+    for i in range(25):
+        status = copy.deepcopy(mastodon_status)
+        status['id'] = i
+        status['in_reply_to_account_id'] = None
+        statuses.append(status)
+
+    async def request(method, endpoint, *, params=None, data=None):
+        if endpoint == '/api/v1/instance':
+            return AttribAccessDict({'version': '4.3.0'}), None
+        # The multi-ID endpoint leaves out the statuses it cannot find
+        return [statuses[i] for i in params['id'] if i < len(statuses)], None
+
+    api = AsyncAPI(mocker.Mock(api_base_url='https://bulk.example'))
+    mocker.patch.object(api, 'request', side_effect=request)
+
+    results = asyncio.run(api.lookup_statuses([24, '3', 99, 3] + list(range(20))))
+
+    assert [result.id for result in results[:2]] == [24, 3]
+    assert isinstance(results[2], MastodonNotFoundError)
+    assert results[3] is results[1]
+    assert [call.kwargs.get('params') for call in api.request.call_args_list[1:]] == [
+        {'id': [24, 3, 99, 0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17]},
+        {'id': [18, 19]},
+    ]
+
+
+def test_async_media_upload(mocker):
+    media = AttribAccessDict({
+        'id': 7, 'url': 'https://async.example/media/7.png', 'meta': {'original': {'width': 1, 'height': 1}}
+    })
+    api = AsyncAPI(mocker.Mock(api_base_url='https://async.example'))
+    request = mocker.patch.object(api, 'request', return_value=(media, None))
+
+    # The file is not on disk, only its name is sent
+    file = io.BytesIO(b'\x89PNG\r\n\x1a\n' + bytes(24))
+    uploaded = asyncio.run(api.media_upload('missing/upload.bin', file=file))
+
+    assert uploaded.media_id == 7
+    form = request.call_args.kwargs['data']
+    (options, headers, content), = form._fields
+    assert options['filename'] == 'missing/upload.bin'
+    assert headers['Content-Type'] == 'image/png'
+    assert content == file.getvalue()
+
+
+def test_async_wait_on_rate_limit(mocker):
+    def response(status, headers):
+        return mocker.Mock(spec=['status', 'reason', 'headers'], status=status, reason='', headers=headers)
+
+    api = AsyncAPI(mocker.Mock(api_base_url='https://async.example'), wait_on_rate_limit=True)
+    sleep = mocker.patch('asyncio.sleep', new=mocker.AsyncMock())
+
+    # Without a reset time, Retry-After or a fixed backoff is waited for
+    send = mocker.patch.object(api, '_send', side_effect=[
+        ('', response(429, {'Retry-After': '5'})), ('', response(429, {})), ('{"id": 1}', response(200, {})),
+    ])
+    result, _ = asyncio.run(api.request('GET', '/api/v1/statuses/1'))
+    assert result == {'id': 1}
+    assert send.call_count == 3
+    assert [call.args[0] for call in sleep.call_args_list] == [5, RATE_LIMIT_BACKOFF]
+
+    # The request is retried a bounded number of times
+    sleep.reset_mock()
+    send = mocker.patch.object(api, '_send', return_value=('', response(429, {})))
+    with pytest.raises(TooManyRequests):
+        asyncio.run(api.request('GET', '/api/v1/statuses/1'))
+    assert send.call_count == RATE_LIMIT_RETRIES + 1
+    assert sleep.call_count == RATE_LIMIT_RETRIES
+
+
+def test_async_client_session():
+    async def use_client():
+        async with AsyncClient('token', connection_limit=5, dns_cache_ttl=60) as client:
+            session = client._get_session()
+            assert client._get_session() is session
+            assert session.connector.limit == 5
+            assert session.connector.use_dns_cache
+        return client, session
+
+    client, session = asyncio.run(use_client())
+    assert session.closed
+    assert client.session is None
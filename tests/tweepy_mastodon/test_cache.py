@@ -0,0 +1,434 @@
+import copy
+import hashlib
+import pickle
+import threading
+import time
+from unittest.mock import ANY, call
+
+from mastodon import MastodonNotFoundError
+from mastodon.utility import AttribAccessList
+import pytest
+
+from tests.tweepy_mastodon.test_utils import mastodon_status
+from tweepy_mastodon import API
+from tweepy_mastodon.cache import (
+    AccountCache, BoundedMemoryCache, FileCache, JSONSerializer, MemoryCache, MongodbCache,
+    MsgpackSerializer, PickleSerializer, RedisCache, ShardedMemoryCache, SQLiteCache
+)
+
+
+def test_account_cache():
+    cache = AccountCache(timeout=60, maxsize=2)
+    cache.store('https://a.example', {'id': 1, 'acct': 'Alice'})
+    cache.store('https://a.example', {'id': 2, 'acct': 'bob@b.example'})
+
+    assert cache.get('https://a.example', 1).acct == 'Alice'
+    assert cache.get('https://a.example', '1').acct == 'Alice'
+    assert cache.get_by_acct('https://a.example', 'alice').id == 1
+    assert cache.get('https://b.example', 1) is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # 2 is the least recently used account
+    cache.store('https://a.example', {'id': 3, 'acct': 'carol'})
+    assert cache.count() == 2
+    assert cache.get('https://a.example', 2) is None
+    assert cache.get_by_acct('https://a.example', 'bob@b.example') is None
+
+    cache.invalidate('https://a.example', 1)
+    assert cache.get('https://a.example', 1) is None
+    assert cache.get_by_acct('https://a.example', 'alice') is None
+
+
+def test_account_cache_expiry(mocker):
+    cache = AccountCache(timeout=60)
+    cache.store('https://a.example', {'id': 1, 'acct': 'alice'})
+    mocker.patch('time.time', return_value=time.time() + 60)
+    assert cache.get('https://a.example', 1) is None
+    assert cache.count() == 0
+
+
+def test_bounded_memory_cache(mocker):
+    now = time.time()
+    mocker.patch('time.time', return_value=now)
+    cache = BoundedMemoryCache(timeout=60, maxsize=2)
+    cache.store('a', 1)
+    cache.store('b', 2)
+    assert cache.get('a') == 1
+    # b is the least recently used entry
+    cache.store('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    mocker.patch('time.time', return_value=now + 30)
+    cache.store('a', 4)
+    mocker.patch('time.time', return_value=now + 60)
+    cache.cleanup()
+    assert cache.count() == 1
+    assert cache.get('a') == 4
+    assert cache.stats() == {
+        'hits': 4, 'misses': 1, 'evictions': 1, 'expirations': 1, 'count': 1, 'bytes': 0,
+    }
+
+
+def test_bounded_memory_cache_read_timeout(mocker):
+    now = time.time()
+    mocker.patch('time.time', return_value=now)
+    cache = BoundedMemoryCache(timeout=1)
+    cache.store('a', 1)
+
+    # Storing other entries does not expire those a longer timeout still reads
+    mocker.patch('time.time', return_value=now + 1.2)
+    cache.store('b', 2)
+    assert cache.get('a', timeout=60) == 1
+    assert cache.get('a', timeout=0) == 1
+    assert cache.get('a') is None
+
+    # Entries are kept for the timeout they are stored with
+    cache.store('c', 3, timeout=60)
+    mocker.patch('time.time', return_value=now + 30)
+    cache.cleanup()
+    assert cache.get('c', timeout=60) == 3
+    assert cache.count() == 1
+
+
+def test_bounded_memory_cache_max_bytes():
+    cache = BoundedMemoryCache(maxsize=100, max_bytes=2500)
+    for key in range(3):
+        cache.store(key, 'x' * 1000)
+    assert cache.count() == 2
+    assert cache.get(0) is None
+    assert cache.stats()['bytes'] <= 2500
+
+
+def test_sharded_memory_cache(mocker):
+    cache = ShardedMemoryCache(timeout=60, shards=4)
+
+    def store(thread):
+        for i in range(100):
+            cache.store(f'{thread}-{i}', i)
+    threads = [threading.Thread(target=store, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.count() == 800
+    assert cache.get('7-99') == 99
+    assert cache.get('7-99', timeout=0) == 99
+
+    mocker.patch('time.time', return_value=time.time() + 60)
+    assert cache.get('7-99') is None
+    assert cache.count() == 799
+    cache.cleanup()
+    assert cache.count() == 0
+
+
+def test_file_cache(mocker, tmp_path):
+    now = time.time()
+    mocker.patch('time.time', return_value=now)
+    cache = FileCache(str(tmp_path), timeout=60, max_size=2500)
+    for key in range(3):
+        mocker.patch('time.time', return_value=now + key)
+        cache.store(f'key{key}', 'x' * 1000)
+    assert cache.get('key0') == 'x' * 1000
+    assert cache.count() == 3
+    # Every entry is stored in a subdirectory, without leftover temporary files
+    assert all(len(path.parent.name) == 2 for path in tmp_path.glob('*/*'))
+    assert not list(tmp_path.glob('*/*.tmp'))
+
+    # The oldest entry is evicted to fit in max_size
+    cache.cleanup()
+    assert cache.count() == 2
+    assert cache.get('key0') is None
+
+    mocker.patch('time.time', return_value=now + 62)
+    assert cache.get('key1') is None
+    assert cache.get('key2', timeout=0) == 'x' * 1000
+    cache.cleanup()
+    assert cache.count() == 0
+
+    cache.store('key', {'id': 1})
+    cache.flush()
+    assert cache.count() == 0
+
+
+def test_file_cache_legacy_files(tmp_path):
+    digest = hashlib.md5(b'key').hexdigest()
+    # Entries of the flat layout, and their lock files
+    (tmp_path / digest).write_bytes(pickle.dumps((time.time(), 'value')))
+    (tmp_path / f'{digest}.lock').touch()
+    (tmp_path / 'notes.txt').touch()
+    cache = FileCache(str(tmp_path))
+    cache.store('key', 'value')
+
+    cache.cleanup()
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_file()) == ['notes.txt']
+    assert cache.get('key') == 'value'
+
+    (tmp_path / digest).touch()
+    cache.flush()
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_file()) == ['notes.txt']
+
+
+def test_sqlite_cache(mocker, tmp_path):
+    now = time.time()
+    mocker.patch('time.time', return_value=now)
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), timeout=60)
+    cache.store('a', {'id': 1})
+    cache.store('a', {'id': 2})
+    cache.store('b', [1, 2])
+    assert cache.get('a') == {'id': 2}
+    assert cache.get('c') is None
+    assert cache.count() == 2
+
+    # Other threads use their own connection to the same database
+    results = []
+    thread = threading.Thread(target=lambda: results.append(cache.get('b')))
+    thread.start()
+    thread.join()
+    assert results == [[1, 2]]
+
+    mocker.patch('time.time', return_value=now + 30)
+    cache.store('c', 3)
+    mocker.patch('time.time', return_value=now + 60)
+    assert cache.get('a') is None
+    assert cache.get('b', timeout=0) == [1, 2]
+    assert cache.count() == 2
+    cache.cleanup()
+    assert cache.count() == 1
+    assert cache.get('c') == 3
+
+    # The entries outlive the connection
+    cache.close()
+    assert SQLiteCache(cache.path).count() == 1
+    cache.flush()
+    assert cache.count() == 0
+
+
+@pytest.mark.parametrize('serializer_class', [JSONSerializer, MsgpackSerializer])
+def test_payload_serializers(serializer_class, mastodon_status):
+    if serializer_class is MsgpackSerializer:
+        pytest.importorskip('msgpack')
+    timeline = AttribAccessList([mastodon_status])
+    timeline._pagination_next = {'max_id': 109801812845135806, '_pagination_endpoint': '/api/v1/timelines/home'}
+    serializer = serializer_class()
+
+    page = serializer.loads(serializer.dumps(timeline))
+    assert isinstance(page, AttribAccessList)
+    assert page == timeline
+    assert page._pagination_next == timeline._pagination_next
+    assert page[0].account.acct == 'shuuji3'
+    assert page[0].created_at == mastodon_status.created_at
+    assert serializer.loads(serializer.dumps(mastodon_status)) == mastodon_status
+    entry = serializer.loads(serializer.dumps({'_cached_at': 1.5, '_payload': timeline}))
+    assert entry['_payload']._pagination_next == timeline._pagination_next
+
+
+def test_serializer_compression_and_format(tmp_path):
+    value = ['x' * 1000] * 10
+    compressed = JSONSerializer(compress_threshold=1024).dumps(value)
+    assert len(compressed) < len(JSONSerializer().dumps(value))
+    assert JSONSerializer().loads(compressed) == value
+
+    with pytest.raises(ValueError):
+        JSONSerializer().loads(PickleSerializer().dumps(value))
+    # Truncated values fail like values written in another format
+    for serializer in (PickleSerializer(), JSONSerializer(), JSONSerializer(compress_threshold=1024)):
+        with pytest.raises(ValueError):
+            serializer.loads(serializer.dumps(value)[:-10])
+
+    # Entries written in another format are cache misses
+    path = str(tmp_path / 'cache.db')
+    SQLiteCache(path).store('key', value)
+    cache = SQLiteCache(path, serializer=JSONSerializer())
+    assert cache.get('key') is None
+    assert cache.count() == 0
+
+    cache = SQLiteCache(path)
+    cache.store('key', value)
+    # Truncated entries are cache misses, and deleted
+    with cache._connection() as connection:
+        connection.execute('UPDATE entries SET value = substr(value, 1, 20)')
+    assert cache.get('key') is None
+    assert cache.count() == 0
+
+
+def test_redis_cache(mocker):
+    client = mocker.Mock()
+    cache = RedisCache(client, timeout=60, serializer=JSONSerializer(), scan_count=2)
+    cache.store_many([('a', {'id': 1}), ('b', [2])])
+    pipe = client.pipeline.return_value
+    assert pipe.set.call_args_list == [call('tweepy:a', ANY, px=60000), call('tweepy:b', ANY, px=60000)]
+    pipe.execute.assert_called_once_with()
+
+    stored = {args[0]: args[1] for args, _ in pipe.set.call_args_list}
+    client.mget.return_value = [stored['tweepy:a'], None, stored['tweepy:b']]
+    assert cache.get_many(['a', 'c', 'b']) == [{'id': 1}, None, [2]]
+    client.mget.assert_called_once_with(['tweepy:a', 'tweepy:c', 'tweepy:b'])
+
+    # Entries written in another format are deleted
+    client.get.return_value = b'garbage'
+    assert cache.get('d') is None
+    client.unlink.assert_called_once_with('tweepy:d')
+
+    client.unlink.reset_mock()
+    client.scan_iter.return_value = iter(['tweepy:a', 'tweepy:b', 'tweepy:c'])
+    assert cache.count() == 3
+    client.scan_iter.return_value = iter(['tweepy:a', 'tweepy:b', 'tweepy:c'])
+    cache.flush()
+    client.scan_iter.assert_called_with(match='tweepy:*', count=2)
+    assert client.unlink.call_args_list == [
+        call('tweepy:a', 'tweepy:b'), call('tweepy:c'), call('tweepy:keys')
+    ]
+
+
+def test_mongodb_cache(mocker):
+    pytest.importorskip('pymongo')
+    mongomock = pytest.importorskip('mongomock')
+    now = time.time()
+    mocker.patch('time.time', return_value=now)
+    cache = MongodbCache(mongomock.MongoClient().db, timeout=60)
+    cache.store('a', {'id': 1})
+    cache.store('a', {'id': 2})
+    cache.store_many([('b', [1, 2]), ('c', 3)])
+    assert cache.get('a') == {'id': 2}
+    assert cache.get_many(['c', 'd', 'b']) == [3, None, [1, 2]]
+    assert cache.count() == 3
+
+    # Expired entries are misses before MongoDB deletes them
+    mocker.patch('time.time', return_value=now + 60)
+    assert cache.get('a') is None
+    assert cache.get('a', timeout=0) == {'id': 2}
+    assert cache.count() == 0
+    cache.cleanup()
+    assert cache.get('a', timeout=0) is None
+
+    cache.store('a', 1)
+    cache.delete_entry('a')
+    assert cache.get('a') is None
+    cache.store('a', 1)
+    cache.flush()
+    assert cache.count() == 0
+
+    # Entries are kept for the timeout they are stored with
+    cache.store('a', 1, timeout=120)
+    mocker.patch('time.time', return_value=now + 120)
+    cache.cleanup()
+    assert cache.get('a', timeout=120) == 1
+    assert cache.count() == 1
+    mocker.patch('time.time', return_value=now + 180)
+    cache.cleanup()
+    assert cache.get('a', timeout=0) is None
+
+
+def test_mongodb_cache_indexes():
+    pytest.importorskip('pymongo')
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+
+    # The TTL index of previous versions is replaced, along with its entries
+    db.tweepy_cache.create_index('created', expireAfterSeconds=60)
+    db.tweepy_cache.insert_one({'_id': 'a', 'created': MongodbCache._now(), 'value': b''})
+    cache = MongodbCache(db, timeout=60)
+    indexes = db.tweepy_cache.index_information()
+    assert 'created_1' not in indexes
+    assert indexes['expires_1']['expireAfterSeconds'] == 0
+    assert cache.get('a', timeout=0) is None
+
+    # An index without TTL is replaced as well
+    db.tweepy_cache.drop_indexes()
+    db.tweepy_cache.create_index('expires')
+    MongodbCache(db, timeout=120)
+    assert db.tweepy_cache.index_information()['expires_1']['expireAfterSeconds'] == 0
+    # The timeout can be changed
+    cache = MongodbCache(db, timeout=30)
+    cache.store('b', 1)
+    assert cache.get('b') == 1
+
+
+def test_api_cached_reads(mocker, tmp_path, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    timeline = AttribAccessList([mastodon_status])
+    timeline._pagination_next = {'max_id': 1}
+
+    auth = mocker.Mock(client_id='id', client_secret='secret', access_token='token',
+                       api_base_url='https://mastodon.example')
+    mastodon = mocker.patch('tweepy_mastodon.api.Mastodon').return_value
+    mastodon.api_base_url = 'https://mastodon.example'
+    mastodon.timeline_home.return_value = timeline
+    mastodon.status.side_effect = lambda id: copy.deepcopy(mastodon_status)
+    api = API(auth, cache=FileCache(str(tmp_path)), cache_timeouts={'get_status': 0})
+
+    first = api.home_timeline(count=10)
+    assert not api.cached_result
+    second = api.home_timeline(count=10, max_id=None)
+    assert api.cached_result
+    assert second[0].user.screen_name == first[0].user.screen_name
+    assert second.max_id == 1
+    mastodon.timeline_home.assert_called_once_with(limit=10, since_id=None, max_id=None, min_id=None)
+
+    # A timeout of 0 never expires
+    api.get_status('109801812845135807')
+    api.get_status(109801812845135807)
+    assert api.cached_result
+    mastodon.status.assert_called_once_with(id='109801812845135807')
+
+
+def test_api_stale_and_not_found(mocker, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    edited_status = copy.deepcopy(mastodon_status)
+    edited_status['content'] = '<p>Edited</p>'
+    now = time.time()
+    mocker.patch('time.time', return_value=now)
+
+    auth = mocker.Mock(client_id='id', client_secret='secret', access_token='token',
+                       api_base_url='https://mastodon.example')
+    mastodon = mocker.patch('tweepy_mastodon.api.Mastodon').return_value
+    mastodon.api_base_url = 'https://mastodon.example'
+    mastodon.status.side_effect = lambda id: copy.deepcopy(mastodon_status)
+    api = API(auth, cache=MemoryCache(timeout=60), stale_timeouts={'get_status': 60})
+    api.get_status(1)
+
+    # A stale status is returned while it is refreshed in the background
+    mocker.patch('time.time', return_value=now + 90)
+    mastodon.status.side_effect = lambda id: copy.deepcopy(edited_status)
+    assert api.get_status(1).text == mastodon_status['content']
+    assert api.cached_result
+    api._refresh_executor.shutdown(wait=True)
+    assert api.get_status(1).text == '<p>Edited</p>'
+    assert api.cached_result
+    assert mastodon.status.call_count == 2
+
+    mastodon.status.side_effect = MastodonNotFoundError('Mastodon API returned error', 404, 'Not Found', None)
+    for _ in range(2):
+        with pytest.raises(MastodonNotFoundError):
+            api.get_status(2)
+    assert api.cached_result
+    assert mastodon.status.call_count == 3
+
+    mocker.patch('time.time', return_value=now + 120)
+    with pytest.raises(MastodonNotFoundError):
+        api.get_status(2)
+    assert not api.cached_result
+    assert mastodon.status.call_count == 4
+
+
+def test_api_stale_timeouts_native_expiry(mocker, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    auth = mocker.Mock(client_id='id', client_secret='secret', access_token='token',
+                       api_base_url='https://mastodon.example')
+    mastodon = mocker.patch('tweepy_mastodon.api.Mastodon').return_value
+    mastodon.api_base_url = 'https://mastodon.example'
+    mastodon.status.side_effect = lambda id: copy.deepcopy(mastodon_status)
+    client = mocker.Mock()
+    client.get.return_value = None
+    api = API(auth, cache=RedisCache(client, timeout=60), stale_timeouts={'get_status': 60},
+              not_found_timeouts={'get_user': 300})
+
+    # Redis keeps the entries through the stale and not found windows
+    api.get_status(1)
+    client.set.assert_called_once_with(ANY, ANY, px=120000)
+    client.set.reset_mock()
+    mastodon.account.side_effect = MastodonNotFoundError('Mastodon API returned error', 404, 'Not Found', None)
+    with pytest.raises(Exception, match='404'):
+        api.get_user(user_id=404)
+    client.set.assert_called_once_with(ANY, ANY, px=300000)
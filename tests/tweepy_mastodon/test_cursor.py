@@ -0,0 +1,116 @@
+from tweepy_mastodon import Cursor, Paginator
+from tweepy_mastodon.cursor import IdIterator
+from tweepy_mastodon.models import ResultSet
+
+
+def id_paginated(pages):
+    calls = []
+
+    def method(max_id=None, **kwargs):
+        calls.append(max_id)
+        return pages[len(calls) - 1] if len(calls) <= len(pages) else []
+
+    method.calls = calls
+    method.pagination_mode = 'id'
+    return method
+
+
+def test_id_iterator_single_parse():
+    first, second = ResultSet(), ResultSet()
+    first.extend([type('Status', (), {'id': 30})(), type('Status', (), {'id': 20})()])
+    second.extend([type('Status', (), {'id': 10})()])
+    method = id_paginated([first, second])
+
+    items = list(Cursor(method).items())
+
+    assert [item.id for item in items] == [30, 20, 10]
+    assert method.calls == [None, 19, 9]
+
+
+def test_id_iterator_bounded_history(mocker):
+    mocker.patch.object(IdIterator, 'history_size', 2)
+    method = id_paginated([[{'id': 40}], [{'id': 30}], [{'id': '20'}], '[{"id": 10}]'])
+
+    iterator = Cursor(method).pages()
+    pages = [next(iterator) for _ in range(4)]
+
+    assert method.calls == [None, 39, 29, 19]
+    assert list(iterator.results) == pages[2:]
+    assert iterator.prev() == [{'id': '20'}]
+
+
+def link_paginated(pages):
+    """Paginate like a Mastodon timeline, linking each page to its neighbours."""
+    calls = []
+
+    def method(max_id=None, min_id=None, **kwargs):
+        calls.append({'max_id': max_id, 'min_id': min_id, **kwargs})
+        if min_id is not None:
+            index = next(i for i, page in enumerate(pages) if page[-1] == min_id + 1)
+        elif max_id is not None:
+            index = next(i for i, page in enumerate(pages) if page[0] == max_id - 1)
+        else:
+            index = 0
+        page = ResultSet()
+        page.extend(pages[index])
+        if index + 1 < len(pages):
+            page._pagination_next = {'max_id': page[-1], '_pagination_endpoint': '/'}
+        if index > 0:
+            page._pagination_prev = {'min_id': page[0], '_pagination_endpoint': '/'}
+        return page
+
+    method.calls = calls
+    method.pagination_mode = 'link'
+    return method
+
+
+def test_link_iterator():
+    method = link_paginated([[30, 29], [28, 27], [26]])
+
+    iterator = Cursor(method, limit=2).pages()
+    assert [next(iterator) for _ in range(3)] == [[30, 29], [28, 27], [26]]
+    assert iterator.prev() == [28, 27]
+    assert method.calls == [
+        {'max_id': None, 'min_id': None, 'limit': 2},
+        {'max_id': 29, 'min_id': None, 'limit': 2},
+        {'max_id': 27, 'min_id': None, 'limit': 2},
+        {'max_id': None, 'min_id': 26, 'limit': 2},
+    ]
+
+
+def test_link_iterator_prefetch():
+    method = link_paginated([[30, 29], [28, 27], [26]])
+
+    pages = Cursor(method, prefetch=True).pages(2)
+    assert next(pages) == [30, 29]
+    pages.pending.result()
+    assert len(method.calls) == 2
+    assert next(pages) == [28, 27]
+    # The limit is reached, so nothing more is prefetched
+    assert pages.pending is None
+    assert list(pages) == []
+    assert len(method.calls) == 2
+
+
+def test_link_iterator_prefetch_stopped_early():
+    method = link_paginated([[30, 29], [28, 27], [26]])
+
+    # The prefetching stops once the item limit is reached
+    cursor = Cursor(method, prefetch=True)
+    assert list(cursor.items(3)) == [30, 29, 28]
+    assert cursor.iterator.pending is None
+    assert cursor.iterator.executor is None
+
+    pages = Cursor(method, prefetch=True).pages()
+    next(pages)
+    executor = pages.executor
+    pages.close()
+    assert pages.pending is None
+    assert executor._shutdown
+
+
+def test_paginator_link():
+    method = link_paginated([[30, 29], [28, 27], [26]])
+
+    assert list(Paginator(method).flatten()) == [30, 29, 28, 27, 26]
+    assert [call['max_id'] for call in method.calls] == [None, 29, 27]
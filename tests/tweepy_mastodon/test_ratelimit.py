@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+
+from tweepy_mastodon import API
+from tweepy_mastodon.errors import TweepyException
+from tweepy_mastodon.ratelimit import RateLimitScheduler, endpoint_family
+
+
+def reset_header(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def test_endpoint_family():
+    assert endpoint_family('GET', '/api/v1/timelines/home') == 'api'
+    assert endpoint_family('POST', '/api/v2/media') == 'media'
+    assert endpoint_family('DELETE', '/api/v1/statuses/1') == 'statuses_delete'
+
+
+def test_scheduler_paces_requests(mocker):
+    now = 1_700_000_000
+    mocker.patch('time.time', return_value=now)
+    scheduler = RateLimitScheduler(limit=2, period=10)
+    key = scheduler.request_key('GET', 'https://a.example/api/v1/timelines/home', 'Bearer token')
+    assert key == scheduler.key('https://a.example', 'token')
+    assert key != scheduler.key('https://a.example', 'other token')
+
+    # Before any response, the bucket refills at limit / period
+    assert [scheduler.reserve(key) for _ in range(3)] == [0, 0, 5]
+
+    # Then the budget follows the server's window
+    scheduler.update(key, {
+        'X-RateLimit-Limit': '300',
+        'X-RateLimit-Remaining': '1',
+        'X-RateLimit-Reset': reset_header(now + 60),
+    })
+    assert tuple(scheduler.budget(key)) == (300, 1, now + 60)
+    assert scheduler.reserve(key) == 0
+    assert scheduler.reserve(key) == 60
+
+    mocker.patch('time.time', return_value=now + 60)
+    assert scheduler.budget(key).remaining == 299
+
+
+def test_scheduler_ignores_responses_without_headers():
+    scheduler = RateLimitScheduler(limit=5)
+    key = scheduler.key('https://a.example')
+    scheduler.update(key, {})
+    assert tuple(scheduler.budget(key)) == (5, 5, None)
+
+
+def test_api_rate_limit_budget(mocker):
+    auth = mocker.Mock(client_id='id', client_secret='secret', access_token='token',
+                       api_base_url='https://a.example')
+    mastodon = mocker.patch('tweepy_mastodon.api.Mastodon').return_value
+    mastodon.api_base_url = 'https://a.example'
+
+    api = API(auth, rate_limit_scheduler=RateLimitScheduler(limit=5))
+    assert tuple(api.rate_limit_budget()) == (5, 5, None)
+
+    api = API(auth, rate_limit_scheduler=None)
+    with pytest.raises(TweepyException, match='rate_limit_scheduler'):
+        api.rate_limit_budget()
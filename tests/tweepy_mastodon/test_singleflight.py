@@ -0,0 +1,132 @@
+import asyncio
+import copy
+import threading
+import time
+
+import pytest
+
+from tests.tweepy_mastodon.test_utils import mastodon_status
+from tweepy_mastodon import API
+from tweepy_mastodon.asynchronous import AsyncAPI
+from tweepy_mastodon.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch(value):
+        calls.append(value)
+        release.wait()
+        return {'value': value}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(single_flight.do('key', fetch, 1)))
+        for _ in range(5)
+    ]
+    threads[0].start()
+    wait_until(lambda: calls)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: single_flight.coalesced == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [({'value': 1}, True)] * 5
+    assert single_flight.stats() == {'calls': 5, 'coalesced': 4, 'in_flight': 0}
+
+    # Calls are made again once the previous one returned
+    assert single_flight.do('key', fetch, 2) == ({'value': 2}, False)
+
+
+def test_single_flight_error():
+    single_flight = SingleFlight()
+
+    def fetch():
+        raise ValueError('not found')
+
+    with pytest.raises(ValueError):
+        single_flight.do('key', fetch)
+    assert single_flight.stats()['in_flight'] == 0
+
+
+def test_async_single_flight():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return {'value': value}
+
+    async def main():
+        return await asyncio.gather(
+            single_flight.do('a', fetch, 1), single_flight.do('a', fetch, 1), single_flight.do('b', fetch, 2)
+        )
+
+    assert asyncio.run(main()) == [({'value': 1}, True), ({'value': 1}, True), ({'value': 2}, False)]
+    assert calls == [1, 2]
+    assert single_flight.stats() == {'calls': 3, 'coalesced': 1, 'in_flight': 0}
+
+
+def test_api_single_flight(mocker, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    release = threading.Event()
+
+    def status(id):
+        release.wait()
+        return copy.deepcopy(mastodon_status)
+
+    auth = mocker.Mock(client_id='id', client_secret='secret', access_token='token',
+                       api_base_url='https://mastodon.example')
+    mastodon = mocker.patch('tweepy_mastodon.api.Mastodon').return_value
+    mastodon.api_base_url = 'https://mastodon.example'
+    mastodon.status.side_effect = status
+    api = API(auth, single_flight=SingleFlight())
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(api.get_status(mastodon_status.id)))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: api.single_flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    mastodon.status.assert_called_once_with(id=mastodon_status.id)
+    assert [status.user.screen_name for status in results] == ['shuuji3'] * 3
+    # Every caller gets its own copy
+    assert len({id(status) for status in results}) == 3
+
+
+def test_async_api_single_flight(mocker, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+
+    async def request(method, endpoint, *, params=None, data=None):
+        await asyncio.sleep(0.01)
+        return copy.deepcopy(mastodon_status), None
+
+    api = AsyncAPI(mocker.Mock(api_base_url='https://async.example'))
+    _request = mocker.patch.object(api, '_request', side_effect=request)
+
+    async def main():
+        return await asyncio.gather(*(api.get_status(mastodon_status.id) for _ in range(3)))
+
+    statuses = asyncio.run(main())
+    _request.assert_called_once_with('GET', f'/api/v1/statuses/{mastodon_status.id}', params=None)
+    assert [status.id for status in statuses] == [mastodon_status.id] * 3
+    assert api.single_flight.stats() == {'calls': 3, 'coalesced': 2, 'in_flight': 0}
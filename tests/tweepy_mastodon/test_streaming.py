@@ -0,0 +1,456 @@
+import asyncio
+import copy
+import json
+import threading
+
+from aiohttp import web
+from mastodon.utility import AttribAccessList
+import pytest
+
+from tests.tweepy_mastodon.test_utils import mastodon_status, mastodon_user
+from tweepy_mastodon import Stream
+from tweepy_mastodon.asynchronous import AsyncMultiplexStream, AsyncStream
+from tweepy_mastodon.asynchronous.streaming import AsyncBaseStream
+from tweepy_mastodon.errors import TweepyException
+from tweepy_mastodon.streaming import (
+    MultiplexStream, _apply_json_hooks, _json_loads, _LineSplitter, _stream_key, _StreamPositions,
+    _subscription_key, _subscription_message
+)
+
+
+class RecordingMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.received = []
+
+    def on_status(self, status):
+        self.received.append(('status', status))
+
+    def on_delete(self, status_id):
+        self.received.append(('delete', status_id))
+
+    def on_notification(self, notification):
+        self.received.append(('notification', notification))
+
+    def on_keep_alive(self):
+        self.received.append(('keep_alive', None))
+
+
+class RecordingStream(RecordingMixin, Stream):
+    pass
+
+
+class RecordingMultiplexStream(RecordingMixin, MultiplexStream):
+    pass
+
+
+@pytest.fixture
+def stream(mocker):
+    stream = RecordingStream('id', 'secret', 'token', api_base_url='mastodon.example/')
+    stream._mastodon = mocker.Mock()
+    return stream
+
+
+def feed(stream, text):
+    for line in text.split('\n'):
+        stream._process_line(line.encode('utf-8'))
+
+
+def test_stream_requires_api_base_url():
+    with pytest.raises(Exception, match='api_base_url'):
+        Stream('id', 'secret', 'token')
+
+
+def test_stream_events(stream, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    payload = json.dumps(mastodon_status, default=lambda value: value.isoformat())
+
+    feed(stream, ':)\n'
+                 f'event: update\ndata: {payload}\n\n'
+                 'event: delete\ndata: 109831593512598806\n\n'
+                 'event: notification\ndata: {"id": "42", "type": "follow"}\n\n'
+                 'event: filters_changed\n\n')
+
+    assert [kind for kind, _ in stream.received] == ['keep_alive', 'status', 'delete', 'notification']
+    status = stream.received[1][1]
+    assert status.id == mastodon_status['id']
+    assert status.user.screen_name == 'shuuji3'
+    assert status.created_at == mastodon_status['created_at']
+    assert stream.received[2][1] == 109831593512598806
+    assert stream.received[3][1].id == 42
+
+
+def test_line_splitter():
+    lines = _LineSplitter()
+    chunks = [b'event: upd', b'ate\r\ndata: {"id"', b': "1"}\n', b'\n:', b')\n']
+    assert [bytes(line) for chunk in chunks for line in lines.feed(chunk)] == [
+        b'event: update', b'data: {"id": "1"}', b'', b':)'
+    ]
+    assert lines.pending == b''
+
+
+def test_stream_raw(mocker, mastodon_status):
+    stream = RecordingStream('id', 'secret', 'token', api_base_url='mastodon.example/', raw=True)
+    stream._mastodon = mocker.Mock()
+    payload = json.dumps(mastodon_status, default=lambda value: value.isoformat())
+
+    feed(stream, f'event: update\ndata: {payload}\n\n'
+                 'event: delete\ndata: 109831593512598806\n\n')
+
+    status = stream.received[0][1]
+    assert type(status) is dict
+    assert status['id'] == mastodon_status['id']
+    assert stream.received[1] == ('delete', '109831593512598806')
+    stream._mastodon.account.assert_not_called()
+
+
+def test_json_hooks(mastodon_status):
+    orjson = pytest.importorskip('orjson')
+    payload = json.dumps(mastodon_status, default=lambda value: value.isoformat())
+    assert _apply_json_hooks(orjson.loads(payload)) == _json_loads(payload)
+
+
+def test_stream_endpoints(mocker, stream):
+    stream.streaming_base_url = 'https://streaming.mastodon.example'
+    request = mocker.patch.object(stream.session, 'request')
+    request.return_value.__enter__.return_value.status_code = 200
+    mocker.patch.object(stream, 'on_connect', side_effect=stream.disconnect)
+
+    stream.hashtag('#python', local=True)
+    method, url = request.call_args.args
+    assert (method, url) == ('GET', 'https://streaming.mastodon.example/api/v1/streaming/hashtag/local')
+    assert request.call_args.kwargs['params'] == {'tag': 'python'}
+    assert stream.session.headers['Authorization'] == 'Bearer token'
+
+    stream.filter()
+    assert request.call_args.args[1].endswith('/api/v1/streaming/public')
+    with pytest.raises(TweepyException):
+        stream.filter(track=['python', 'rust'])
+
+
+def test_subscription_key():
+    assert _subscription_key('hashtag', '#Python') == ('hashtag', 'python')
+    assert _subscription_key('list', 12) == ('list', '12')
+    assert _subscription_key('user') == ('user',)
+    assert json.loads(_subscription_message('subscribe', ('list', '12'))) == {
+        'type': 'subscribe', 'stream': 'list', 'list': '12'
+    }
+    with pytest.raises(TweepyException):
+        _subscription_key('hashtag')
+
+
+async def serve_streaming(received, events):
+    """Serve a WebSocket streaming API which sends `events` once the client
+    subscribed to two streams, and records the messages it receives."""
+    async def streaming(request):
+        received.append(request.headers['Authorization'])
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            received.append(json.loads(message.data))
+            if len(received) == 3:
+                for event in events:
+                    await ws.send_json(event)
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/api/v1/streaming', streaming)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+def streaming_events(mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    payload = json.dumps(mastodon_status, default=lambda value: value.isoformat())
+    return [
+        {'stream': ['hashtag', 'Python'], 'event': 'update', 'payload': payload},
+        {'error': 'Unknown stream type', 'status': 400},
+        {'stream': ['user'], 'event': 'delete', 'payload': '109831593512598806'},
+    ]
+
+
+def test_multiplex_stream(mocker, mastodon_status):
+    pytest.importorskip('websocket')
+    received = []
+    events = []
+    loop = asyncio.new_event_loop()
+    runner, port = loop.run_until_complete(serve_streaming(received, streaming_events(mastodon_status)))
+    server = threading.Thread(target=loop.run_forever, daemon=True)
+    server.start()
+
+    stream = RecordingMultiplexStream('id', 'secret', 'token', api_base_url='mastodon.example',
+                                      streaming_base_url=f'http://127.0.0.1:{port}')
+    stream._mastodon = mocker.Mock()
+
+    def on_hashtag(event, status):
+        events.append((event, status))
+
+    def on_delete(status_id):
+        events.append(('delete', status_id))
+        stream.unsubscribe('hashtag', tag='python')
+        stream.disconnect()
+
+    stream.on_delete = on_delete
+    stream.subscribe('hashtag', tag='#Python', handler=on_hashtag)
+    stream.subscribe('user')
+    stream.connect(threaded=True).join(5)
+
+    assert not stream.running
+    assert received[:3] == [
+        'Bearer token',
+        {'type': 'subscribe', 'stream': 'hashtag', 'tag': 'python'},
+        {'type': 'subscribe', 'stream': 'user'},
+    ]
+    assert events[0][0] == 'update'
+    assert events[0][1].user.screen_name == 'shuuji3'
+    assert events[1] == ('delete', 109831593512598806)
+    assert stream.subscriptions == {('user',): None}
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_async_multiplex_stream(mastodon_status):
+    events = []
+
+    class RecordingAsyncStream(AsyncMultiplexStream):
+
+        async def on_delete(self, status_id):
+            events.append(('delete', status_id))
+            await self.unsubscribe('hashtag', tag='python')
+            self.disconnect()
+
+    async def main():
+        received = []
+        runner, port = await serve_streaming(received, streaming_events(mastodon_status))
+
+        async def on_hashtag(event, status):
+            events.append((event, status))
+
+        stream = RecordingAsyncStream('id', 'secret', 'token', api_base_url='mastodon.example',
+                                      streaming_base_url=f'http://127.0.0.1:{port}')
+        await stream.subscribe('hashtag', tag='#Python', handler=on_hashtag)
+        await stream.subscribe('user')
+        await asyncio.wait_for(stream.connect(), 5)
+        await runner.cleanup()
+        return received, stream
+
+    received, stream = asyncio.run(main())
+    assert received[:3] == [
+        'Bearer token',
+        {'type': 'subscribe', 'stream': 'hashtag', 'tag': 'python'},
+        {'type': 'subscribe', 'stream': 'user'},
+    ]
+    assert events[0][0] == 'update'
+    assert events[0][1].user.screen_name == 'shuuji3'
+    assert events[1] == ('delete', 109831593512598806)
+    assert stream.subscriptions == {('user',): None}
+
+
+def test_async_stream(mocker, mastodon_status):
+    mastodon_status['in_reply_to_account_id'] = None
+    payload = json.dumps(mastodon_status, default=lambda value: value.isoformat())
+    events = []
+    done = None
+
+    class RecordingAsyncStream(AsyncStream):
+
+        async def on_status(self, status):
+            # Slower than reading the stream
+            await asyncio.sleep(0.01)
+            events.append(('status', status))
+
+        async def on_delete(self, status_id):
+            events.append(('delete', status_id))
+            self.disconnect()
+            done.set()
+
+    async def streaming(request):
+        assert request.headers['Authorization'] == 'Bearer token'
+        assert request.query['tag'] == 'python'
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await response.write(f':)\n\nevent: update\ndata: {payload}\n\nevent: delete\ndata: 1\n\n'.encode())
+        await done.wait()
+        return response
+
+    async def main():
+        nonlocal done
+        done = asyncio.Event()
+        app = web.Application()
+        app.router.add_get('/api/v1/streaming/hashtag', streaming)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+
+        stream = RecordingAsyncStream('id', 'secret', 'token', api_base_url='mastodon.example',
+                                      streaming_base_url=f'http://127.0.0.1:{runner.addresses[0][1]}',
+                                      handlers=2)
+        await asyncio.wait_for(stream.filter(track=['#python']), 5)
+        await runner.cleanup()
+        return stream
+
+    stream = asyncio.run(main())
+    # The deletion was handled while the status was still being converted
+    assert [kind for kind, _ in events] == ['delete']
+    assert stream.stats()['received'] == 2
+    # The stream is resumed from before the status left unhandled
+    assert stream.last_ids == {('hashtag', 'python'): mastodon_status['id'] - 1}
+
+    async def resume():
+        resumed = RecordingAsyncStream('id', 'secret', 'token', api_base_url='mastodon.example',
+                                       last_ids=stream.last_ids)
+        resumed._stream_key = stream._stream_key
+        resumed.api.request = mocker.AsyncMock(side_effect=[
+            (AttribAccessList([status_with_id(mastodon_status, mastodon_status['id'])]), None),
+            (AttribAccessList(), None),
+        ])
+        resumed._start_handlers()
+        await resumed._resume()
+        await resumed._stop_handlers()
+        return resumed
+
+    resumed = asyncio.run(resume())
+    assert [(kind, status.id) for kind, status in events[1:]] == [('status', mastodon_status['id'])]
+    assert resumed.last_ids == {('hashtag', 'python'): mastodon_status['id']}
+
+
+@pytest.mark.parametrize('overflow', ['drop_oldest', 'spill'])
+def test_async_stream_overflow(tmp_path, overflow):
+    handled = []
+    release = None
+
+    class SlowStream(AsyncBaseStream):
+
+        async def _handle(self, data):
+            await release.wait()
+            handled.append(data)
+
+    stream = SlowStream(queue_size=2, overflow=overflow, spill_directory=tmp_path)
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        stream._start_handlers()
+        await stream._enqueue(0)
+        # Let a handler take the first event
+        await asyncio.sleep(0)
+        for i in range(1, 6):
+            await stream._enqueue(i)
+        await asyncio.sleep(0)
+        stats = stream.stats()
+        release.set()
+        await stream._stop_handlers()
+        return stats
+
+    stats = asyncio.run(main())
+    if overflow == 'drop_oldest':
+        # The first event is being handled, the next ones made room for the last two
+        assert stats['dropped'] == 3
+        assert handled == [0, 4, 5]
+    else:
+        assert stats['spilled'] == 3
+        assert stats['queued'] == 5
+        assert handled == [0, 1, 2, 3, 4, 5]
+    assert stream.stats()['handled'] == len(handled)
+    assert stream.stats()['queued'] == 0
+
+
+def test_async_stream_overflow_policy():
+    with pytest.raises(TweepyException):
+        AsyncStream('id', 'secret', 'token', api_base_url='mastodon.example', overflow='drop')
+
+
+def status_with_id(mastodon_status, status_id):
+    status = copy.deepcopy(mastodon_status)
+    status['id'] = status_id
+    status['in_reply_to_account_id'] = None
+    return status
+
+
+def test_stream_resume(stream, mastodon_status):
+    stream._stream_key = _stream_key('hashtag', {'tag': 'Python'})
+    stream.last_ids[stream._stream_key] = 100
+    pages = [[status_with_id(mastodon_status, 102), status_with_id(mastodon_status, 101)], []]
+    stream.mastodon.timeline_hashtag.side_effect = pages
+    stream.running = True
+
+    stream._resume()
+    payload = json.dumps(status_with_id(mastodon_status, 102), default=lambda value: value.isoformat())
+    feed(stream, f'event: update\ndata: {payload}\n\n')
+    payload = json.dumps(status_with_id(mastodon_status, 103), default=lambda value: value.isoformat())
+    feed(stream, f'event: update\ndata: {payload}\n\n')
+
+    # The status received both from the timeline and live is only dispatched once
+    assert [status.id for _, status in stream.received] == [101, 102, 103]
+    assert [call.kwargs['min_id'] for call in stream.mastodon.timeline_hashtag.call_args_list] == [100, 102]
+    stream.mastodon.timeline_hashtag.assert_called_with('python', local=False, min_id=102, limit=40)
+    assert stream.last_ids == {('hashtag', 'python'): 103}
+
+
+def test_async_stream_resume(mocker, mastodon_status):
+    statuses = []
+
+    class RecordingAsyncStream(AsyncStream):
+
+        async def on_status(self, status):
+            statuses.append(status.id)
+
+    stream = RecordingAsyncStream('id', 'secret', 'token', api_base_url='mastodon.example',
+                                  last_ids={('list', '42'): 100}, queue_size=None)
+    stream._stream_key = _stream_key('list', {'list': 42})
+    pages = [AttribAccessList([status_with_id(mastodon_status, 102), status_with_id(mastodon_status, 101)]),
+             AttribAccessList()]
+    request = mocker.patch.object(stream.api, 'request', side_effect=[(page, None) for page in pages])
+
+    async def main():
+        await stream._resume()
+        payload = json.dumps(status_with_id(mastodon_status, 101), default=lambda value: value.isoformat())
+        for line in f'event: update\ndata: {payload}\n\n'.split('\n'):
+            await stream._process_line(line.encode())
+
+    asyncio.run(main())
+    assert statuses == [101, 102]
+    request.assert_called_with('GET', '/api/v1/timelines/list/42', params={'min_id': 102, 'limit': 40})
+    assert stream.last_ids == {('list', '42'): 102}
+
+
+def test_stream_positions():
+    positions = _StreamPositions({('user',): 100})
+    key = ('user',)
+    assert [positions.receive(key, status_id) for status_id in (101, 102, 103, 101)] == [True] * 3 + [False]
+
+    # The position only moves past the statuses handled and those before them
+    positions.complete(key, 102)
+    assert positions.last_ids[key] == 100
+    positions.complete(key, 101)
+    assert positions.last_ids[key] == 102
+
+    # An abandoned status holds the position back until it is received again
+    positions.abandon(key, 103)
+    assert positions.receive(key, 104)
+    positions.complete(key, 104)
+    assert positions.last_ids[key] == 102
+    assert positions.receive(key, 103)
+    positions.complete(key, 103)
+    assert positions.last_ids[key] == 104
+
+    # or given up
+    positions.receive(key, 105)
+    positions.abandon(key, 105)
+    positions.give_up(key)
+    assert positions.last_ids[key] == 104
+    positions.receive(key, 106)
+    positions.complete(key, 106)
+    assert positions.last_ids[key] == 106
+
+    # Without any position, resuming starts from the abandoned status
+    positions.receive(('list', '1'), 200)
+    positions.abandon(('list', '1'), 200)
+    assert positions.last_ids[('list', '1')] == 199
+
@@ -1,11 +1,17 @@
+import copy
 import datetime
+import pickle
 from dateutil.tz import tzutc
 
-from mastodon.utility import AttribAccessDict
+from mastodon import MastodonNotFoundError
+from mastodon.utility import AttribAccessDict, AttribAccessList
 import pytest
 
 from tests.tweepy_mastodon.test_api import mastodon_api
-from tweepy_mastodon.utils import convert_user, convert_status, convert_media
+from tweepy_mastodon.utils import (
+    convert_user, convert_status, convert_statuses, convert_media, fetch_accounts, fetch_statuses, lookup_accounts,
+    pagination_params
+)
 
 
 @pytest.fixture
@@ -406,3 +412,132 @@ def test_convert_status(mastodon_api, mastodon_status, twitter_status):
 def test_convert_media(mastodon_media, twitter_media):
     converted_media = convert_media(mastodon_media)
     assert set(converted_media.keys()).issuperset(set(twitter_media.keys()))
+
+
+def test_convert_statuses_batches_lookups(mocker, mastodon_status):
+    mastodon_api = mocker.Mock()
+    mastodon_api.verify_minimum_version.return_value = False
+    mastodon_api.account.return_value = AttribAccessDict({'id': 1, 'username': 'Gargron', 'acct': 'Gargron'})
+    mastodon_api.account_statuses.return_value = []
+
+    replies = []
+    for i in range(3):
+        reply = copy.deepcopy(mastodon_status)
+        reply['id'] += i
+        reply['in_reply_to_account_id'] = 1
+        replies.append(reply)
+    converted_statuses = convert_statuses(mastodon_api, [mastodon_status] + replies)
+
+    assert [status.in_reply_to_screen_name for status in converted_statuses] == ['shuuji3'] + ['Gargron'] * 3
+    mastodon_api.account.assert_called_once_with(1)
+    mastodon_api.account_statuses.assert_not_called()
+
+
+def test_convert_statuses_deleted_reply_target(mocker, mastodon_status):
+    mastodon_api = mocker.Mock()
+    mastodon_api.verify_minimum_version.return_value = False
+    mastodon_api.account.side_effect = lambda account_id: raise_not_found()
+    reply = copy.deepcopy(mastodon_status)
+    reply['in_reply_to_account_id'] = 404
+
+    converted_statuses = convert_statuses(mastodon_api, [reply], include_user_status=False)
+
+    assert converted_statuses[0].in_reply_to_screen_name is None
+    mastodon_api.account.assert_called_once_with(404)
+
+
+def test_convert_statuses_keeps_link_pagination(mocker, mastodon_status):
+    mastodon_statuses = AttribAccessList([mastodon_status])
+    mastodon_statuses._pagination_next = {'max_id': 100, 'limit': 20, '_pagination_endpoint': '/api/v1/timelines/home'}
+    mastodon_statuses._pagination_prev = {'min_id': 200, 'limit': 20, '_pagination_endpoint': '/api/v1/timelines/home'}
+
+    converted_statuses = convert_statuses(mocker.Mock(), mastodon_statuses)
+
+    assert converted_statuses.max_id == 100
+    assert pagination_params(converted_statuses, 'next') == {'max_id': 100}
+    assert pagination_params(converted_statuses, 'prev') == {'min_id': 200}
+    assert pagination_params(convert_statuses(mocker.Mock(), [mastodon_status])) is None
+
+
+def test_convert_statuses_loads_user_status_lazily(mocker, mastodon_status):
+    latest_status = copy.deepcopy(mastodon_status)
+    mastodon_api = mocker.Mock()
+    mastodon_api.account_statuses.return_value = [latest_status]
+
+    converted_statuses = convert_statuses(mastodon_api, [mastodon_status, copy.deepcopy(mastodon_status)])
+    mastodon_api.account_statuses.assert_not_called()
+
+    assert converted_statuses[0].user.status.id == latest_status['id']
+    assert converted_statuses[1].user.status.id == latest_status['id']
+    mastodon_api.account_statuses.assert_called_once_with(936436, limit=1)
+
+    mastodon_api.account_statuses.return_value = []
+    user = convert_user(mastodon_api, AttribAccessDict(mastodon_status['account']))
+    assert 'status' not in user
+    with pytest.raises(AttributeError):
+        user.status
+
+
+def test_lazy_account_copies_stay_lazy(mocker, mastodon_status):
+    mastodon_api = mocker.Mock()
+    mastodon_api.account_statuses.return_value = [copy.deepcopy(mastodon_status)]
+    user = convert_user(mastodon_api, AttribAccessDict(mastodon_status['account']))
+
+    pickled = pickle.loads(pickle.dumps(user))
+    copied = copy.copy(user)
+    deep_copied = copy.deepcopy(user)
+    mastodon_api.account_statuses.assert_not_called()
+
+    assert pickled.screen_name == user.screen_name
+    assert 'status' not in pickled
+    assert deep_copied.status.id == mastodon_status['id']
+    assert copied.status.id == mastodon_status['id']
+    # The original is still unloaded, and only loads its own status
+    assert dict.get(user, 'status') is not dict.get(deep_copied, 'status')
+
+
+def test_fetch_accounts_in_bulk(mocker):
+    mastodon_api = mocker.Mock()
+    mastodon_api.verify_minimum_version.return_value = True
+    mastodon_api._Mastodon__api_request.side_effect = lambda method, endpoint, params: [
+        AttribAccessDict({'id': account_id, 'acct': f'user{account_id}'}) for account_id in params['id[]'] if account_id > 0
+    ]
+
+    accounts = fetch_accounts(mastodon_api, [*range(-1, 50), 1, 2])
+
+    assert sorted(accounts) == list(range(1, 50))
+    assert mastodon_api._Mastodon__api_request.call_count == 2
+    mastodon_api.account.assert_not_called()
+
+    # Accounts fetched once are served from the account cache afterwards
+    assert sorted(fetch_accounts(mastodon_api, [1, 2, 3])) == [1, 2, 3]
+    assert mastodon_api._Mastodon__api_request.call_count == 2
+
+
+def test_fetch_statuses(mocker, mastodon_status):
+    mastodon_api = mocker.Mock()
+    mastodon_api.verify_minimum_version.return_value = False
+    mastodon_api.status.side_effect = lambda status_id: (
+        AttribAccessDict(mastodon_status, id=status_id) if status_id < 100 else raise_not_found()
+    )
+
+    statuses = fetch_statuses(mastodon_api, [1, 2, 1, 100])
+
+    assert list(statuses) == [1, 2]
+    assert mastodon_api.status.call_count == 3
+
+
+def test_lookup_accounts(mocker):
+    mastodon_api = mocker.Mock(api_base_url='https://lookup.example')
+    mastodon_api.account_lookup.side_effect = lambda acct: (
+        AttribAccessDict({'id': len(acct), 'acct': acct}) if acct != 'missing' else raise_not_found()
+    )
+
+    accounts = lookup_accounts(mastodon_api, ['alice', 'missing', 'alice'])
+
+    assert list(accounts) == ['alice']
+    assert mastodon_api.account_lookup.call_count == 2
+
+
+def raise_not_found():
+    raise MastodonNotFoundError('Record not found')
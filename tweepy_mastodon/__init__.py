@@ -15,7 +15,10 @@ from tweepy_mastodon.tweepy.auth import (
     AppAuthHandler, OAuthHandler, OAuth2AppHandler,
     OAuth2BearerHandler, OAuth2UserHandler
 )
-from tweepy_mastodon.cache import Cache, FileCache, MemoryCache
+from tweepy_mastodon.cache import (
+    AccountCache, BoundedMemoryCache, Cache, FileCache, MemoryCache,
+    ShardedMemoryCache, SQLiteCache
+)
 from tweepy_mastodon.client import Client, Response
 from tweepy_mastodon.cursor import Cursor
 from tweepy_mastodon.direct_message_event import DirectMessageEvent
@@ -27,10 +30,12 @@ from tweepy_mastodon.list import List
 from tweepy_mastodon.media import Media
 from tweepy_mastodon.pagination import Paginator
 from tweepy_mastodon.place import Place
+from tweepy_mastodon.ratelimit import RateLimitScheduler
 from tweepy_mastodon.poll import Poll
+from tweepy_mastodon.singleflight import SingleFlight
 from tweepy_mastodon.space import Space
 from tweepy_mastodon.streaming import (
-    Stream, StreamingClient, StreamResponse, StreamRule
+    MultiplexStream, Stream, StreamingClient, StreamResponse, StreamRule
 )
 from tweepy_mastodon.tweet import ReferencedTweet, Tweet
 from tweepy_mastodon.user import User
@@ -1,9 +1,21 @@
-import imghdr
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
+import hashlib
 import logging
-import mimetypes
-
-from tweepy_mastodon.utils import convert_user, convert_status, convert_media
-from tweepy_mastodon.tweepy.api import API as TweepyAPI
+import threading
+import time
+from urllib.parse import urlencode
+
+from tweepy_mastodon.cache import account_cache
+from tweepy_mastodon.errors import TweepyException
+from tweepy_mastodon.ratelimit import RateLimitAdapter, rate_limit_scheduler
+from tweepy_mastodon.singleflight import single_flight
+from tweepy_mastodon.utils import (
+    MAX_WORKERS, convert_user, convert_status, convert_statuses, convert_media, fetch_account, fetch_accounts,
+    fetch_statuses, guess_mime_type, lookup_account, lookup_accounts, normalize_id
+)
+from tweepy_mastodon.tweepy.api import API as TweepyAPI, pagination
 
 log = logging.getLogger(__name__)
 
@@ -22,7 +34,8 @@ class API(TweepyAPI):
     auth
         The authentication handler to be used
     cache
-        The cache to query if a GET method is used
+        The cache to query for the statuses and users read from Mastodon. See
+        ``cache_timeouts``.
     host
         The general REST API host server URL
     parser
@@ -42,6 +55,38 @@ class API(TweepyAPI):
         The URL of the upload server
     wait_on_rate_limit
         Whether or not to automatically wait for rate limits to replenish
+    pool_connections
+        The number of hosts to keep connection pools for
+    pool_maxsize
+        The maximum number of connections to keep open per host
+    pool_block
+        Whether or not to wait for a free connection instead of opening an
+        extra one when ``pool_maxsize`` connections to a host are in use
+    keep_alive
+        Whether or not to keep connections open between requests. The
+        Mastodon client shares the same session, so :meth:`close` or using
+        the API as a context manager releases its connections as well.
+    rate_limit_scheduler
+        The :class:`~tweepy_mastodon.ratelimit.RateLimitScheduler` pacing the
+        requests, shared by every API instance by default. ``None`` disables
+        pacing.
+    cache_timeouts
+        Number of seconds to cache the results of each method for, by method
+        name, overriding :attr:`CACHE_TIMEOUTS`. ``None`` uses the timeout of
+        the cache.
+    single_flight
+        The :class:`~tweepy_mastodon.singleflight.SingleFlight` coalescing
+        concurrent identical reads, so that they share one request, shared by
+        every API instance by default. ``None`` disables coalescing.
+    stale_timeouts
+        Number of seconds past their timeout during which the cached results
+        of each method are still returned, by method name, while they are
+        refreshed in the background. The cached results are kept this much
+        longer, and for the not found timeout, by the cache backends expiring
+        entries on their own. Off by default.
+    not_found_timeouts
+        Number of seconds to cache that a status or user could not be found
+        for, by method name, overriding :attr:`NOT_FOUND_TIMEOUTS`.
 
     Raises
     ------
@@ -53,30 +98,194 @@ class API(TweepyAPI):
     https://developer.twitter.com/en/docs/api-reference-index
     """
 
+    #: Default number of seconds the results of each method stay cached for.
+    #: Timelines change faster than statuses and profiles.
+    CACHE_TIMEOUTS = {
+        'home_timeline': 15,
+        'user_timeline': 15,
+        'get_status': 60,
+        'get_user': 60,
+        'verify_credentials': 60,
+    }
+
+    #: Default number of seconds a status or user stays cached as not found.
+    NOT_FOUND_TIMEOUTS = {
+        'get_status': 30,
+        'get_user': 30,
+    }
+
     def __init__(
             self, auth=None, *, cache=None, host='api.twitter.com', parser=None,
             proxy=None, retry_count=0, retry_delay=0, retry_errors=None,
             timeout=60, upload_host='upload.twitter.com', user_agent=None,
-            wait_on_rate_limit=False
+            wait_on_rate_limit=False, pool_connections=10, pool_maxsize=10, pool_block=False,
+            keep_alive=True, rate_limit_scheduler=rate_limit_scheduler, cache_timeouts=None,
+            single_flight=single_flight, stale_timeouts=None, not_found_timeouts=None
     ):
         super().__init__(
             auth, cache=cache, host=host, parser=parser, proxy=proxy, retry_count=retry_count,
             retry_delay=retry_delay, retry_errors=retry_errors, timeout=timeout, upload_host=upload_host,
-            user_agent=user_agent, wait_on_rate_limit=wait_on_rate_limit
+            user_agent=user_agent, wait_on_rate_limit=wait_on_rate_limit, pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize, pool_block=pool_block, keep_alive=keep_alive
         )
 
+        self.cache_timeouts = {**self.CACHE_TIMEOUTS, **(cache_timeouts or {})}
+        self.stale_timeouts = dict(stale_timeouts or {})
+        self.not_found_timeouts = {**self.NOT_FOUND_TIMEOUTS, **(not_found_timeouts or {})}
+        self.cached_result = False
+        self.single_flight = single_flight
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = None
+
+        self.rate_limit_scheduler = rate_limit_scheduler
+        if rate_limit_scheduler is not None:
+            adapter = RateLimitAdapter(
+                rate_limit_scheduler, pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                pool_block=pool_block
+            )
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
         if auth is not None:
             self.mastodon = Mastodon(
                 auth.client_id,
                 auth.client_secret,
                 auth.access_token,
                 api_base_url=auth.api_base_url,
+                session=self.session,
             )
 
+    def _cached_request(self, method_name, fetch, **params):
+        """Get the raw Mastodon payload of `fetch(**params)` from the cache, or fetch and
+        cache it.
+
+        The payload is cached before it is converted, since the converters modify it in
+        place, and a copy is handed out on every read. Concurrent identical fetches are
+        coalesced into one by the single flight. Stale payloads are returned while they
+        are refreshed in the background, and MastodonNotFoundError is cached as well.
+        """
+        self.cached_result = False
+        key = self._cache_key(method_name, **params)
+        if self.cache:
+            timeout = self.cache_timeouts.get(method_name)
+            if timeout is None:
+                timeout = self.cache.timeout
+            stale_timeout = self.stale_timeouts.get(method_name, 0)
+            not_found_timeout = self.not_found_timeouts.get(method_name, 0)
+            # Entries are kept through the stale and not found windows
+            retention = max(timeout + stale_timeout, not_found_timeout) if timeout > 0 else 0
+
+        def fetch_and_store():
+            try:
+                payload = fetch(**params)
+            except MastodonNotFoundError:
+                if self.cache and self.not_found_timeouts.get(method_name):
+                    self.cache.store(key, {'_cached_at': time.time(), '_not_found': True}, timeout=retention)
+                raise
+            if payload and self.cache:
+                self.cache.store(
+                    key, {'_cached_at': time.time(), '_payload': copy.deepcopy(payload)}, timeout=retention
+                )
+            return payload
+
+        if self.cache:
+            entry = self.cache.get(key, timeout=retention)
+            # Entries cached by previous versions are not wrapped
+            if isinstance(entry, dict) and '_cached_at' in entry:
+                age = time.time() - entry['_cached_at']
+                if entry.get('_not_found'):
+                    if age < not_found_timeout:
+                        self.cached_result = True
+                        raise MastodonNotFoundError('Mastodon API returned error', 404, 'Not Found', None)
+                elif timeout <= 0 or age < timeout + stale_timeout:
+                    if timeout > 0 and age >= timeout:
+                        self._refresh(key, fetch_and_store)
+                    self.cached_result = True
+                    return copy.deepcopy(entry['_payload'])
+
+        if self.single_flight is None:
+            return fetch_and_store()
+        payload, shared = self.single_flight.do(key, fetch_and_store)
+        # Every caller converts the payload in place
+        return copy.deepcopy(payload) if shared else payload
+
+    def _refresh(self, key, fetch_and_store):
+        """Refresh a stale cache entry in the background, unless it already is"""
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS, thread_name_prefix='tweepy-mastodon-refresh'
+                )
+
+        def refresh():
+            try:
+                if self.single_flight is None:
+                    fetch_and_store()
+                else:
+                    self.single_flight.do(key, fetch_and_store)
+            except MastodonNotFoundError:
+                pass
+            except Exception:
+                log.exception(f'Failed to refresh {key}')
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+        self._refresh_executor.submit(refresh)
+
+    def close(self):
+        """Stop refreshing the stale cache entries and close the pooled
+        connections of the session"""
+        with self._refresh_lock:
+            executor, self._refresh_executor = self._refresh_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        super().close()
+
+    def _cache_key(self, method_name, **params):
+        # Results depend on the instance and, for timelines and relationships, on the
+        # authenticating account. Parameters are normalized so that equivalent calls
+        # share their entry.
+        account = hashlib.sha256(self.auth.access_token.encode('utf-8')).hexdigest()[:16]
+        params = sorted(
+            (key, normalize_id(value)) for key, value in params.items() if value is not None
+        )
+        return f'{self.mastodon.api_base_url}/{account}/{method_name}?{urlencode(params)}'
+
+    def rate_limit_budget(self, family='api'):
+        """rate_limit_budget(family='api')
+
+        Returns the requests left before the rate limit of the authenticating
+        user is reached, so that workers can size their batches.
+
+        Parameters
+        ----------
+        family
+            The endpoint family: ``'api'``, ``'media'`` or
+            ``'statuses_delete'``
+
+        Returns
+        -------
+        :class:`~tweepy_mastodon.ratelimit.RateLimitBudget`
+
+        Raises
+        ------
+        TweepyException
+            If the API has no ``rate_limit_scheduler``
+        """
+        if self.rate_limit_scheduler is None:
+            raise TweepyException('rate_limit_budget requires a rate_limit_scheduler')
+        key = self.rate_limit_scheduler.key(self.mastodon.api_base_url, self.auth.access_token, family)
+        return self.rate_limit_scheduler.budget(key)
+
     def verify_credentials(self, **kwargs):
-        me = self.mastodon.me()
+        me = self._cached_request('verify_credentials', self.mastodon.me)
         return convert_user(self.mastodon, me, verified_credentials=True)
 
+    @pagination(mode='link')
     def home_timeline(
             self,
             count=20,
@@ -85,9 +294,10 @@ class API(TweepyAPI):
             trim_user=None,
             exclude_replies=None,
             include_entities=None,
+            min_id=None,
             **kwargs
     ):
-        """home_timeline(*, count, since_id, max_id, trim_user, exclude_replies, include_entities)
+        """home_timeline(*, count, since_id, max_id, trim_user, exclude_replies, include_entities, min_id)
 
         Returns the 20 most recent statuses, including retweets, posted by
         the authenticating user and that user's friends. This is the equivalent
@@ -107,6 +317,9 @@ class API(TweepyAPI):
             |exclude_replies|
         include_entities
             |include_entities|
+        min_id
+            Returns the statuses immediately newer than the specified ID.
+            Used to page back through Mastodon's ``Link`` header.
 
         Returns
         -------
@@ -120,12 +333,10 @@ class API(TweepyAPI):
             log.warning(
                 '`trim_user`, `exclude_replies`, and `include_entities` are not implemented in tweepy-mastodon yet')
 
-        mastodon_posts = self.mastodon.timeline_home(limit=count, since_id=since_id, max_id=max_id)
-        posts = []
-        for mastodon_post in mastodon_posts:
-            post = convert_status(self.mastodon, mastodon_post)
-            posts.append(post)
-        return posts
+        mastodon_posts = self._cached_request(
+            'home_timeline', self.mastodon.timeline_home, limit=count, since_id=since_id, max_id=max_id, min_id=min_id
+        )
+        return convert_statuses(self.mastodon, mastodon_posts)
 
     def update_status(
             self, status,
@@ -294,16 +505,7 @@ class API(TweepyAPI):
         if chunked is not None or media_category is not None or additional_owners is not None:
             log.warning('`chunked`, `media_category`, and `additional_owners` are '
                         'not implemented in tweepy-mastodon yet')
-        h = None
-        if file is not None:
-            location = file.tell()
-            h = file.read(32)
-            file.seek(location)
-        mime_type = imghdr.what(filename, h=h)
-        if mime_type is not None:
-            mime_type = 'image/' + mime_type
-        else:
-            mime_type = mimetypes.guess_type(filename)[0]
+        mime_type = guess_mime_type(filename, file)
 
         media_file = file or filename
         mastodon_media = self.mastodon.media_post(media_file=media_file, mime_type=mime_type, file_name=filename)
@@ -362,9 +564,13 @@ class API(TweepyAPI):
 
         try:
             if user_id:
-                user = self.mastodon.account(id=user_id)
+                user = self._cached_request(
+                    'get_user', functools.partial(fetch_account, self.mastodon), account_id=user_id
+                )
             elif screen_name:
-                user = self.mastodon.account_lookup(acct=screen_name)
+                user = self._cached_request(
+                    'get_user', functools.partial(lookup_account, self.mastodon), acct=screen_name
+                )
             else:
                 raise Exception('404 not found')  # TODO: use actual `tweepy.errors.NotFound`
         except MastodonNotFoundError:
@@ -372,6 +578,60 @@ class API(TweepyAPI):
 
         return convert_user(self.mastodon, user, get_user=True)
 
+    def lookup_users(self, *, screen_name=None, user_id=None, include_entities=None, tweet_mode=None):
+        """lookup_users(*, screen_name, user_id, include_entities, tweet_mode)
+
+        Returns fully-hydrated user objects for the specified users.
+
+        Unlike Twitter, any number of users can be looked up. The users are
+        fetched concurrently, in bulk on servers that support it, and returned
+        in the order they were requested in: first those of ``user_id``, then
+        those of ``screen_name``. A user that cannot be found is returned as a
+        :class:`mastodon.MastodonNotFoundError` in its place.
+
+        Parameters
+        ----------
+        screen_name
+            A list of screen names
+        user_id
+            A list of user IDs
+        include_entities
+            |include_entities|
+        tweet_mode
+            Valid request values are compat and extended, which give
+            compatibility mode and extended mode, respectively for Tweets that
+            contain over 140 characters.
+
+        Returns
+        -------
+        :py:class:`List`\[:class:`~tweepy.models.User` | :class:`mastodon.MastodonNotFoundError`]
+
+        References
+        ----------
+        https://developer.twitter.com/en/docs/twitter-api/v1/accounts-and-users/follow-search-get-users/api-reference/get-users-lookup
+        """
+        if include_entities is not None or tweet_mode is not None:
+            log.warning('`include_entities` and `tweet_mode` are not implemented in tweepy-mastodon yet')
+
+        user_ids = [normalize_id(account_id) for account_id in user_id or ()]
+        screen_names = list(screen_name or ())
+        accounts_by_id = fetch_accounts(self.mastodon, user_ids)
+        accounts_by_acct = lookup_accounts(self.mastodon, screen_names)
+
+        users = []
+        for account_id in user_ids:
+            if account_id in accounts_by_id:
+                users.append(convert_user(self.mastodon, accounts_by_id[account_id]))
+            else:
+                users.append(MastodonNotFoundError(f'User {account_id} not found'))
+        for acct in screen_names:
+            if acct in accounts_by_acct:
+                users.append(convert_user(self.mastodon, accounts_by_acct[acct]))
+            else:
+                users.append(MastodonNotFoundError(f'User {acct} not found'))
+        return users
+
+    @pagination(mode='link')
     def user_timeline(
             self,
             user_id=None,
@@ -381,10 +641,11 @@ class API(TweepyAPI):
             max_id=None,
             trim_user=None,
             exclude_replies=None,
-            include_rts=None
+            include_rts=None,
+            min_id=None
     ):
         """user_timeline(*, user_id, screen_name, since_id, count, max_id,
-                        trim_user, exclude_replies, include_rts)
+                        trim_user, exclude_replies, include_rts, min_id)
 
         Returns the 20 most recent statuses posted from the authenticating user
         or the user specified. It's also possible to request another user's
@@ -412,6 +673,9 @@ class API(TweepyAPI):
             timeline and the slice selected by the count parameter). Note: If
             you're using the trim_user parameter in conjunction with
             include_rts, the retweets will still contain a full user object.
+        min_id
+            Returns the statuses immediately newer than the specified ID.
+            Used to page back through Mastodon's ``Link`` header.
 
         Returns
         -------
@@ -425,12 +689,10 @@ class API(TweepyAPI):
             log.warning(
                 '`trim_user`, `exclude_replies`, and `include_rts` are not implemented in tweepy-mastodon yet')
 
-        mastodon_posts = self.mastodon.timeline_home(limit=count, since_id=since_id, max_id=max_id)
-        posts = []
-        for mastodon_post in mastodon_posts:
-            post = convert_status(self.mastodon, mastodon_post)
-            posts.append(post)
-        return posts
+        mastodon_posts = self._cached_request(
+            'user_timeline', self.mastodon.timeline_home, limit=count, since_id=since_id, max_id=max_id, min_id=min_id
+        )
+        return convert_statuses(self.mastodon, mastodon_posts)
 
     def get_status(
             self,
@@ -482,9 +744,72 @@ class API(TweepyAPI):
                 '`trim_user`, `include_my_retweet`, `include_entities`, `include_ext_alt_text`, '
                 'and `include_card_uri` are not implemented in tweepy-mastodon yet')
 
-        status = self.mastodon.status(id=id)
+        status = self._cached_request('get_status', self.mastodon.status, id=id)
         return convert_status(self.mastodon, status, include_user_status=False)
 
+    def lookup_statuses(
+            self,
+            id,
+            include_entities=None,
+            trim_user=None,
+            map=None,
+            include_ext_alt_text=None,
+            include_card_uri=None
+    ):
+        """lookup_statuses(id, *, include_entities, trim_user, map, \
+                           include_ext_alt_text, include_card_uri)
+
+        Returns full status objects for the statuses specified by the ``id``
+        parameter.
+
+        Unlike Twitter, any number of statuses can be looked up. The statuses
+        are fetched concurrently, in bulk on servers that support it, and
+        returned in the order of ``id``. A status that cannot be found is
+        returned as a :class:`mastodon.MastodonNotFoundError` in its place.
+
+        Parameters
+        ----------
+        id
+            A list of status IDs to lookup
+        include_entities
+            |include_entities|
+        trim_user
+            |trim_user|
+        map
+            Not used, statuses that cannot be found are always included
+        include_ext_alt_text
+            |include_ext_alt_text|
+        include_card_uri
+            |include_card_uri|
+
+        Returns
+        -------
+        :py:class:`List`\[:class:`~tweepy.models.Status` | :class:`mastodon.MastodonNotFoundError`]
+
+        References
+        ----------
+        https://developer.twitter.com/en/docs/twitter-api/v1/tweets/post-and-engage/api-reference/get-statuses-lookup
+        """
+        if include_entities is not None \
+                or trim_user is not None \
+                or map is not None \
+                or include_ext_alt_text is not None \
+                or include_card_uri is not None:
+            log.warning(
+                '`include_entities`, `trim_user`, `map`, `include_ext_alt_text`, '
+                'and `include_card_uri` are not implemented in tweepy-mastodon yet')
+
+        status_ids = [normalize_id(status_id) for status_id in id]
+        mastodon_statuses = fetch_statuses(self.mastodon, status_ids)
+        statuses_by_id = {
+            status.id: status for status in convert_statuses(self.mastodon, mastodon_statuses.values())
+        }
+        return [
+            statuses_by_id[status_id] if status_id in statuses_by_id
+            else MastodonNotFoundError(f'Status {status_id} not found')
+            for status_id in status_ids
+        ]
+
     def create_favorite(self, id, include_entities=None):
         """create_favorite(id, *, include_entities)
 
@@ -632,6 +957,7 @@ class API(TweepyAPI):
         try:
             user = self.get_user(user_id, screen_name)
             relationship = self.mastodon.account_follow(id=user.id, notify=follow)
+            account_cache.invalidate(self.mastodon.api_base_url, user.id)
 
             user['following'] = relationship.following
             user['notifications'] = relationship.notifying
@@ -664,6 +990,7 @@ class API(TweepyAPI):
         try:
             user = self.get_user(user_id, screen_name)
             relationship = self.mastodon.account_unfollow(id=user.id)
+            account_cache.invalidate(self.mastodon.api_base_url, user.id)
 
             user['following'] = relationship.following
             user['notifications'] = relationship.notifying
@@ -696,6 +1023,7 @@ class API(TweepyAPI):
         """
         user = self.get_user(user_id, screen_name)
         self.mastodon.account_mute(id=user.id)
+        account_cache.invalidate(self.mastodon.api_base_url, user.id)
         return user
 
     def destroy_mute(self, screen_name=None, user_id=None):
@@ -721,6 +1049,7 @@ class API(TweepyAPI):
         """
         user = self.get_user(user_id, screen_name)
         self.mastodon.account_unmute(id=user.id)
+        account_cache.invalidate(self.mastodon.api_base_url, user.id)
         return user
 
     def create_block(self, screen_name=None, user_id=None, include_entities=None, skip_status=None):
@@ -755,6 +1084,7 @@ class API(TweepyAPI):
 
         user = self.get_user(user_id, screen_name)
         self.mastodon.account_block(id=user.id)
+        account_cache.invalidate(self.mastodon.api_base_url, user.id)
         return user
 
     def destroy_block(self, screen_name=None, user_id=None, include_entities=None, skip_status=None):
@@ -788,4 +1118,5 @@ class API(TweepyAPI):
 
         user = self.get_user(user_id, screen_name)
         self.mastodon.account_unblock(id=user.id)
+        account_cache.invalidate(self.mastodon.api_base_url, user.id)
         return user
@@ -19,6 +19,9 @@ except ModuleNotFoundError:
         "installed"
     )
 
+from tweepy_mastodon.asynchronous.api import AsyncAPI
 from tweepy_mastodon.asynchronous.client import AsyncClient
 from tweepy_mastodon.asynchronous.pagination import AsyncPaginator
-from tweepy_mastodon.asynchronous.streaming import AsyncStream, AsyncStreamingClient
+from tweepy_mastodon.asynchronous.streaming import (
+    AsyncMultiplexStream, AsyncStream, AsyncStreamingClient
+)
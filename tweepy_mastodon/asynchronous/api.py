@@ -0,0 +1,619 @@
+import asyncio
+import copy
+import functools
+import json
+import logging
+from platform import python_version
+import time
+
+import aiohttp
+from dateutil.parser import parse as parse_datetime
+from mastodon import Mastodon, MastodonNotFoundError
+from mastodon.utility import AttribAccessList, parse_version_string
+
+import tweepy_mastodon
+from tweepy_mastodon.cache import account_cache
+from tweepy_mastodon.errors import (
+    BadRequest, Forbidden, HTTPException, NotFound, TooManyRequests,
+    TwitterServerError, Unauthorized
+)
+from tweepy_mastodon.ratelimit import endpoint_family, rate_limit_scheduler
+from tweepy_mastodon.singleflight import AsyncSingleFlight
+from tweepy_mastodon.utils import (
+    BULK_ACCOUNTS_LIMIT, BULK_LOOKUP_VERSION, BULK_STATUSES_LIMIT, LINK_PARAMS, MAX_WORKERS, convert_media,
+    convert_status, convert_statuses, convert_user, guess_mime_type, normalize_id, page_usernames
+)
+
+log = logging.getLogger(__name__)
+
+# Mastodon.py's JSON hooks turn dates into datetimes, numeric IDs into ints and
+# objects into AttribAccessDicts, which is what the converters expect.
+_json_loads = functools.partial(json.loads, object_hook=Mastodon._Mastodon__json_hooks)
+
+# Number of times a rate limited request is retried with wait_on_rate_limit, and
+# the number of seconds to wait for when the response tells no reset time
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 60
+
+
+def _rate_limit_sleep_time(headers):
+    """Get the number of seconds to wait for after a rate limited response"""
+    try:
+        return parse_datetime(headers['X-RateLimit-Reset']).timestamp() - time.time() + 1
+    except (KeyError, TypeError, ValueError, OverflowError):
+        pass
+    retry_after = headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            return parse_datetime(retry_after).timestamp() - time.time()
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return RATE_LIMIT_BACKOFF
+
+
+class AsyncAPI:
+    """Asynchronous interface to the Mastodon API, returning the same Twitter-like
+    objects as :class:`tweepy_mastodon.API`
+
+    Requests go through a single :class:`aiohttp.ClientSession`, so many
+    accounts can be served concurrently from one event loop. Pass the same
+    ``session`` to every instance to share its connection pool. Otherwise, a
+    session is created on the first request and closed by :meth:`close` or at
+    the end of an ``async with`` block.
+
+    Unlike :class:`tweepy_mastodon.API`, the users embedded in statuses have no
+    ``status``, as it cannot be loaded lazily without blocking the event loop.
+    :meth:`get_user` and :meth:`verify_credentials` include it.
+
+    Parameters
+    ----------
+    auth
+        The authentication handler to be used
+    session
+        The :class:`aiohttp.ClientSession` to make the requests with
+    timeout
+        The maximum amount of time to wait for a response from Mastodon
+    user_agent
+        The User Agent to use when requesting the API
+    wait_on_rate_limit
+        Whether or not to automatically wait for rate limits to replenish, up
+        to :data:`RATE_LIMIT_RETRIES` times per request
+    max_concurrency
+        The maximum number of concurrent requests made by bulk lookups
+    rate_limit_scheduler
+        The :class:`~tweepy_mastodon.ratelimit.RateLimitScheduler` pacing the
+        requests, shared with the synchronous API by default. ``None``
+        disables pacing.
+    coalesce_requests
+        Whether or not concurrent identical GET requests share one request
+        and its response. See :attr:`single_flight` for the number of
+        coalesced requests.
+    """
+
+    def __init__(
+        self, auth, *, session=None, timeout=60, user_agent=None,
+        wait_on_rate_limit=False, max_concurrency=MAX_WORKERS,
+        rate_limit_scheduler=rate_limit_scheduler, coalesce_requests=True
+    ):
+        self.auth = auth
+        self.api_base_url = auth.api_base_url
+        if not self.api_base_url.startswith(('http://', 'https://')):
+            self.api_base_url = 'https://' + self.api_base_url
+        self.api_base_url = self.api_base_url.rstrip('/')
+
+        self.session = session
+        self._owns_session = session is None
+        self.timeout = timeout
+        self.user_agent = user_agent or (
+            f"Python/{python_version()} "
+            f"aiohttp/{aiohttp.__version__} "
+            f"tweepy-mastodon/{tweepy_mastodon.__version__}"
+        )
+        self.wait_on_rate_limit = wait_on_rate_limit
+        self.max_concurrency = max_concurrency
+        self.rate_limit_scheduler = rate_limit_scheduler
+        self.single_flight = AsyncSingleFlight() if coalesce_requests else None
+        self._version = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the session, unless it was passed in by the caller"""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, endpoint, *, params=None, data=None):
+        """Make a request to the Mastodon API and return the decoded JSON
+        response, along with the :class:`aiohttp.ClientResponse`"""
+        if method != 'GET' or self.single_flight is None:
+            return await self._request(method, endpoint, params=params, data=data)
+        key = (endpoint, None if params is None else tuple(_encode_params(params)))
+        (response_json, response), shared = await self.single_flight.do(
+            key, self._request, method, endpoint, params=params
+        )
+        # Callers convert the response in place
+        return (copy.deepcopy(response_json) if shared else response_json), response
+
+    async def _request(self, method, endpoint, *, params=None, data=None):
+        for retries in range(RATE_LIMIT_RETRIES + 1):
+            text, response = await self._send(method, endpoint, params, data)
+            if response.status != 429 or not self.wait_on_rate_limit or retries == RATE_LIMIT_RETRIES:
+                break
+            sleep_time = _rate_limit_sleep_time(response.headers)
+            if sleep_time > 0:
+                log.warning(
+                    "Rate limit exceeded. "
+                    f"Sleeping for {sleep_time:.0f} seconds."
+                )
+                await asyncio.sleep(sleep_time)
+
+        if 200 <= response.status < 300:
+            return _json_loads(text) if text else None, response
+
+        try:
+            response_json = json.loads(text)
+        except ValueError:
+            response_json = {}
+        if response.status == 400:
+            raise BadRequest(response, response_json=response_json)
+        if response.status == 401:
+            raise Unauthorized(response, response_json=response_json)
+        if response.status == 403:
+            raise Forbidden(response, response_json=response_json)
+        if response.status == 404:
+            raise NotFound(response, response_json=response_json)
+        if response.status == 429:
+            raise TooManyRequests(response, response_json=response_json)
+        if response.status >= 500:
+            raise TwitterServerError(response, response_json=response_json)
+        raise HTTPException(response, response_json=response_json)
+
+    async def _send(self, method, endpoint, params, data):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._owns_session = True
+
+        headers = {
+            'Authorization': f'Bearer {self.auth.access_token}',
+            'User-Agent': self.user_agent,
+        }
+        encoded_params = None if params is None else _encode_params(params)
+        encoded_data = _encode_params(data) if isinstance(data, dict) else data
+
+        if self.rate_limit_scheduler is not None:
+            key = self.rate_limit_scheduler.key(
+                self.api_base_url, self.auth.access_token, endpoint_family(method, endpoint)
+            )
+            delay = self.rate_limit_scheduler.reserve(key)
+            if delay > 0:
+                log.warning(f"Rate limit budget exhausted. Sleeping for {delay:.0f} seconds.")
+                await asyncio.sleep(delay)
+
+        log.debug(
+            f"Making API request: {method} {self.api_base_url + endpoint}\n"
+            f"Parameters: {encoded_params}"
+        )
+
+        async with self.session.request(
+            method, self.api_base_url + endpoint, params=encoded_params,
+            data=encoded_data, headers=headers
+        ) as response:
+            text = await response.text()
+
+        if self.rate_limit_scheduler is not None:
+            self.rate_limit_scheduler.update(key, response.headers)
+
+        log.debug(
+            f"Received API response: {response.status} {response.reason}\n"
+            f"Headers: {response.headers}"
+        )
+        return text, response
+
+    async def fetch_account(self, account_id):
+        """Fetch an account by ID, going through the process-wide account cache"""
+        account = account_cache.get(self.api_base_url, account_id)
+        if account is None:
+            account, _ = await self.request('GET', f'/api/v1/accounts/{account_id}')
+            account_cache.store(self.api_base_url, account)
+        return account
+
+    async def lookup_account(self, acct):
+        """Fetch an account by ``acct``, going through the process-wide account
+        cache"""
+        account = account_cache.get_by_acct(self.api_base_url, acct)
+        if account is None:
+            account, _ = await self.request('GET', '/api/v1/accounts/lookup', params={'acct': acct})
+            account_cache.store(self.api_base_url, account)
+        return account
+
+    async def fetch_accounts(self, account_ids):
+        """Fetch accounts by ID with as few round trips as possible, see
+        :func:`tweepy_mastodon.utils.fetch_accounts`"""
+        cached_accounts = {}
+        for account_id in dict.fromkeys(account_ids):
+            cached_accounts[account_id] = account_cache.get(self.api_base_url, account_id)
+        account_ids = [account_id for account_id, account in cached_accounts.items() if account is None]
+
+        accounts = await self._fetch_many(account_ids, '/api/v1/accounts', BULK_ACCOUNTS_LIMIT)
+
+        accounts_by_id = {account_id: account for account_id, account in cached_accounts.items() if account is not None}
+        for account in accounts:
+            if account is not None:
+                account_cache.store(self.api_base_url, account)
+                accounts_by_id[account['id']] = account
+        return accounts_by_id
+
+    async def fetch_statuses(self, status_ids):
+        """Fetch statuses by ID with as few round trips as possible, see
+        :func:`tweepy_mastodon.utils.fetch_statuses`"""
+        status_ids = list(dict.fromkeys(status_ids))
+        statuses = await self._fetch_many(status_ids, '/api/v1/statuses', BULK_STATUSES_LIMIT)
+        return {status['id']: status for status in statuses if status is not None}
+
+    async def lookup_accounts(self, accts):
+        """Fetch accounts by ``acct`` concurrently, see
+        :func:`tweepy_mastodon.utils.lookup_accounts`"""
+        accts = list(dict.fromkeys(accts))
+        accounts = await self._gather_bounded(self.lookup_account, accts)
+        return {acct: account for acct, account in zip(accts, accounts) if account is not None}
+
+    async def _supports_bulk_lookups(self):
+        if self._version is None:
+            instance, _ = await self.request('GET', '/api/v1/instance')
+            self._version = parse_version_string(instance['version'])
+        return self._version >= parse_version_string(BULK_LOOKUP_VERSION)
+
+    async def _fetch_many(self, resource_ids, endpoint, bulk_limit):
+        if not resource_ids:
+            return []
+        if await self._supports_bulk_lookups():
+            async def fetch_chunk(chunk):
+                resources, _ = await self.request('GET', endpoint, params={'id': chunk})
+                return resources
+            chunks = [resource_ids[i:i + bulk_limit] for i in range(0, len(resource_ids), bulk_limit)]
+            return [resource for resources in await self._gather_bounded(fetch_chunk, chunks) for resource in resources]
+
+        async def fetch(resource_id):
+            resource, _ = await self.request('GET', f'{endpoint}/{resource_id}')
+            return resource
+        return await self._gather_bounded(fetch, resource_ids)
+
+    async def _gather_bounded(self, fetch, items):
+        # Run `fetch` over `items` with at most `max_concurrency` requests in flight,
+        # returning None for the items that cannot be found.
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_or_none(item):
+            async with semaphore:
+                try:
+                    return await fetch(item)
+                except NotFound:
+                    return None
+        return await asyncio.gather(*(fetch_or_none(item) for item in items))
+
+    async def _account_usernames(self, mastodon_statuses):
+        # Resolve every username the converters need up front, so that they never
+        # fall back to a blocking request.
+        account_usernames, missing_account_ids = page_usernames(mastodon_statuses)
+        accounts = await self.fetch_accounts(missing_account_ids)
+        for account_id in missing_account_ids:
+            account = accounts.get(account_id)
+            account_usernames[account_id] = account.username if account is not None else None
+        return account_usernames
+
+    async def _convert_statuses(self, mastodon_statuses):
+        return convert_statuses(
+            self, mastodon_statuses, include_user_status=False,
+            account_usernames=await self._account_usernames(mastodon_statuses)
+        )
+
+    async def _convert_status(self, mastodon_status):
+        return (await self._convert_statuses([mastodon_status]))[0]
+
+    async def _convert_user(self, mastodon_account, include_status=True, **kwargs):
+        user = convert_user(self, mastodon_account, include_status=False, **kwargs)
+        if not include_status:
+            return user
+        mastodon_statuses, _ = await self.request(
+            'GET', f'/api/v1/accounts/{mastodon_account.id}/statuses', params={'limit': 1}
+        )
+        if mastodon_statuses:
+            user['status'] = convert_status(
+                self, mastodon_statuses[0], is_user_embedded=True,
+                account_usernames=await self._account_usernames(mastodon_statuses)
+            )
+        return user
+
+    async def _user(self, user_id=None, screen_name=None):
+        if user_id:
+            return await self.fetch_account(user_id)
+        if screen_name:
+            return await self.lookup_account(screen_name)
+        raise TypeError('Expected user_id or screen_name')
+
+    async def verify_credentials(self):
+        """verify_credentials()
+
+        Returns the authenticating user.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        me, _ = await self.request('GET', '/api/v1/accounts/verify_credentials')
+        return await self._convert_user(me, verified_credentials=True)
+
+    async def home_timeline(self, count=20, since_id=None, max_id=None, min_id=None):
+        """home_timeline(*, count, since_id, max_id, min_id)
+
+        Returns the most recent statuses of the home timeline.
+
+        Returns
+        -------
+        :class:`~tweepy_mastodon.models.ResultSet`
+        """
+        mastodon_statuses, response = await self.request(
+            'GET', '/api/v1/timelines/home',
+            params={'limit': count, 'since_id': since_id, 'max_id': max_id, 'min_id': min_id}
+        )
+        mastodon_statuses = AttribAccessList(mastodon_statuses)
+        mastodon_statuses._pagination_next = _link_params(response, 'next')
+        mastodon_statuses._pagination_prev = _link_params(response, 'prev')
+        return await self._convert_statuses(mastodon_statuses)
+
+    async def update_status(self, status, in_reply_to_status_id=None, media_ids=None):
+        """update_status(status, *, in_reply_to_status_id, media_ids)
+
+        Posts a status.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request(
+            'POST', '/api/v1/statuses',
+            data={'status': status, 'in_reply_to_id': in_reply_to_status_id, 'media_ids': media_ids}
+        )
+        return await self._convert_status(mastodon_status)
+
+    async def media_upload(self, filename, *, file=None):
+        """media_upload(filename, *, file)
+
+        Uploads an image, video or audio file. Read from ``file`` if given,
+        otherwise from ``filename``.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        # Reading the file, and sniffing its type, would block the event loop
+        content, mime_type = await asyncio.get_running_loop().run_in_executor(
+            None, _read_media, filename, file
+        )
+        form = aiohttp.FormData()
+        form.add_field(
+            'file', content, filename=filename,
+            content_type=mime_type or 'application/octet-stream'
+        )
+        mastodon_media, _ = await self.request('POST', '/api/v2/media', data=form)
+        return convert_media(mastodon_media)
+
+    async def get_status(self, id):
+        """get_status(id)
+
+        Returns a single status.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request('GET', f'/api/v1/statuses/{id}')
+        return await self._convert_status(mastodon_status)
+
+    async def destroy_status(self, id):
+        """destroy_status(id)
+
+        Deletes a status of the authenticating user.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request('DELETE', f'/api/v1/statuses/{id}')
+        return await self._convert_status(mastodon_status)
+
+    async def get_user(self, *, user_id=None, screen_name=None):
+        """get_user(*, user_id, screen_name)
+
+        Returns information about the specified user.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        return await self._convert_user(await self._user(user_id, screen_name), get_user=True)
+
+    async def lookup_statuses(self, id):
+        """lookup_statuses(id)
+
+        Returns the statuses specified by the ``id`` parameter, in its order.
+        A status that cannot be found is returned as a
+        :class:`mastodon.MastodonNotFoundError` in its place.
+
+        Returns
+        -------
+        :py:class:`List`\\[:class:`mastodon.utility.AttribAccessDict` | :class:`mastodon.MastodonNotFoundError`]
+        """
+        status_ids = [normalize_id(status_id) for status_id in id]
+        mastodon_statuses = await self.fetch_statuses(status_ids)
+        statuses_by_id = {
+            status.id: status for status in await self._convert_statuses(list(mastodon_statuses.values()))
+        }
+        return [
+            statuses_by_id[status_id] if status_id in statuses_by_id
+            else MastodonNotFoundError(f'Status {status_id} not found')
+            for status_id in status_ids
+        ]
+
+    async def lookup_users(self, *, screen_name=None, user_id=None):
+        """lookup_users(*, screen_name, user_id)
+
+        Returns the users specified by ``user_id``, then those specified by
+        ``screen_name``, in order. A user that cannot be found is returned as a
+        :class:`mastodon.MastodonNotFoundError` in its place.
+
+        Returns
+        -------
+        :py:class:`List`\\[:class:`mastodon.utility.AttribAccessDict` | :class:`mastodon.MastodonNotFoundError`]
+        """
+        user_ids = [normalize_id(account_id) for account_id in user_id or ()]
+        screen_names = list(screen_name or ())
+        accounts_by_id, accounts_by_acct = await asyncio.gather(
+            self.fetch_accounts(user_ids), self.lookup_accounts(screen_names)
+        )
+
+        users = []
+        for account_id in user_ids:
+            if account_id in accounts_by_id:
+                users.append(convert_user(self, accounts_by_id[account_id], include_status=False))
+            else:
+                users.append(MastodonNotFoundError(f'User {account_id} not found'))
+        for acct in screen_names:
+            if acct in accounts_by_acct:
+                users.append(convert_user(self, accounts_by_acct[acct], include_status=False))
+            else:
+                users.append(MastodonNotFoundError(f'User {acct} not found'))
+        return users
+
+    async def create_favorite(self, id):
+        """create_favorite(id)
+
+        Favorites the specified status.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request('POST', f'/api/v1/statuses/{id}/favourite')
+        return await self._convert_status(mastodon_status)
+
+    async def destroy_favorite(self, id):
+        """destroy_favorite(id)
+
+        Removes the favorite of the specified status.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request('POST', f'/api/v1/statuses/{id}/unfavourite')
+        return await self._convert_status(mastodon_status)
+
+    async def retweet(self, id):
+        """retweet(id)
+
+        Reblogs the specified status.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request('POST', f'/api/v1/statuses/{id}/reblog')
+        return await self._convert_status(mastodon_status)
+
+    async def unretweet(self, id):
+        """unretweet(id)
+
+        Undoes the reblog of the specified status.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        mastodon_status, _ = await self.request('POST', f'/api/v1/statuses/{id}/unreblog')
+        return await self._convert_status(mastodon_status)
+
+    async def create_friendship(self, *, screen_name=None, user_id=None, follow=None):
+        """create_friendship(*, screen_name, user_id, follow)
+
+        Follows the specified user.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        return await self._update_friendship('follow', screen_name, user_id, {'notify': follow})
+
+    async def destroy_friendship(self, *, screen_name=None, user_id=None):
+        """destroy_friendship(*, screen_name, user_id)
+
+        Unfollows the specified user.
+
+        Returns
+        -------
+        :class:`mastodon.utility.AttribAccessDict`
+        """
+        return await self._update_friendship('unfollow', screen_name, user_id)
+
+    async def _update_friendship(self, action, screen_name, user_id, data=None):
+        user = await self._convert_user(await self._user(user_id, screen_name), include_status=False, get_user=True)
+        relationship, _ = await self.request('POST', f'/api/v1/accounts/{user.id}/{action}', data=data)
+        account_cache.invalidate(self.api_base_url, user.id)
+
+        user['following'] = relationship.following
+        user['notifications'] = relationship.notifying
+        user['follow_request_sent'] = relationship.requested
+        return user
+
+
+def _encode_params(params):
+    # aiohttp only takes strings: drop unset parameters, spell booleans the way
+    # Mastodon expects and expand lists into `key[]` pairs.
+    encoded = []
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            encoded.extend((f'{key}[]', _encode_value(item)) for item in value)
+        else:
+            encoded.append((key, _encode_value(value)))
+    return encoded
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _link_params(response, rel):
+    # The same pagination parameters Mastodon.py parses from the Link header
+    link = response.links.get(rel)
+    if link is None:
+        return None
+    query = link['url'].query
+    params = {}
+    for key in LINK_PARAMS:
+        if key in query:
+            value = query[key]
+            params[key] = int(value) if value.isdigit() else value
+    return params or None
+
+
+def _read_media(filename, file):
+    if file is None:
+        with open(filename, 'rb') as f:
+            return _read_media(filename, f)
+    mime_type = guess_mime_type(filename, file)
+    return file.read(), mime_type
@@ -40,7 +40,8 @@ class AsyncBaseClient(BaseClient):
     def __init__(
         self, bearer_token=None, consumer_key=None, consumer_secret=None,
         access_token=None, access_token_secret=None, *, return_type=Response,
-        wait_on_rate_limit=False
+        wait_on_rate_limit=False, connection_limit=100,
+        connection_limit_per_host=0, dns_cache_ttl=10
     ):
         self.bearer_token = bearer_token
         self.consumer_key = consumer_key
@@ -51,17 +52,55 @@ class AsyncBaseClient(BaseClient):
         self.return_type = return_type
         self.wait_on_rate_limit = wait_on_rate_limit
 
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+
         self.session = None
+        self._managed_session = None
         self.user_agent = (
             f"Python/{python_version()} "
             f"aiohttp/{aiohttp.__version__} "
             f"Tweepy/{tweepy_mastodon.__version__}"
         )
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the session created by the client, along with its pooled
+        connections
+
+        A session assigned to :attr:`session` by the caller is left open.
+        """
+        if self._managed_session is not None:
+            await self._managed_session.close()
+            if self.session is self._managed_session:
+                self.session = None
+            self._managed_session = None
+
+    def _get_session(self):
+        # The session is created on first use, as it has to be created inside
+        # the event loop, and then reused so that its connections, DNS cache
+        # and TLS contexts are shared by every request
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.connection_limit,
+                    limit_per_host=self.connection_limit_per_host,
+                    ttl_dns_cache=self.dns_cache_ttl
+                )
+            )
+            self._managed_session = self.session
+        return self.session
+
     async def request(
         self, method, route, params=None, json=None, user_auth=False
     ):
-        session = self.session or aiohttp.ClientSession()
+        session = self._get_session()
         url = "https://api.twitter.com" + route
         headers = {"User-Agent": self.user_agent}
         if json is not None:
@@ -105,9 +144,6 @@ class AsyncBaseClient(BaseClient):
             f"Headers: {response.headers}"
         )
 
-        if self.session is None:
-            await session.close()
-
         if not 200 <= response.status < 300:
             response_json = await response.json()
         if response.status == 400:
@@ -162,11 +198,19 @@ class AsyncClient(AsyncBaseClient):
     """AsyncClient( \
         bearer_token=None, consumer_key=None, consumer_secret=None, \
         access_token=None, access_token_secret=None, *, return_type=Response, \
-        wait_on_rate_limit=False \
+        wait_on_rate_limit=False, connection_limit=100, \
+        connection_limit_per_host=0, dns_cache_ttl=10 \
     )
 
     Asynchronous Twitter API v2 Client
 
+    The client keeps a single connection-pooled session, created on the first
+    request. Use it as an asynchronous context manager, or call :meth:`close`,
+    to release its connections::
+
+        async with AsyncClient(bearer_token) as client:
+            ...
+
     .. versionadded:: 4.10
 
     Parameters
@@ -185,11 +229,20 @@ class AsyncClient(AsyncBaseClient):
         Type to return from requests to the API
     wait_on_rate_limit : bool
         Whether to wait when rate limit is reached
+    connection_limit : int
+        Maximum number of simultaneous connections, ``0`` for no limit
+    connection_limit_per_host : int
+        Maximum number of simultaneous connections to the same host, ``0`` for
+        no limit
+    dns_cache_ttl : int | None
+        Number of seconds to cache DNS lookups for, ``None`` to cache them
+        forever
 
     Attributes
     ----------
-    session : aiohttp.ClientSession
-        Aiohttp client session used to make requests to the API
+    session : aiohttp.ClientSession | None
+        Aiohttp client session used to make requests to the API. If set by the
+        caller, it is used instead of the client's own session.
     user_agent : str
         User agent used when making requests to the API
     """
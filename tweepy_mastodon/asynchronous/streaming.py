@@ -3,35 +3,104 @@
 # See LICENSE for details.
 
 import asyncio
+from collections import namedtuple
 import json
 import logging
 from math import inf
+import os
+import pickle
 from platform import python_version
+import tempfile
+import time
 import traceback
+from urllib.parse import quote
 
 import aiohttp
-from oauthlib.oauth1 import Client as OAuthClient
-from yarl import URL
 
 import tweepy_mastodon
+from tweepy_mastodon.asynchronous.api import AsyncAPI
 from tweepy_mastodon.asynchronous.client import AsyncBaseClient
+from tweepy_mastodon.auth import OAuth1UserHandler
 from tweepy_mastodon.client import Response
-from tweepy_mastodon.errors import TweepyException
-from tweepy_mastodon.models import Status
-from tweepy_mastodon.streaming import StreamResponse, StreamRule
+from tweepy_mastodon.errors import HTTPException, TweepyException
+from tweepy_mastodon.streaming import (
+    BACKFILL_PAGE_SIZE, StreamResponse, StreamRule, _apply_json_hooks,
+    _base_url, _decode_payload, _default_decoder, _id_order, _LineSplitter,
+    _sse_field, _stream_key, _StreamPositions, _subscription_key,
+    _subscription_message, _websocket_url
+)
 from tweepy_mastodon.tweet import Tweet
+from tweepy_mastodon.utils import normalize_id
 
 log = logging.getLogger(__name__)
 
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+# An event of a Mastodon stream waiting to be handled. The status_id is set for
+# the statuses the position of the stream is tracked with, and the data is
+# already converted for the backfilled statuses.
+_StreamEvent = namedtuple(
+    "_StreamEvent", ("key", "stream", "event", "data", "status_id", "converted")
+)
+
+
+class _SpillFile:
+    """Events waiting on disk for room in the queue, in order"""
+
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.read_position = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, item):
+        self.file.seek(0, os.SEEK_END)
+        pickle.dump(item, self.file, pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def pop(self):
+        self.file.seek(self.read_position)
+        item = pickle.load(self.file)
+        self.read_position = self.file.tell()
+        self.count -= 1
+        if not self.count:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_position = 0
+        return item
+
+    def close(self):
+        self.file.close()
+
 
 class AsyncBaseStream:
 
-    def __init__(self, *, max_retries=inf, proxy=None):
+    def __init__(self, *, max_retries=inf, proxy=None, queue_size=None,
+                 overflow="block", handlers=1, spill_directory=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise TweepyException(
+                f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}"
+            )
         self.max_retries = max_retries
         self.proxy = proxy
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.handlers = handlers
+        self.spill_directory = spill_directory
 
         self.session = None
         self.task = None
+        self._queue = None
+        self._spill = None
+        self._handler_tasks = []
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.lag = 0
+        self.max_lag = 0
         self.user_agent = (
             f"Python/{python_version()} "
             f"aiohttp/{aiohttp.__version__} "
@@ -59,7 +128,9 @@ class AsyncBaseStream:
                 timeout=aiohttp.ClientTimeout(sock_read=timeout)
             )
         self.session.headers["User-Agent"] = self.user_agent
+        self._start_handlers()
 
+        cancelled = False
         try:
             while error_count <= self.max_retries:
                 try:
@@ -77,13 +148,12 @@ class AsyncBaseStream:
                             network_error_wait = 0
 
                             await self.on_connect()
+                            await self._resume()
 
-                            async for line in resp.content:
-                                line = line.strip()
-                                if line:
-                                    await self.on_data(line)
-                                else:
-                                    await self.on_keep_alive()
+                            lines = _LineSplitter()
+                            async for chunk in resp.content.iter_any():
+                                for line in lines.feed(chunk):
+                                    await self._process_line(line)
 
                             await self.on_closed(resp)
                         else:
@@ -130,13 +200,132 @@ class AsyncBaseStream:
                     if network_error_wait > network_error_wait_max:
                         network_error_wait = network_error_wait_max
         except asyncio.CancelledError:
+            cancelled = True
             return
         except Exception as e:
             await self.on_exception(e)
         finally:
             await self.session.close()
+            await self._stop_handlers(drain=not cancelled)
             await self.on_disconnect()
 
+    async def _process_line(self, line):
+        if line:
+            await self._enqueue(bytes(line))
+        else:
+            await self.on_keep_alive()
+
+    async def _handle(self, data):
+        await self.on_data(data)
+
+    def _complete(self, data):
+        # Called once an event is handled, or dropped on purpose
+        pass
+
+    def _abandon(self, data):
+        # Called for the events left unhandled when the stream disconnects
+        pass
+
+    async def _resume(self):
+        pass
+
+    def _start_handlers(self):
+        if self.queue_size is None:
+            return
+        self._queue = asyncio.Queue(self.queue_size)
+        if self.overflow == "spill":
+            self._spill = _SpillFile(self.spill_directory)
+        self._handler_tasks = [
+            asyncio.ensure_future(self._run_handler(self._queue))
+            for _ in range(self.handlers)
+        ]
+
+    async def _stop_handlers(self, drain=True):
+        if self._queue is None:
+            return
+        try:
+            if drain:
+                await self._queue.join()
+        finally:
+            for task in self._handler_tasks:
+                task.cancel()
+            await asyncio.gather(*self._handler_tasks, return_exceptions=True)
+            self._handler_tasks = []
+            while not self._queue.empty():
+                self._abandon(self._queue.get_nowait()[1])
+            self._queue = None
+            if self._spill is not None:
+                while len(self._spill):
+                    self._abandon(self._spill.pop()[1])
+                self._spill.close()
+                self._spill = None
+
+    async def _enqueue(self, data):
+        # Reading from the connection only waits for the handlers with the
+        # block policy, so that the server does not drop a slow client.
+        self.received += 1
+        if self._queue is None:
+            return await self._handle_event(data)
+
+        item = (time.time(), data)
+        if self._spill is not None and (self._queue.full() or len(self._spill)):
+            # Later events are spilled as well until the file is drained, to
+            # keep them in order
+            self._spill.push(item)
+            self.spilled += 1
+            return
+        if self.overflow == "drop_oldest" and self._queue.full():
+            self._complete(self._queue.get_nowait()[1])
+            self._queue.task_done()
+            self.dropped += 1
+        await self._queue.put(item)
+
+    async def _run_handler(self, queue):
+        while True:
+            received_at, data = await queue.get()
+            try:
+                if self._spill is not None and len(self._spill):
+                    # Refill the slot just freed, before any event is queued
+                    queue.put_nowait(self._spill.pop())
+                self.lag = time.time() - received_at
+                self.max_lag = max(self.max_lag, self.lag)
+                await self._handle_event(data)
+            except Exception as e:
+                # A failing handler does not take the connection down
+                await self.on_exception(e)
+            finally:
+                self.handled += 1
+                queue.task_done()
+
+    async def _handle_event(self, data):
+        try:
+            await self._handle(data)
+        except asyncio.CancelledError:
+            # The stream disconnected meanwhile
+            self._abandon(data)
+            raise
+        except Exception:
+            # A failing event is not handled again
+            self._complete(data)
+            raise
+        self._complete(data)
+
+    def stats(self):
+        """Get the number of events received, handled, dropped and spilled to
+        disk, the number of events waiting to be handled, and the lag in
+        seconds between the reception and the handling of the last event and
+        its maximum"""
+        queued = 0
+        if self._queue is not None:
+            queued += self._queue.qsize()
+        if self._spill is not None:
+            queued += len(self._spill)
+        return {
+            'received': self.received, 'handled': self.handled,
+            'dropped': self.dropped, 'spilled': self.spilled,
+            'queued': queued, 'lag': self.lag, 'max_lag': self.max_lag,
+        }
+
     def disconnect(self):
         """Disconnect the stream"""
         if self.task is not None:
@@ -207,34 +396,344 @@ class AsyncBaseStream:
         log.error("Stream encountered HTTP Error: %d", status_code)
 
 
-class AsyncStream(AsyncBaseStream):
-    """Stream realtime Tweets asynchronously with Twitter API v1.1
+class AsyncBaseMastodonStream(AsyncBaseStream):
+    """Base class of the asynchronous streams of the Mastodon streaming API
+
+    Holds the credentials and the :class:`AsyncAPI` used to convert the
+    events, and dispatches them to the ``on_*`` methods.
+
+    The statuses posted while the stream is reconnecting are fetched from
+    the matching timeline once it is connected again, after the last one it
+    handled, see :attr:`last_ids`, and queued like the live ones. Those also
+    received live are only dispatched once, and those left in the queue when
+    the stream disconnected are fetched again.
+
+    The payloads are decoded by ``decoder``, orjson or ujson if installed.
+    With ``raw``, they are passed to the ``on_*`` methods as decoded, which
+    spares building the objects returned by :class:`AsyncAPI` when the
+    statuses are only forwarded.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_token,
+                 access_token_secret=None, *, api_base_url=None,
+                 streaming_base_url=None, resume=True, last_ids=None,
+                 max_backfill=1000, decoder=None, raw=False, api=None,
+                 **kwargs):
+        if api_base_url is None:
+            raise Exception(
+                'tweepy-mastodon requires the additional parameter `api_base_url` to determine Mastodon API server'
+            )
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = None
+        self.api_base_url = _base_url(api_base_url)
+        self.streaming_base_url = streaming_base_url and _base_url(streaming_base_url)
+        self.resume = resume
+        self.max_backfill = max_backfill
+        self.decoder = decoder or _default_decoder()
+        self.raw = raw
+        self._positions = _StreamPositions(last_ids)
+        self._owns_api = api is None
+        self.api = api or AsyncAPI(OAuth1UserHandler(
+            consumer_key, consumer_secret, access_token,
+            api_base_url=self.api_base_url
+        ))
+        super().__init__(**kwargs)
+
+    @property
+    def last_ids(self):
+        """The ID of the last status handled from each stream, along with
+        those before it, by stream, which can be saved to resume the streams
+        from another instance"""
+        return self._positions.last_ids
+
+    async def _connect(self, *args, **kwargs):
+        try:
+            await super()._connect(*args, **kwargs)
+        finally:
+            if self._owns_api:
+                await self.api.close()
+
+    async def _get_streaming_base_url(self):
+        if self.streaming_base_url is None:
+            try:
+                instance, _ = await self.api.request('GET', '/api/v1/instance')
+                self.streaming_base_url = _base_url(
+                    instance['urls']['streaming_api'].replace('wss://', 'https://', 1)
+                )
+            except Exception as e:
+                log.warning(
+                    "Failed to get the streaming server of %s, connecting "
+                    "to the instance itself: %s", self.api_base_url, e
+                )
+                self.streaming_base_url = self.api_base_url
+        return self.streaming_base_url
+
+    def _receive(self, key, stream, event, data):
+        # The event to queue, or None for a status already received
+        status_id = None
+        if event == "update" and key is not None:
+            status_id = normalize_id(data["id"])
+            if not self._positions.receive(key, status_id):
+                return None
+        return _StreamEvent(key, stream, event, data, status_id, False)
+
+    def _complete(self, data):
+        # The position of the stream only moves past the statuses handled,
+        # so that resuming it backfills the others
+        if data.status_id is not None:
+            self._positions.complete(data.key, data.status_id)
+
+    def _abandon(self, data):
+        if data.status_id is not None:
+            self._positions.abandon(data.key, data.status_id)
+
+    async def _convert(self, data):
+        if data.converted:
+            return data.data
+        return await self._convert_event(data.event, data.data)
+
+    async def _convert_event(self, event, data):
+        if self.raw or data is None:
+            return data
+        if event == "delete":
+            return normalize_id(data)
+        data = _apply_json_hooks(data)
+        if event in ("update", "status.update"):
+            return await self.api._convert_status(data)
+        return data
+
+    def _resumed_streams(self):
+        return []
+
+    async def _resume(self):
+        for key in self._resumed_streams():
+            if self.resume and key in self.last_ids:
+                await self._backfill(key)
+            else:
+                self._positions.give_up(key)
+
+    async def _backfill(self, key):
+        # The statuses are queued like the live ones, after those left from
+        # before the reconnection
+        timeline = _timeline_endpoint(key)
+        if timeline is None:
+            self._positions.give_up(key)
+            return
+        endpoint, params = timeline
+        min_id = self.last_ids[key]
+        count = 0
+        while count < self.max_backfill:
+            try:
+                page, _ = await self.api.request(
+                    'GET', endpoint,
+                    params={**params, 'min_id': min_id, 'limit': BACKFILL_PAGE_SIZE}
+                )
+            except HTTPException as e:
+                log.error("Failed to backfill the %s stream: %s", key, e)
+                return
+            if not page:
+                break
+            # Pages after min_id are sorted from the newest status
+            page = sorted(page, key=lambda status: _id_order(status.id))
+            min_id = page[-1].id
+            count += len(page)
+            page = [
+                mastodon_status for mastodon_status in page
+                if self._positions.receive(key, mastodon_status.id)
+            ]
+            status_ids = [mastodon_status.id for mastodon_status in page]
+            try:
+                if page and not self.raw:
+                    page = await self.api._convert_statuses(page)
+            except BaseException:
+                for status_id in status_ids:
+                    self._positions.abandon(key, status_id)
+                raise
+            for status_id, status in zip(status_ids, page):
+                await self._enqueue(
+                    _StreamEvent(key, key, "update", status, status_id, True)
+                )
+        if count >= self.max_backfill:
+            log.warning(
+                "Stopped backfilling the %s stream after %d statuses", key,
+                count
+            )
+        self._positions.give_up(key)
+
+    async def on_event(self, event, data):
+        """|coroutine|
+
+        This is called when an event is received from the stream.
+        This method handles sending the payload to other methods based on the
+        event type.
+
+        Parameters
+        ----------
+        event : str
+            The type of the event
+        data
+            The payload of the event, converted like the argument of the
+            method it is sent to
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#events
+        """
+        if event == "update":
+            return await self.on_status(data)
+        if event == "status.update":
+            return await self.on_status_update(data)
+        if event == "delete":
+            return await self.on_delete(data)
+        if event == "notification":
+            return await self.on_notification(data)
+        if event == "conversation":
+            return await self.on_conversation(data)
+        if event == "filters_changed":
+            return await self.on_filters_changed()
+
+        log.error("Received unknown event type %s: %s", event, data)
+
+    async def on_status(self, status):
+        """|coroutine|
+
+        This is called when a status is received.
+
+        Parameters
+        ----------
+        status : :class:`mastodon.utility.AttribAccessDict` | dict
+            The status received, converted like those returned by
+            :class:`AsyncAPI`, or as decoded with ``raw``
+        """
+        log.debug("Received status: %s", status["id"])
+
+    async def on_status_update(self, status):
+        """|coroutine|
+
+        This is called when an edited status is received.
+
+        Parameters
+        ----------
+        status : :class:`mastodon.utility.AttribAccessDict`
+            The edited status
+        """
+        log.debug("Received status update: %s", status["id"])
+
+    async def on_delete(self, status_id):
+        """|coroutine|
+
+        This is called when a status is deleted.
+
+        Parameters
+        ----------
+        status_id : int | str
+            The ID of the deleted status
+        """
+        log.debug("Received status deletion: %s", status_id)
+
+    async def on_notification(self, notification):
+        """|coroutine|
+
+        This is called when a notification is received.
+
+        Parameters
+        ----------
+        notification : :class:`mastodon.utility.AttribAccessDict`
+            The notification, as returned by Mastodon.py
+        """
+        log.debug("Received notification: %s", notification["id"])
+
+    async def on_conversation(self, conversation):
+        """|coroutine|
 
-    .. note::
+        This is called when a direct conversation is updated.
 
-        New Twitter Developer Apps created on or after April 29, 2022 `will not
-        be able to gain access to v1.1 statuses/filter`_, the Twitter API v1.1
-        endpoint that :class:`AsyncStream` uses. Twitter API v2 can be used
-        instead with :class:`AsyncStreamingClient`.
+        Parameters
+        ----------
+        conversation : :class:`mastodon.utility.AttribAccessDict`
+            The conversation, as returned by Mastodon.py
+        """
+        log.debug("Received conversation: %s", conversation["id"])
 
-    .. versionadded:: 4.0
+    async def on_filters_changed(self):
+        """|coroutine|
 
-    .. versionchanged:: 4.13
-        Removed ``sample``, ``on_delete``, ``on_scrub_geo``,
-        ``on_status_withheld``, and ``on_user_withheld`` methods, as `the
-        Twitter API v1.1 statuses/sample endpoint and compliance messages on
-        the Twitter API v1.1 statuses/filter endpoint have been retired`_
+        This is called when the filters of the user have changed.
+        """
+        log.debug("Received filters change")
+
+
+class AsyncStream(AsyncBaseMastodonStream):
+    """Stream realtime statuses and notifications from Mastodon
+    asynchronously
+
+    The asyncio counterpart of :class:`tweepy_mastodon.Stream`. Statuses are
+    converted by :attr:`api`, so that the accounts they refer to are fetched
+    without blocking the event loop.
+
+    With a ``queue_size``, reading the stream is decoupled from handling its
+    events: they are put in a bounded queue consumed by ``handlers``
+    concurrent tasks, so that slow ``on_*`` methods do not stall the
+    connection until the server drops it. When the queue is full, the
+    ``overflow`` policy applies:
+
+    * ``block`` waits for room in the queue, and stops reading the stream
+      meanwhile
+    * ``drop_oldest`` discards the oldest event of the queue, counted in
+      :meth:`stats`
+    * ``spill`` writes the events to a temporary file, in
+      ``spill_directory``, until the handlers catch up
+
+    An exception raised while handling a queued event is passed to
+    :meth:`on_exception` and does not disconnect the stream. See
+    :meth:`stats` for the number of dropped events and the handling lag.
 
     Parameters
     ----------
-    consumer_key: str
-        Twitter API Consumer Key
-    consumer_secret: str
-        Twitter API Consumer Secret
+    consumer_key : str
+        Mastodon Client ID
+    consumer_secret : str
+        Mastodon Client Secret
     access_token: str
-        Twitter API Access Token
-    access_token_secret: str
-        Twitter API Access Token Secret
+        Mastodon Access Token
+    access_token_secret : str | None
+        Unused, as Mastodon does not need it
+    api_base_url : str
+        Base URL of the Mastodon instance
+    streaming_base_url : str | None
+        Base URL of the streaming server of the instance, if it is not served
+        by the instance itself. By default, it is asked to the instance.
+    resume : bool
+        Whether or not to backfill the statuses posted while the stream was
+        reconnecting from the matching timeline
+    last_ids : dict[tuple, int | str] | None
+        The :attr:`last_ids` of a previous stream, to resume its streams
+        from the first connection
+    max_backfill : int
+        Maximum number of statuses to backfill per stream and reconnection
+    decoder : Callable[[bytes | memoryview | str], Any] | None
+        Decodes the JSON payloads. By default, orjson or ujson if installed,
+        else json.
+    raw : bool
+        Whether or not to pass the payloads to the ``on_*`` methods as
+        decoded, instead of converting them. The statuses backfilled after a
+        reconnection are still decoded by the API.
+    api : AsyncAPI | None
+        The :class:`AsyncAPI` used to convert the events, to share its
+        session. By default, one is created for the stream.
+    queue_size : int | None
+        Maximum number of events waiting to be handled. ``None`` handles
+        every event before reading the next one.
+    overflow : str
+        What to do with events when the queue is full: ``block``,
+        ``drop_oldest`` or ``spill``
+    handlers : int
+        Number of tasks handling the queued events concurrently
+    spill_directory : str | None
+        Directory of the file the ``spill`` policy writes to. By default,
+        the temporary directory.
     max_retries: int | None
         Number of times to attempt to (re)connect the stream.
     proxy: str | None
@@ -242,96 +741,97 @@ class AsyncStream(AsyncBaseStream):
 
     Attributes
     ----------
+    api : AsyncAPI
+        The API used to convert the events
+    last_ids : dict[tuple, int | str]
+        The ID of the last status handled from each stream, by stream
     session : aiohttp.ClientSession | None
         Aiohttp client session used to connect to the API
     task : asyncio.Task | None
         The task running the stream
     user_agent : str
         User agent used when connecting to the API
-
-
-    .. _will not be able to gain access to v1.1 statuses/filter: https://twittercommunity.com/t/deprecation-announcement-removing-compliance-messages-from-statuses-filter-and-retiring-statuses-sample-from-the-twitter-api-v1-1/170500
-    .. _the Twitter API v1.1 statuses/sample endpoint and compliance messages
-        on the Twitter API v1.1 statuses/filter endpoint have been retired: https://twittercommunity.com/t/deprecation-announcement-removing-compliance-messages-from-statuses-filter-and-retiring-statuses-sample-from-the-twitter-api-v1-1/170500
     """
 
     def __init__(self, consumer_key, consumer_secret, access_token,
-                 access_token_secret, **kwargs):
+                 access_token_secret=None, *, api_base_url=None,
+                 streaming_base_url=None, api=None, queue_size=1000,
+                 **kwargs):
         """__init__( \
-            consumer_key, consumer_secret, access_token, access_token_secret, \
-            *, max_retries=inf, proxy=None \
+            consumer_key, consumer_secret, access_token, \
+            access_token_secret=None, *, api_base_url, \
+            streaming_base_url=None, resume=True, last_ids=None, \
+            max_backfill=1000, decoder=None, raw=False, api=None, \
+            queue_size=1000, overflow="block", handlers=1, \
+            spill_directory=None, \
+            max_retries=inf, proxy=None \
         )
         """
-        self.consumer_key = consumer_key
-        self.consumer_secret = consumer_secret
-        self.access_token = access_token
-        self.access_token_secret = access_token_secret
-        super().__init__(**kwargs)
+        self._event = None
+        self._data = []
+        self._stream_key = None
+        super().__init__(
+            consumer_key, consumer_secret, access_token, access_token_secret,
+            api_base_url=api_base_url, streaming_base_url=streaming_base_url,
+            api=api, queue_size=queue_size, **kwargs
+        )
 
-    async def _connect(
-        self, method, endpoint, params={}, headers=None, body=None
-    ):
-        oauth_client = OAuthClient(self.consumer_key, self.consumer_secret,
-                                   self.access_token, self.access_token_secret)
-        url = f"https://stream.twitter.com/1.1/{endpoint}.json"
-        url = str(URL(url).with_query(sorted(params.items())))
+    async def _connect(self, method, endpoint, params=None):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self._event = None
+        self._data = []
+        url = f"{await self._get_streaming_base_url()}/api/v1/streaming/{endpoint}"
         await super()._connect(
-            method, url, headers=headers, body=body, oauth_client=oauth_client,
-            timeout=90
+            method, url, params=params, headers=headers, timeout=60
         )
 
-    def filter(self, *, follow=None, track=None, locations=None,
-               filter_level=None, languages=None, stall_warnings=False):
-        """Filter realtime Tweets
+    def _stream(self, endpoint, params=None):
+        if self.task is not None and not self.task.done():
+            raise TweepyException("Stream is already connected")
 
-        .. deprecated:: 4.10
-            `The delivery of compliance messages through the Twitter API v1.1
-            endpoint this method uses has been deprecated, and they will stop
-            being delivered beginning October 29, 2022.`_ Twitter API v2 can be
-            used instead with :meth:`AsyncStreamingClient.filter` and/or
-            :class:`AsyncClient` :ref:`batch compliance <Batch compliance>`
-            methods.
+        self._stream_key = _stream_key(endpoint, params)
+        self.task = asyncio.create_task(
+            self._connect("GET", endpoint, params=params)
+        )
+        # Use name parameter when support for Python 3.7 is dropped
+        return self.task
+
+    def user(self):
+        """Stream the statuses of the home timeline and the notifications of
+        the authenticating user
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
+
+        Returns
+        -------
+        asyncio.Task
+            The task running the stream
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#user
+        """
+        return self._stream("user")
+
+    def public(self, *, local=False, remote=False, only_media=False):
+        """Stream the public statuses known to the instance
 
         Parameters
         ----------
-        follow: list[int | str] | None
-            A list of user IDs, indicating the users to return statuses for in
-            the stream. See https://developer.twitter.com/en/docs/twitter-api/v1/tweets/filter-realtime/guides/basic-stream-parameters
-            for more information.
-        track: list[str] | None
-            Keywords to track. Phrases of keywords are specified by a list. See
-            https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/basic-stream-parameters
-            for more information.
-        locations: list[float] | None
-            Specifies a set of bounding boxes to track. See
-            https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/basic-stream-parameters
-            for more information.
-        filter_level : str | None
-            Setting this parameter to one of none, low, or medium will set the
-            minimum value of the filter_level Tweet attribute required to be
-            included in the stream. The default value is none, which includes
-            all available Tweets.
-
-            When displaying a stream of Tweets to end users (dashboards or live
-            feeds at a presentation or conference, for example) it is suggested
-            that you set this value to medium.
-        languages : list[str] | None
-            Setting this parameter to a comma-separated list of `BCP 47`_
-            language identifiers corresponding to any of the languages listed
-            on Twitter’s `advanced search`_ page will only return Tweets that
-            have been detected as being written in the specified languages. For
-            example, connecting with language=en will only stream Tweets
-            detected to be in the English language.
-        stall_warnings: bool | None
-            Specifies whether stall warnings should be delivered. See
-            https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/basic-stream-parameters
-            for more information.
+        local : bool
+            Only stream the statuses posted on the instance
+        remote : bool
+            Only stream the statuses posted on other instances
+        only_media : bool
+            Only stream the statuses with media attachments
 
         Raises
         ------
         TweepyException
-            When the stream is already connected or when the number of location
-            coordinates is not a multiple of 4
+            When the stream is already connected
 
         Returns
         -------
@@ -340,124 +840,479 @@ class AsyncStream(AsyncBaseStream):
 
         References
         ----------
-        https://developer.twitter.com/en/docs/twitter-api/v1/tweets/filter-realtime/api-reference/post-statuses-filter
-
-        .. _BCP 47: https://tools.ietf.org/html/bcp47
-        .. _advanced search: https://twitter.com/search-advanced
-        .. _The delivery of compliance messages through the Twitter API v1.1
-            endpoint this method uses has been deprecated, and they will stop
-            being delivered beginning October 29, 2022.: https://twittercommunity.com/t/deprecation-announcement-removing-compliance-messages-from-statuses-filter-and-retiring-statuses-sample-from-the-twitter-api-v1-1/170500
+        https://docs.joinmastodon.org/methods/streaming/#public
         """
-        if self.task is not None and not self.task.done():
-            raise TweepyException("Stream is already connected")
+        endpoint = "public"
+        if local:
+            endpoint += "/local"
+        elif remote:
+            endpoint += "/remote"
+        params = {"only_media": "true"} if only_media else None
+        return self._stream(endpoint, params=params)
 
-        endpoint = "statuses/filter"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-        body = {}
-        if follow is not None:
-            body["follow"] = ','.join(map(str, follow))
-        if track is not None:
-            body["track"] = ','.join(map(str, track))
-        if locations is not None:
-            if len(locations) % 4:
-                raise TweepyException(
-                    "Number of location coordinates should be a multiple of 4"
-                )
-            body["locations"] = ','.join(
-                f"{location:.4f}" for location in locations
-            )
-        if filter_level is not None:
-            body["filter_level"] = filter_level
-        if languages is not None:
-            body["language"] = ','.join(map(str, languages))
-        if stall_warnings:
-            body["stall_warnings"] = "true"
+    def hashtag(self, tag, *, local=False):
+        """Stream the public statuses with a hashtag
 
-        self.task = asyncio.create_task(
-            self._connect("POST", endpoint, headers=headers, body=body or None)
-        )
-        # Use name parameter when support for Python 3.7 is dropped
-        return self.task
+        Parameters
+        ----------
+        tag : str
+            The hashtag, with or without its leading ``#``
+        local : bool
+            Only stream the statuses posted on the instance
 
-    async def on_data(self, raw_data):
-        """|coroutine|
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
 
-        This is called when raw data is received from the stream.
-        This method handles sending the data to other methods, depending on the
-        message type.
+        Returns
+        -------
+        asyncio.Task
+            The task running the stream
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#hashtag
+        """
+        endpoint = "hashtag/local" if local else "hashtag"
+        return self._stream(endpoint, params={"tag": tag.lstrip("#")})
+
+    def list(self, list_id):
+        """Stream the statuses of a list of the authenticating user
 
         Parameters
         ----------
-        raw_data : JSON
-            The raw data from the stream
+        list_id : int | str
+            ID of the list
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
+
+        Returns
+        -------
+        asyncio.Task
+            The task running the stream
 
         References
         ----------
-        https://developer.twitter.com/en/docs/twitter-api/v1/tweets/filter-realtime/guides/streaming-message-types
+        https://docs.joinmastodon.org/methods/streaming/#list
         """
-        data = json.loads(raw_data)
+        return self._stream("list", params={"list": str(list_id)})
 
-        if "in_reply_to_status_id" in data:
-            status = Status.parse(None, data)
-            return await self.on_status(status)
-        if "disconnect" in data:
-            return await self.on_disconnect_message(data["disconnect"])
-        if "limit" in data:
-            return await self.on_limit(data["limit"]["track"])
-        if "warning" in data:
-            return await self.on_warning(data["warning"])
+    def filter(self, *, track=None, **kwargs):
+        """Stream the public statuses with a hashtag, or all of them
 
-        log.warning("Received unknown message type: %s", raw_data)
+        Kept for compatibility with Tweepy. Mastodon streams follow a single
+        hashtag, given as the only keyword of ``track``, and the other
+        parameters of Twitter's filter are not supported.
 
-    async def on_status(self, status):
+        Parameters
+        ----------
+        track : list[str] | None
+            The hashtag to stream
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected or when ``track`` contains
+            more than one keyword
+
+        Returns
+        -------
+        asyncio.Task
+            The task running the stream
+        """
+        if any(value for value in kwargs.values()):
+            log.warning(
+                '`follow`, `locations`, `filter_level`, `languages` and '
+                '`stall_warnings` are not implemented in tweepy-mastodon yet'
+            )
+        if not track:
+            return self.public()
+        if len(track) > 1:
+            raise TweepyException(
+                "Mastodon streams follow a single hashtag"
+            )
+        return self.hashtag(track[0])
+
+    def _resumed_streams(self):
+        return [self._stream_key]
+
+    async def _process_line(self, line):
+        # https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+        if not line:
+            # A blank line ends the event
+            if self._data:
+                event = self._event or "message"
+                payload = (
+                    self._data[0] if len(self._data) == 1
+                    else b"\n".join(self._data)
+                )
+                data = _decode_payload(self.decoder, event, payload)
+                data = self._receive(self._stream_key, None, event, data)
+                if data is not None:
+                    await self._enqueue(data)
+            self._event = None
+            self._data = []
+            return
+        field, value = _sse_field(line)
+        if field is None:
+            # Comments are sent as heartbeats
+            await self.on_keep_alive()
+        elif field == b"event":
+            self._event = bytes(value).decode("utf-8")
+        elif field == b"data":
+            self._data.append(value)
+
+    async def _handle(self, data):
+        await self.on_event(data.event, await self._convert(data))
+
+
+class AsyncMultiplexStream(AsyncBaseMastodonStream):
+    """Stream many Mastodon streams asynchronously over a single WebSocket
+    connection
+
+    The asyncio counterpart of :class:`tweepy_mastodon.MultiplexStream`.
+    Statuses are converted by :attr:`api`, so that the accounts they refer
+    to are fetched without blocking the event loop. The events are queued
+    before being handled, like those of :class:`AsyncStream`.
+
+    Parameters
+    ----------
+    consumer_key : str
+        Mastodon Client ID
+    consumer_secret : str
+        Mastodon Client Secret
+    access_token: str
+        Mastodon Access Token
+    access_token_secret : str | None
+        Unused, as Mastodon does not need it
+    api_base_url : str
+        Base URL of the Mastodon instance
+    streaming_base_url : str | None
+        Base URL of the streaming server of the instance, if it is not served
+        by the instance itself. By default, it is asked to the instance.
+    resume : bool
+        Whether or not to backfill the statuses posted while the stream was
+        reconnecting from the matching timeline
+    last_ids : dict[tuple, int | str] | None
+        The :attr:`last_ids` of a previous stream, to resume its streams
+        from the first connection
+    max_backfill : int
+        Maximum number of statuses to backfill per stream and reconnection
+    decoder : Callable[[bytes | memoryview | str], Any] | None
+        Decodes the JSON payloads. By default, orjson or ujson if installed,
+        else json.
+    raw : bool
+        Whether or not to pass the payloads to the ``on_*`` methods as
+        decoded, instead of converting them. The statuses backfilled after a
+        reconnection are still decoded by the API.
+    api : AsyncAPI | None
+        The :class:`AsyncAPI` used to convert the events, to share its
+        session. By default, one is created for the stream.
+    timeout : float
+        Number of seconds without any frame, including the pings sent by the
+        server, after which the connection is considered stalled
+    queue_size : int | None
+        Maximum number of events waiting to be handled. ``None`` handles
+        every event before reading the next one.
+    overflow : str
+        What to do with events when the queue is full: ``block``,
+        ``drop_oldest`` or ``spill``
+    handlers : int
+        Number of tasks handling the queued events concurrently
+    spill_directory : str | None
+        Directory of the file the ``spill`` policy writes to. By default,
+        the temporary directory.
+    max_retries: int | None
+        Number of times to attempt to (re)connect the stream.
+    proxy: str | None
+        URL of the proxy to use when connecting to the stream
+
+    Attributes
+    ----------
+    api : AsyncAPI
+        The API used to convert the events
+    last_ids : dict[tuple, int | str]
+        The ID of the last status handled from each stream, by stream
+    session : aiohttp.ClientSession | None
+        Aiohttp client session used to connect to the API
+    subscriptions : dict[tuple, Callable | None]
+        The handler of each subscribed stream, by stream
+    task : asyncio.Task | None
+        The task running the stream
+    user_agent : str
+        User agent used when connecting to the API
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_token,
+                 access_token_secret=None, *, api_base_url=None,
+                 streaming_base_url=None, api=None, timeout=90,
+                 queue_size=1000, **kwargs):
+        """__init__( \
+            consumer_key, consumer_secret, access_token, \
+            access_token_secret=None, *, api_base_url, \
+            streaming_base_url=None, resume=True, last_ids=None, \
+            max_backfill=1000, decoder=None, raw=False, api=None, \
+            timeout=90, queue_size=1000, overflow="block", handlers=1, \
+            spill_directory=None, \
+            max_retries=inf, proxy=None \
+        )
+        """
+        self.timeout = timeout
+        self.subscriptions = {}
+        self._ws = None
+        super().__init__(
+            consumer_key, consumer_secret, access_token, access_token_secret,
+            api_base_url=api_base_url, streaming_base_url=streaming_base_url,
+            api=api, queue_size=queue_size, **kwargs
+        )
+
+    async def subscribe(self, stream, *, tag=None, list_id=None,
+                        handler=None):
         """|coroutine|
 
-        This is called when a status is received.
+        Subscribe to a stream, or replace the handler of a stream already
+        subscribed to
 
         Parameters
         ----------
-        status : Status
-            The Status received
-        """
-        log.debug("Received status: %d", status.id)
+        stream : str
+            Name of the stream: ``user``, ``user:notification``, ``public``,
+            ``public:local``, ``public:remote``, ``public:media``,
+            ``hashtag``, ``hashtag:local``, ``list`` or ``direct``
+        tag : str | None
+            The hashtag of the ``hashtag`` streams, with or without its
+            leading ``#``
+        list_id : int | str | None
+            ID of the list of the ``list`` stream
+        handler : Callable[[str, Any], Awaitable[None]] | None
+            Coroutine function called with the type of each event of the
+            stream and its payload, converted like those passed to the
+            ``on_*`` methods. By default, the events are passed to the
+            ``on_*`` methods.
 
-    async def on_disconnect_message(self, message):
+        Returns
+        -------
+        tuple
+            The stream, as found in :attr:`subscriptions`
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#websocket
+        """
+        key = _subscription_key(stream, tag if tag is not None else list_id)
+        subscribed = key in self.subscriptions
+        self.subscriptions[key] = handler
+        if not subscribed:
+            await self._send(_subscription_message("subscribe", key))
+        return key
+
+    async def unsubscribe(self, stream, *, tag=None, list_id=None):
         """|coroutine|
 
-        This is called when a disconnect message is received.
+        Unsubscribe from a stream
 
         Parameters
         ----------
-        message : JSON
-            The disconnect message
+        stream : str
+            Name of the stream
+        tag : str | None
+            The hashtag of the ``hashtag`` streams
+        list_id : int | str | None
+            ID of the list of the ``list`` stream
+        """
+        key = _subscription_key(stream, tag if tag is not None else list_id)
+        if self.subscriptions.pop(key, False) is not False:
+            await self._send(_subscription_message("unsubscribe", key))
+
+    async def _send(self, message):
+        # The subscriptions are sent again on reconnection, so a message lost
+        # with the connection does not matter.
+        if self._ws is None or self._ws.closed:
+            return
+        try:
+            await self._ws.send_str(message)
+        except (aiohttp.ClientError, ConnectionError) as e:
+            log.debug("Failed to send %s: %s", message, e)
+
+    def connect(self):
+        """Connect to the streaming API and receive the events of the
+        subscribed streams
+
+        Returns
+        -------
+        asyncio.Task
+            The task running the stream
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
         """
-        log.warning("Received disconnect message: %s", message)
+        if self.task is not None and not self.task.done():
+            raise TweepyException("Stream is already connected")
 
-    async def on_limit(self, track):
+        self.task = asyncio.create_task(self._connect())
+        return self.task
+
+    async def _connect(self):
+        error_count = 0
+        network_error_wait = 0
+        network_error_wait_step = 0.25
+        network_error_wait_max = 16
+        http_error_wait = http_error_wait_start = 5
+        http_error_wait_max = 320
+        http_429_error_wait_start = 60
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(enable_cleanup_closed=True)
+            )
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "User-Agent": self.user_agent,
+        }
+        if hasattr(aiohttp, "ClientWSTimeout"):
+            # receive_timeout is deprecated since aiohttp 3.11
+            timeout = {"timeout": aiohttp.ClientWSTimeout(ws_receive=self.timeout)}
+        else:
+            timeout = {"receive_timeout": self.timeout}
+        self._start_handlers()
+
+        cancelled = False
+        try:
+            url = _websocket_url(await self._get_streaming_base_url())
+            while error_count <= self.max_retries:
+                try:
+                    async with self.session.ws_connect(
+                        url, headers=headers, proxy=self.proxy, **timeout
+                    ) as ws:
+                        self._ws = ws
+                        try:
+                            for key in list(self.subscriptions):
+                                await ws.send_str(
+                                    _subscription_message("subscribe", key)
+                                )
+
+                            error_count = 0
+                            http_error_wait = http_error_wait_start
+                            network_error_wait = 0
+
+                            await self.on_connect()
+                            await self._resume()
+
+                            async for message in ws:
+                                if message.type == aiohttp.WSMsgType.TEXT:
+                                    await self._process_message(message.data)
+                                elif message.type == aiohttp.WSMsgType.ERROR:
+                                    raise message.data
+                        finally:
+                            self._ws = None
+
+                    await self.on_closed(ws)
+                except aiohttp.WSServerHandshakeError as e:
+                    await self.on_request_error(e.status)
+                    log.error("HTTP error response text: %s", e.message)
+
+                    error_count += 1
+
+                    if e.status in (420, 429):
+                        if http_error_wait < http_429_error_wait_start:
+                            http_error_wait = http_429_error_wait_start
+
+                    await asyncio.sleep(http_error_wait)
+
+                    http_error_wait *= 2
+                    if http_error_wait > http_error_wait_max:
+                        http_error_wait = http_error_wait_max
+                except (aiohttp.ClientConnectionError,
+                        aiohttp.ClientPayloadError, asyncio.TimeoutError,
+                        ConnectionError) as e:
+                    await self.on_connection_error()
+                    log.error(
+                        "Connection error: %s",
+                        "".join(
+                            traceback.format_exception_only(type(e), e)
+                        ).rstrip()
+                    )
+
+                    await asyncio.sleep(network_error_wait)
+
+                    network_error_wait += network_error_wait_step
+                    if network_error_wait > network_error_wait_max:
+                        network_error_wait = network_error_wait_max
+        except asyncio.CancelledError:
+            cancelled = True
+            return
+        except Exception as e:
+            await self.on_exception(e)
+        finally:
+            await self.session.close()
+            await self._stop_handlers(drain=not cancelled)
+            if self._owns_api:
+                await self.api.close()
+            await self.on_disconnect()
+
+    async def _process_message(self, message):
+        message = self.decoder(message)
+        if "error" in message:
+            log.error(
+                "Received error from the streaming API: %s", message["error"]
+            )
+            return
+        stream = tuple(message.get("stream") or ())
+        event = message.get("event")
+        data = _decode_payload(self.decoder, event, message.get("payload"))
+        key = _subscription_key(*stream) if stream else None
+        data = self._receive(key, stream, event, data)
+        if data is not None:
+            await self._enqueue(data)
+
+    async def _handle(self, data):
+        await self.on_message(data.stream, data.event, await self._convert(data))
+
+    def _resumed_streams(self):
+        return list(self.subscriptions)
+
+    async def on_message(self, stream, event, data):
         """|coroutine|
 
-        This is called when a limit notice is received.
+        This is called when an event is received from the stream.
+        This method handles sending the event to the handler of the stream
+        it belongs to, or to :meth:`on_event`.
 
         Parameters
         ----------
-        track : int
-            Total count of the number of undelivered Tweets since the
-            connection was opened
+        stream : tuple[str, ...]
+            The stream of the event, as sent by Mastodon, such as
+            ``("hashtag", "python")``
+        event : str
+            The type of the event
+        data
+            The payload of the event, converted like the argument of the
+            ``on_*`` method it is sent to by default
         """
-        log.debug("Received limit notice: %d", track)
-
-    async def on_warning(self, notice):
+        handler = None
+        if stream:
+            handler = self.subscriptions.get(_subscription_key(*stream))
+        if handler is None:
+            return await self.on_event(event, data)
+        await handler(event, data)
+
+    async def on_closed(self, connection):
         """|coroutine|
 
-        This is called when a stall warning message is received.
+        This is called when the stream has been closed by Mastodon.
 
         Parameters
         ----------
-        warning : JSON
-            The stall warning
+        connection : aiohttp.ClientWebSocketResponse
+            The closed connection
         """
-        log.warning("Received stall warning: %s", notice)
+        log.error("Stream connection closed by Mastodon")
 
 
 class AsyncStreamingClient(AsyncBaseClient, AsyncBaseStream):
@@ -895,3 +1750,25 @@ class AsyncStreamingClient(AsyncBaseClient, AsyncBaseStream):
             The response received
         """
         log.debug("Received response: %s", response)
+
+
+def _timeline_endpoint(key):
+    stream = key[0]
+    if stream == "user":
+        return "/api/v1/timelines/home", {}
+    if stream.startswith("public"):
+        params = {}
+        if ":local" in stream:
+            params["local"] = True
+        if ":remote" in stream:
+            params["remote"] = True
+        if stream.endswith(":media"):
+            params["only_media"] = True
+        return "/api/v1/timelines/public", params
+    if stream.startswith("hashtag"):
+        params = {"local": True} if stream == "hashtag:local" else {}
+        return f"/api/v1/timelines/tag/{quote(key[1])}", params
+    if stream == "list":
+        return f"/api/v1/timelines/list/{key[1]}", {}
+    # Notifications and conversations have no timeline to backfill from
+    return None
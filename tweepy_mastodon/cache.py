@@ -2,37 +2,197 @@
 # Copyright 2009-2023 Joshua Roesslein
 # See LICENSE for details.
 
+from collections import OrderedDict
 import datetime
 import hashlib
+import heapq
+import json
 import logging
 import pickle
+import sqlite3
+import struct
+import sys
+import tempfile
 import threading
 import time
 import os
+import zlib
 
-try:
-    import fcntl
-except ImportError:
-    # Probably on a windows system
-    # TODO: use win32file
-    pass
+from mastodon import Mastodon
+from mastodon.utility import AttribAccessDict, AttribAccessList
 
 log = logging.getLogger(__name__)
 
 
+class Serializer:
+    """Cache value serializer interface
+
+    Serialized values start with a header identifying their format and its
+    version, so that values written in another format are treated as cache
+    misses instead of being misread. Values larger than ``compress_threshold``
+    bytes are compressed with zlib.
+    """
+
+    # Identifies the format, and its version, in the header
+    format = None
+
+    def __init__(self, compress_threshold=None, compress_level=6):
+        """Initialize the serializer
+            compress_threshold: size in bytes above which serialized values
+                are compressed [optional]
+            compress_level: zlib compression level, from 1 (fastest) to 9
+        """
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode(self, value):
+        """Serialize a value to bytes"""
+        raise NotImplementedError
+
+    def decode(self, data):
+        """Deserialize bytes returned by encode()"""
+        raise NotImplementedError
+
+    def dumps(self, value):
+        """Serialize a value, along with its header"""
+        data = self.encode(value)
+        if self.compress_threshold is not None and len(data) > self.compress_threshold:
+            return self.format + b'z' + zlib.compress(data, self.compress_level)
+        return self.format + b'-' + data
+
+    def loads(self, data):
+        """Deserialize a value returned by dumps()
+
+        Raises ValueError if the value was serialized in another format, or
+        cannot be deserialized, such as when it is truncated.
+        """
+        header = bytes(data[:3])
+        try:
+            if header == self.format + b'-':
+                return self.decode(data[3:])
+            if header == self.format + b'z':
+                return self.decode(zlib.decompress(data[3:]))
+        except Exception as e:
+            # The errors of the decoders and zlib do not share a base class
+            raise ValueError(f'Cannot deserialize with {type(self).__name__}: {e}') from e
+        raise ValueError(f'Not serialized by {type(self).__name__}: {header!r}')
+
+
+class PickleSerializer(Serializer):
+    """Serializes any picklable value
+
+    Only share a cache using it with trusted processes, as unpickling data
+    can execute arbitrary code.
+    """
+
+    format = b'P1'
+
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class JSONSerializer(Serializer):
+    """Serializes Mastodon payloads, as returned by Mastodon.py, to JSON
+
+    Payloads are rebuilt with the hooks Mastodon.py parses API responses
+    with, which restores their dates, IDs and attribute access, and the
+    pagination of a list of results is kept. Unlike pickled values, entries
+    do not depend on the layout of any class and are safe to share between
+    services.
+    """
+
+    format = b'J1'
+
+    PAGINATION_ATTRIBUTES = ('_pagination_next', '_pagination_prev')
+
+    @classmethod
+    def _wrap(cls, value):
+        # Lists are serialized natively, losing their attributes. Those at the top
+        # level, or directly in a top level dict, such as an API cache entry, are
+        # wrapped to keep them.
+        if isinstance(value, dict):
+            if any(isinstance(item, AttribAccessList) for item in value.values()):
+                return {key: cls._wrap_list(item) for key, item in value.items()}
+            return value
+        return cls._wrap_list(value)
+
+    @classmethod
+    def _wrap_list(cls, value):
+        if isinstance(value, AttribAccessList):
+            wrapper = {'__list__': value}
+            for attribute in cls.PAGINATION_ATTRIBUTES:
+                if getattr(value, attribute, None) is not None:
+                    wrapper[attribute] = getattr(value, attribute)
+            return wrapper
+        return value
+
+    @staticmethod
+    def _default(value):
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        raise TypeError(f'Object of type {type(value).__name__} is not serializable')
+
+    @classmethod
+    def _object_hook(cls, obj):
+        if '__list__' in obj:
+            value = AttribAccessList(obj['__list__'])
+            for attribute in cls.PAGINATION_ATTRIBUTES:
+                if attribute in obj:
+                    setattr(value, attribute, obj[attribute])
+            return value
+        return Mastodon._Mastodon__json_hooks(obj)
+
+    def encode(self, value):
+        return json.dumps(
+            self._wrap(value), default=self._default, ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data, object_hook=self._object_hook)
+
+
+class MsgpackSerializer(JSONSerializer):
+    """Serializes Mastodon payloads to MessagePack, which is more compact and
+    faster to parse than JSON
+
+    Requires the msgpack package.
+    """
+
+    format = b'M1'
+
+    def encode(self, value):
+        import msgpack
+
+        return msgpack.packb(self._wrap(value), default=self._default)
+
+    def decode(self, data):
+        import msgpack
+
+        return msgpack.unpackb(data, object_hook=self._object_hook, strict_map_key=False)
+
+
 class Cache:
     """Cache interface"""
 
-    def __init__(self, timeout=60):
+    def __init__(self, timeout=60, serializer=None):
         """Initialize the cache
             timeout: number of seconds to keep a cached entry
+            serializer: Serializer of the values, used by the caches storing
+                them outside of the process [optional, PickleSerializer by default]
         """
         self.timeout = timeout
+        self.serializer = serializer or PickleSerializer()
 
-    def store(self, key, value):
+    def store(self, key, value, timeout=None):
         """Add new record to cache
             key: entry key
             value: data of entry
+            timeout: number of seconds the entry will be read with, 0 for ever,
+                which the caches expiring entries on their own keep it for at
+                least [optional]
         """
         raise NotImplementedError
 
@@ -43,10 +203,33 @@ class Cache:
         """
         raise NotImplementedError
 
+    def store_many(self, items, timeout=None):
+        """Add several records to cache
+            items: iterable of (key, value) pairs
+            timeout: number of seconds the entries are read with [optional]
+        """
+        for key, value in items:
+            self.store(key, value, timeout)
+
+    def get_many(self, keys, timeout=None):
+        """Get several cached entries, None for the missing or expired ones
+            keys: which entries to get
+            timeout: override timeout with this value [optional]
+        """
+        return [self.get(key, timeout) for key in keys]
+
     def count(self):
         """Get count of entries currently stored in cache"""
         raise NotImplementedError
 
+    def _retention(self, timeout):
+        # Number of seconds to keep an entry read with `timeout` for, 0 for ever
+        if timeout is None:
+            return self.timeout
+        if timeout <= 0 or self.timeout <= 0:
+            return 0
+        return max(timeout, self.timeout)
+
     def cleanup(self):
         """Delete any expired entries in cache."""
         raise NotImplementedError
@@ -77,7 +260,7 @@ class MemoryCache(Cache):
     def _is_expired(self, entry, timeout):
         return timeout > 0 and (time.time() - entry[0]) >= timeout
 
-    def store(self, key, value):
+    def store(self, key, value, timeout=None):
         self.lock.acquire()
         self._entries[key] = (time.time(), value)
         self.lock.release()
@@ -125,142 +308,620 @@ class MemoryCache(Cache):
         self.lock.release()
 
 
-class FileCache(Cache):
-    """File-based cache"""
+class BoundedMemoryCache(Cache):
+    """Size-bounded in-memory cache
 
-    # locks used to make cache thread-safe
-    cache_locks = {}
+    The least recently used entries are evicted once ``maxsize`` entries, or
+    approximately ``max_bytes`` bytes of pickled values, are cached. Like
+    :class:`MemoryCache`, entries only expire when they are read, against the
+    timeout of the read, or by ``cleanup()``, which reclaims them through a
+    heap ordered by expiry time instead of by scanning every entry.
+    """
 
-    def __init__(self, cache_dir, timeout=60):
+    def __init__(self, timeout=60, maxsize=1000, max_bytes=None):
+        """Initialize the cache
+            timeout: number of seconds to keep a cached entry
+            maxsize: maximum number of entries to keep
+            max_bytes: approximate maximum size of the cached values, measured
+                by their pickled size [optional]
+        """
         Cache.__init__(self, timeout)
-        if os.path.exists(cache_dir) is False:
-            os.mkdir(cache_dir)
-        self.cache_dir = cache_dir
-        if cache_dir in FileCache.cache_locks:
-            self.lock = FileCache.cache_locks[cache_dir]
-        else:
-            self.lock = threading.Lock()
-            FileCache.cache_locks[cache_dir] = self.lock
-
-        if os.name == 'posix':
-            self._lock_file = self._lock_file_posix
-            self._unlock_file = self._unlock_file_posix
-        elif os.name == 'nt':
-            self._lock_file = self._lock_file_win32
-            self._unlock_file = self._unlock_file_win32
-        else:
-            log.warning('FileCache locking not supported on this system!')
-            self._lock_file = self._lock_file_dummy
-            self._unlock_file = self._unlock_file_dummy
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        # key -> (time stored, value, size, retention)
+        self._entries = OrderedDict()
+        # (expiry time, time stored, key), with stale items skipped on pop
+        self._expiry = []
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
 
-    def _get_path(self, key):
-        md5 = hashlib.md5()
-        md5.update(key.encode('utf-8'))
-        return os.path.join(self.cache_dir, md5.hexdigest())
+    def __getstate__(self):
+        # pickle
+        return {
+            'entries': self._entries, 'timeout': self.timeout,
+            'maxsize': self.maxsize, 'max_bytes': self.max_bytes
+        }
 
-    def _lock_file_dummy(self, path, exclusive=True):
-        return None
+    def __setstate__(self, state):
+        # unpickle
+        self.__init__(state['timeout'], state['maxsize'], state['max_bytes'])
+        # Entries pickled by previous versions have no retention
+        self._entries = OrderedDict(
+            (key, entry if len(entry) == 4 else (*entry, self.timeout))
+            for key, entry in state['entries'].items()
+        )
+        self.size = sum(entry[2] for entry in self._entries.values())
+        self._rebuild_expiry()
+
+    def _sizeof(self, value):
+        if self.max_bytes is None:
+            return 0
+        try:
+            return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return sys.getsizeof(value)
+
+    def _is_expired(self, entry, timeout, now):
+        return timeout > 0 and (now - entry[0]) >= timeout
+
+    def _remove(self, key):
+        # The lock must be held by the caller
+        entry = self._entries.pop(key)
+        self.size -= entry[2]
+
+    def _rebuild_expiry(self):
+        # The lock must be held by the caller
+        self._expiry = [
+            (stored + retention, stored, key)
+            for key, (stored, _, _, retention) in self._entries.items() if retention > 0
+        ]
+        heapq.heapify(self._expiry)
+
+    def _expire(self, now):
+        # The lock must be held by the caller
+        while self._expiry and self._expiry[0][0] <= now:
+            _, stored, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            # Skip the items of entries which were replaced or evicted since
+            if entry is not None and entry[0] == stored:
+                self._remove(key)
+                self.expirations += 1
+        self._compact_expiry()
+
+    def _compact_expiry(self):
+        # The lock must be held by the caller
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._rebuild_expiry()
+
+    def store(self, key, value, timeout=None):
+        size = self._sizeof(value)
+        retention = self._retention(timeout)
+        with self.lock:
+            now = time.time()
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now, value, size, retention)
+            self.size += size
+            if retention > 0:
+                heapq.heappush(self._expiry, (now + retention, now, key))
+                # Drop the items of the replaced and evicted entries
+                self._compact_expiry()
+            while self._entries and (
+                len(self._entries) > self.maxsize
+                or self.max_bytes is not None and self.size > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
 
-    def _unlock_file_dummy(self, lock):
-        return
+    def get(self, key, timeout=None):
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
 
-    def _lock_file_posix(self, path, exclusive=True):
-        lock_path = path + '.lock'
-        if exclusive is True:
-            f_lock = open(lock_path, 'w')
-            fcntl.lockf(f_lock, fcntl.LOCK_EX)
-        else:
-            f_lock = open(lock_path, 'r')
-            fcntl.lockf(f_lock, fcntl.LOCK_SH)
-        if os.path.exists(lock_path) is False:
-            f_lock.close()
+            # use provided timeout in arguments if provided
+            # otherwise use the one provided during init.
+            if timeout is None:
+                timeout = self.timeout
+            if self._is_expired(entry, timeout, time.time()):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def count(self):
+        return len(self._entries)
+
+    def cleanup(self):
+        with self.lock:
+            self._expire(time.time())
+
+    def flush(self):
+        with self.lock:
+            self._entries.clear()
+            self._expiry = []
+            self.size = 0
+
+    def stats(self):
+        """Get the hit, miss, eviction and expiration counts, along with the
+        number of entries and their approximate size in bytes"""
+        with self.lock:
+            return {
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'count': len(self._entries), 'bytes': self.size,
+            }
+
+
+class ShardedMemoryCache(Cache):
+    """In-memory cache for many concurrent threads
+
+    Entries are spread over ``shards`` dicts, each with its own lock, so that
+    threads storing different keys rarely wait for each other. Reads of
+    entries which have not expired take no lock at all, as a single dict
+    lookup is atomic.
+    """
+
+    def __init__(self, timeout=60, shards=16):
+        """Initialize the cache
+            timeout: number of seconds to keep a cached entry
+            shards: number of independently locked partitions
+        """
+        Cache.__init__(self, timeout)
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def __getstate__(self):
+        # pickle
+        return {
+            'entries': [entries for entries, _ in self._shards],
+            'timeout': self.timeout
+        }
+
+    def __setstate__(self, state):
+        # unpickle
+        self.timeout = state['timeout']
+        self._shards = [(entries, threading.Lock()) for entries in state['entries']]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _is_expired(self, entry, timeout):
+        return timeout > 0 and (time.time() - entry[0]) >= timeout
+
+    def store(self, key, value, timeout=None):
+        entries, lock = self._shard(key)
+        with lock:
+            entries[key] = (time.time(), value)
+
+    def get(self, key, timeout=None):
+        entries, lock = self._shard(key)
+        entry = entries.get(key)
+        if entry is None:
             return None
-        return f_lock
 
-    def _unlock_file_posix(self, lock):
-        lock.close()
+        # use provided timeout in arguments if provided
+        # otherwise use the one provided during init.
+        if timeout is None:
+            timeout = self.timeout
+        if not self._is_expired(entry, timeout):
+            return entry[1]
 
-    def _lock_file_win32(self, path, exclusive=True):
-        # TODO: implement
+        with lock:
+            # Only delete the entry if it was not replaced in the meantime
+            if entries.get(key) is entry:
+                del entries[key]
         return None
 
-    def _unlock_file_win32(self, lock):
-        # TODO: implement
-        return
+    def count(self):
+        return sum(len(entries) for entries, _ in self._shards)
 
-    def _delete_file(self, path):
-        os.remove(path)
-        if os.path.exists(path + '.lock'):
-            os.remove(path + '.lock')
+    def cleanup(self):
+        for entries, lock in self._shards:
+            with lock:
+                for k, v in list(entries.items()):
+                    if self._is_expired(v, self.timeout):
+                        del entries[k]
 
-    def store(self, key, value):
-        path = self._get_path(key)
-        self.lock.acquire()
+    def flush(self):
+        for entries, lock in self._shards:
+            with lock:
+                entries.clear()
+
+
+class FileCache(Cache):
+    """File-based cache
+
+    Entries are spread over 256 subdirectories named after the first two hex
+    digits of the hash of their key, so that no directory grows too large.
+    An entry is written to a temporary file which then atomically replaces
+    the previous one, so readers never see a partially written entry and no
+    locks are needed, even across processes. The modification time of an
+    entry file is its time of storage: expired entries are found by
+    ``cleanup()`` from the directory listings alone, without reading them.
+
+    Once ``max_size`` bytes are cached, ``cleanup()`` also evicts the oldest
+    entries until the cache fits again.
+
+    The entries, and lock files, left at the top of ``cache_dir`` by earlier
+    versions are unreadable in this layout, and are deleted by ``cleanup()``
+    and ``flush()``.
+    """
+
+    # Temporary files older than this were left behind by a crashed writer
+    TEMP_TIMEOUT = 60 * 60
+
+    def __init__(self, cache_dir, timeout=60, max_size=None, serializer=None):
+        """Initialize the cache
+            cache_dir: directory to store the entries in
+            timeout: number of seconds to keep a cached entry
+            max_size: maximum total size of the entry files in bytes [optional]
+            serializer: Serializer of the values [optional]
+        """
+        Cache.__init__(self, timeout, serializer)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_path(self, key):
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _shards(self):
+        for entry in os.scandir(self.cache_dir):
+            if len(entry.name) == 2 and entry.is_dir():
+                yield entry.path
+
+    def _legacy_files(self):
+        """Yield the path of every file of the flat layout of earlier versions,
+        named after the MD5 hash of its key"""
+        for entry in os.scandir(self.cache_dir):
+            name = entry.name
+            if name.endswith('.lock'):
+                name = name[:-len('.lock')]
+            if len(name) == 32 and not name.strip('0123456789abcdef') and entry.is_file():
+                yield entry.path
+
+    def _entries(self):
+        """Yield the os.DirEntry of every entry and temporary file"""
+        for shard in self._shards():
+            try:
+                yield from os.scandir(shard)
+            except FileNotFoundError:
+                # Removed by a concurrent flush()
+                continue
+
+    @staticmethod
+    def _remove(path, stat=None):
+        """Delete an entry file, unless it was replaced since ``stat``"""
         try:
-            # acquire lock and open file
-            f_lock = self._lock_file(path)
-            datafile = open(path, 'wb')
+            if stat is not None and os.stat(path).st_ino != stat.st_ino:
+                return
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
-            # write data
-            pickle.dump((time.time(), value), datafile)
+    def _is_expired(self, mtime, timeout, now):
+        return timeout > 0 and (now - mtime) >= timeout
 
-            # close and unlock file
-            datafile.close()
-            self._unlock_file(f_lock)
-        finally:
-            self.lock.release()
+    def store(self, key, value, timeout=None):
+        data = self.serializer.dumps(value)
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as datafile:
+                datafile.write(data)
+            now = time.time()
+            os.utime(temp_path, (now, now))
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
 
     def get(self, key, timeout=None):
-        return self._get(self._get_path(key), timeout)
-
-    def _get(self, path, timeout):
-        if os.path.exists(path) is False:
-            # no record
-            return None
-        self.lock.acquire()
+        path = self._get_path(key)
         try:
-            # acquire lock and open
-            f_lock = self._lock_file(path, False)
             datafile = open(path, 'rb')
+        except FileNotFoundError:
+            # no record
+            return None
+        with datafile:
+            stat = os.fstat(datafile.fileno())
 
-            # read pickled object
-            created_time, value = pickle.load(datafile)
-            datafile.close()
-
-            # check if value is expired
+            # use provided timeout in arguments if provided
+            # otherwise use the one provided during init.
             if timeout is None:
                 timeout = self.timeout
-            if timeout > 0:
-                if (time.time() - created_time) >= timeout:
-                    # expired! delete from cache
-                    value = None
-                    self._delete_file(path)
-
-            # unlock and return result
-            self._unlock_file(f_lock)
-            return value
-        finally:
-            self.lock.release()
+            if self._is_expired(stat.st_mtime, timeout, time.time()):
+                # expired! delete from cache
+                self._remove(path, stat)
+                return None
+
+            try:
+                return self.serializer.loads(datafile.read())
+            except Exception:
+                # Written in another format
+                log.warning(f'Deleting unreadable cache entry {path}')
+                self._remove(path, stat)
+                return None
 
     def count(self):
-        c = 0
-        for entry in os.listdir(self.cache_dir):
-            if entry.endswith('.lock'):
-                continue
-            c += 1
-        return c
+        return sum(1 for entry in self._entries() if not entry.name.endswith('.tmp'))
 
     def cleanup(self):
-        for entry in os.listdir(self.cache_dir):
-            if entry.endswith('.lock'):
+        for path in self._legacy_files():
+            self._remove(path)
+        now = time.time()
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
                 continue
-            self._get(os.path.join(self.cache_dir, entry), None)
+            if entry.name.endswith('.tmp'):
+                if now - stat.st_mtime >= self.TEMP_TIMEOUT:
+                    self._remove(entry.path, stat)
+            elif self._is_expired(stat.st_mtime, self.timeout, now):
+                self._remove(entry.path, stat)
+            elif self.max_size is not None:
+                entries.append((stat.st_mtime, entry.path, stat))
+
+        if self.max_size is not None:
+            size = sum(stat.st_size for _, _, stat in entries)
+            # Evict the oldest entries first
+            entries.sort(key=lambda entry: entry[0])
+            for _, path, stat in entries:
+                if size <= self.max_size:
+                    break
+                self._remove(path, stat)
+                size -= stat.st_size
 
     def flush(self):
-        for entry in os.listdir(self.cache_dir):
-            if entry.endswith('.lock'):
-                continue
-            self._delete_file(os.path.join(self.cache_dir, entry))
+        for path in self._legacy_files():
+            self._remove(path)
+        for entry in self._entries():
+            if not entry.name.endswith('.tmp'):
+                self._remove(entry.path)
+
+
+class SQLiteCache(Cache):
+    """Cache stored in a single SQLite database file
+
+    The database is in write-ahead logging mode, so that any number of
+    threads and processes can share it: readers are never blocked, and
+    writers wait up to ``busy_timeout`` seconds for each other. Entries are
+    indexed by time of storage, so ``cleanup()`` is a single indexed delete,
+    and their number is kept up to date by triggers, so ``count()`` does not
+    scan the table.
+    """
+
+    def __init__(self, path, timeout=60, busy_timeout=30, serializer=None):
+        """Initialize the cache
+            path: path of the database file
+            timeout: number of seconds to keep a cached entry
+            busy_timeout: number of seconds to wait for the database to be
+                unlocked by another writer
+            serializer: Serializer of the values [optional]
+        """
+        Cache.__init__(self, timeout, serializer)
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    stored REAL NOT NULL,
+                    value BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_stored ON entries (stored);
+                CREATE TABLE IF NOT EXISTS entry_count (count INTEGER NOT NULL);
+                INSERT INTO entry_count SELECT 0 WHERE NOT EXISTS (SELECT * FROM entry_count);
+                CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+                    BEGIN UPDATE entry_count SET count = count + 1; END;
+                CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+                    BEGIN UPDATE entry_count SET count = count - 1; END;
+            """)
+
+    def __getstate__(self):
+        # pickle
+        return {
+            'path': self.path, 'timeout': self.timeout,
+            'busy_timeout': self.busy_timeout, 'serializer': self.serializer
+        }
+
+    def __setstate__(self, state):
+        # unpickle
+        self.__init__(state['path'], state['timeout'], state['busy_timeout'], state['serializer'])
+
+    def _connection(self):
+        # SQLite connections can be shared by neither threads nor processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def store(self, key, value, timeout=None):
+        blob = self.serializer.dumps(value)
+        with self._connection() as connection:
+            # An upsert, unlike INSERT OR REPLACE, keeps the count triggers right
+            connection.execute(
+                'INSERT INTO entries (key, stored, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET stored = excluded.stored, value = excluded.value',
+                (key, time.time(), blob)
+            )
+
+    def get(self, key, timeout=None):
+        connection = self._connection()
+        row = connection.execute('SELECT stored, value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            # no hit, return nothing
+            return None
+
+        # use provided timeout in arguments if provided
+        # otherwise use the one provided during init.
+        if timeout is None:
+            timeout = self.timeout
+        stored, blob = row
+        if timeout > 0 and (time.time() - stored) >= timeout:
+            # entry expired, delete it unless it was replaced in the meantime
+            self._delete(connection, key, stored)
+            return None
+        try:
+            return self.serializer.loads(blob)
+        except ValueError:
+            # written in another format
+            self._delete(connection, key, stored)
+            return None
+
+    @staticmethod
+    def _delete(connection, key, stored):
+        with connection:
+            connection.execute('DELETE FROM entries WHERE key = ? AND stored = ?', (key, stored))
+
+    def count(self):
+        return self._connection().execute('SELECT count FROM entry_count').fetchone()[0]
+
+    def cleanup(self):
+        if self.timeout <= 0:
+            return
+        with self._connection() as connection:
+            connection.execute('DELETE FROM entries WHERE stored <= ?', (time.time() - self.timeout,))
+
+    def flush(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM entries')
+
+    def close(self):
+        """Close the database connection of the calling thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class AccountCache:
+    """Bounded in-memory cache of Mastodon accounts
+
+    Accounts are indexed both by ID and by ``acct`` and are namespaced by the
+    Mastodon instance they were fetched from, since account IDs are only
+    unique per instance. Entries expire after ``timeout`` seconds and the
+    least recently used entries are evicted once ``maxsize`` accounts are
+    cached. A ``maxsize`` of 0 disables the cache.
+    """
+
+    def __init__(self, timeout=300, maxsize=10000):
+        """Initialize the cache
+            timeout: number of seconds to keep a cached account
+            maxsize: maximum number of accounts to keep
+        """
+        self.timeout = timeout
+        self.maxsize = maxsize
+        # (instance, account ID) -> (time, account), in least recently used order
+        self._entries = OrderedDict()
+        # (instance, lowercased acct) -> account ID
+        self._accts = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _is_expired(self, entry):
+        return self.timeout > 0 and (time.time() - entry[0]) >= self.timeout
+
+    @staticmethod
+    def _key(instance, account_id):
+        # Mastodon.py turns numeric IDs into ints, but callers may pass strings
+        if isinstance(account_id, str) and account_id.isdigit():
+            account_id = int(account_id)
+        return instance, account_id
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._accts.pop((key[0], entry[1]['acct'].lower()), None)
+
+    def store(self, instance, account):
+        """Add or refresh an account
+            instance: base URL of the instance the account was fetched from
+            account: the account as returned by Mastodon.py
+        """
+        if self.maxsize <= 0:
+            return
+        key = self._key(instance, account['id'])
+        with self.lock:
+            self._remove(key)
+            self._entries[key] = (time.time(), AttribAccessDict(account))
+            self._accts[(instance, account['acct'].lower())] = key[1]
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def _get(self, key):
+        # The lock must be held by the caller
+        entry = self._entries.get(key)
+        if entry is not None and self._is_expired(entry):
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return AttribAccessDict(entry[1])
+
+    def get(self, instance, account_id):
+        """Get a copy of a cached account if it exists and is not expired
+            instance: base URL of the instance the account was fetched from
+            account_id: ID of the account
+        """
+        with self.lock:
+            return self._get(self._key(instance, account_id))
+
+    def get_by_acct(self, instance, acct):
+        """Get a copy of a cached account by its ``acct``
+            instance: base URL of the instance the account was fetched from
+            acct: ``username`` or ``username@domain`` of the account
+        """
+        with self.lock:
+            return self._get((instance, self._accts.get((instance, acct.lower()))))
+
+    def invalidate(self, instance, account_id):
+        """Drop an account, e.g. after following, muting or blocking it"""
+        with self.lock:
+            self._remove(self._key(instance, account_id))
+
+    def count(self):
+        """Get count of accounts currently stored in cache"""
+        return len(self._entries)
+
+    def cleanup(self):
+        """Delete any expired accounts in cache."""
+        with self.lock:
+            for key, entry in list(self._entries.items()):
+                if self._is_expired(entry):
+                    self._remove(key)
+
+    def flush(self):
+        """Delete all cached accounts and reset the counters"""
+        with self.lock:
+            self._entries.clear()
+            self._accts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Shared by every API instance in the process
+account_cache = AccountCache()
 
 
 class MemCacheCache(Cache):
@@ -274,12 +935,13 @@ class MemCacheCache(Cache):
         self.client = client
         self.timeout = timeout
 
-    def store(self, key, value):
+    def store(self, key, value, timeout=None):
         """Add new record to cache
             key: entry key
             value: data of entry
+            timeout: number of seconds the entry is read with [optional]
         """
-        self.client.set(key, value, time=self.timeout)
+        self.client.set(key, value, time=self._retention(timeout))
 
     def get(self, key, timeout=None):
         """Get cached entry if exists and not expired
@@ -303,125 +965,227 @@ class MemCacheCache(Cache):
 
 
 class RedisCache(Cache):
-    """Cache running in a redis server"""
+    """Cache running in a redis server
+
+    Entries expire through native Redis TTLs, so there is nothing to clean
+    up and no index of the keys to maintain. Maintenance commands walk the
+    keys with ``SCAN`` and delete them with ``UNLINK`` in batches of
+    ``scan_count``, so that they never block the server for long.
+    """
+
+    # Entries are the time they were stored followed by the serialized value
+    TIME_FORMAT = struct.Struct('!d')
 
     def __init__(self, client,
                  timeout=60,
                  keys_container='tweepy:keys',
-                 pre_identifier='tweepy:'):
-        Cache.__init__(self, timeout)
+                 pre_identifier='tweepy:',
+                 serializer=None,
+                 scan_count=1000):
+        """Initialize the cache
+            client: the redis client
+            timeout: number of seconds to keep a cached entry
+            keys_container: set of the keys kept by previous versions, which
+                is deleted by flush()
+            pre_identifier: prefix of the keys of the entries
+            serializer: Serializer of the values [optional]
+            scan_count: number of keys to scan or delete per command
+        """
+        Cache.__init__(self, timeout, serializer)
         self.client = client
         self.keys_container = keys_container
         self.pre_identifier = pre_identifier
+        self.scan_count = scan_count
 
     def _is_expired(self, entry, timeout):
         # Returns true if the entry has expired
         return timeout > 0 and (time.time() - entry[0]) >= timeout
 
-    def store(self, key, value):
+    def _parse(self, data):
+        # Returns the time an entry was stored along with its serialized value
+        try:
+            return self.TIME_FORMAT.unpack_from(data)[0], data[self.TIME_FORMAT.size:]
+        except struct.error:
+            raise ValueError('Truncated cache entry')
+
+    def _set(self, client, key, value, timeout):
+        data = self.TIME_FORMAT.pack(time.time()) + self.serializer.dumps(value)
+        retention = self._retention(timeout)
+        if retention > 0:
+            # Redis TTLs are whole milliseconds
+            client.set(self.pre_identifier + key, data, px=max(1, int(retention * 1000)))
+        else:
+            client.set(self.pre_identifier + key, data)
+
+    def _load(self, key, data, timeout):
+        # Returns the value of an entry, or None if it is expired or unreadable
+        if not data:
+            return None
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            entry = self._parse(data)
+            # A timeout shorter than the TTL can still expire the entry
+            if self._is_expired(entry, timeout):
+                return None
+            return self.serializer.loads(entry[1])
+        except ValueError:
+            # entry written in another format
+            self.delete_entry(key)
+            return None
+
+    def _scan(self):
+        # Yields the keys of the entries in batches
+        pattern = ''.join('\\' + c if c in '*?[]\\' else c for c in self.pre_identifier) + '*'
+        batch = []
+        for key in self.client.scan_iter(match=pattern, count=self.scan_count):
+            batch.append(key)
+            if len(batch) >= self.scan_count:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def store(self, key, value, timeout=None):
         """Store the key, value pair in our redis server"""
-        # Prepend tweepy to our key,
-        # this makes it easier to identify tweepy keys in our redis server
-        key = self.pre_identifier + key
-        # Get a pipe (to execute several redis commands in one step)
-        pipe = self.client.pipeline()
-        # Set our values in a redis hash (similar to python dict)
-        pipe.set(key, pickle.dumps((time.time(), value)))
-        # Set the expiration
-        pipe.expire(key, self.timeout)
-        # Add the key to a set containing all the keys
-        pipe.sadd(self.keys_container, key)
-        # Execute the instructions in the redis server
+        self._set(self.client, key, value, timeout)
+
+    def store_many(self, items, timeout=None):
+        """Store several key, value pairs in a single round trip
+            items: iterable of (key, value) pairs
+            timeout: number of seconds the entries are read with [optional]
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items:
+            self._set(pipe, key, value, timeout)
         pipe.execute()
 
     def get(self, key, timeout=None):
         """Given a key, returns an element from the redis table"""
         key = self.pre_identifier + key
-        # Check to see if we have this key
-        unpickled_entry = self.client.get(key)
-        if not unpickled_entry:
-            # No hit, return nothing
-            return None
+        return self._load(key, self.client.get(key), timeout)
 
-        entry = pickle.loads(unpickled_entry)
-        # Use provided timeout in arguments if provided
-        # otherwise use the one provided during init.
-        if timeout is None:
-            timeout = self.timeout
-
-        # Make sure entry is not expired
-        if self._is_expired(entry, timeout):
-            # entry expired, delete and return nothing
-            self.delete_entry(key)
-            return None
-        # entry found and not expired, return it
-        return entry[1]
+    def get_many(self, keys, timeout=None):
+        """Get several entries in a single round trip, None for the missing or
+        expired ones
+            keys: which entries to get
+            timeout: override timeout with this value [optional]
+        """
+        keys = [self.pre_identifier + key for key in keys]
+        if not keys:
+            return []
+        return [self._load(key, data, timeout) for key, data in zip(keys, self.client.mget(keys))]
 
     def count(self):
-        """Note: This is not very efficient,
-        since it retrieves all the keys from the redis
-        server to know how many keys we have"""
-        return len(self.client.smembers(self.keys_container))
+        """Note: This scans every key of the cache, without blocking the
+        server"""
+        return sum(len(batch) for batch in self._scan())
 
     def delete_entry(self, key):
         """Delete an object from the redis table"""
-        pipe = self.client.pipeline()
-        pipe.srem(self.keys_container, key)
-        pipe.delete(key)
-        pipe.execute()
+        self.client.unlink(key)
 
     def cleanup(self):
-        """Cleanup all the expired keys"""
-        keys = self.client.smembers(self.keys_container)
-        for key in keys:
-            entry = self.client.get(key)
-            if entry:
-                entry = pickle.loads(entry)
-                if self._is_expired(entry, self.timeout):
-                    self.delete_entry(key)
+        """Redis deletes the expired keys on its own"""
+        pass
 
     def flush(self):
         """Delete all entries from the cache"""
-        keys = self.client.smembers(self.keys_container)
-        for key in keys:
-            self.delete_entry(key)
+        for batch in self._scan():
+            self.client.unlink(*batch)
+        self.client.unlink(self.keys_container)
 
 
 class MongodbCache(Cache):
-    """A simple pickle-based MongoDB cache system."""
+    """A simple MongoDB cache system.
+
+    MongoDB deletes expired entries in the background, up to a minute late,
+    so expiry is also checked whenever an entry is read or counted. Each entry
+    expires at its own ``expires`` time, which is None for those kept for ever.
+    """
 
-    def __init__(self, db, timeout=3600, collection='tweepy_cache'):
+    def __init__(self, db, timeout=3600, collection='tweepy_cache', serializer=None):
         """Should receive a "database" cursor from pymongo."""
-        Cache.__init__(self, timeout)
+        Cache.__init__(self, timeout, serializer)
         self.timeout = timeout
         self.col = db[collection]
-        self.col.create_index('created', expireAfterSeconds=timeout)
+        self._create_index()
+
+    def _create_index(self):
+        indexes = self.col.index_information()
+        if 'created_1' in indexes:
+            # Previous versions expired the entries with the TTL index of the
+            # timeout they were created with, and did not store their expiry
+            self.col.drop_index('created_1')
+            self.col.delete_many({'expires': {'$exists': False}})
+        if 'expires_1' in indexes and indexes['expires_1'].get('expireAfterSeconds') != 0:
+            # Options of an existing index cannot be changed by create_index()
+            self.col.drop_index('expires_1')
+        # Documents without an expiry time are left alone by the TTL monitor
+        self.col.create_index('expires', expireAfterSeconds=0)
+
+    @staticmethod
+    def _now():
+        # BSON dates are read back as naive UTC datetimes
+        return datetime.datetime.fromtimestamp(time.time(), datetime.timezone.utc).replace(tzinfo=None)
+
+    def _is_expired(self, obj, timeout):
+        created = obj['created']
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=datetime.timezone.utc)
+        return timeout > 0 and (time.time() - created.timestamp()) >= timeout
+
+    def _load(self, obj, timeout):
+        if obj is None:
+            return None
+        if timeout is None:
+            timeout = self.timeout
+        if self._is_expired(obj, timeout):
+            return None
+        try:
+            return self.serializer.loads(obj['value'])
+        except ValueError:
+            # written in another format
+            return None
 
-    def store(self, key, value):
+    def _update(self, key, value, now, timeout):
         from bson.binary import Binary
 
-        now = datetime.datetime.utcnow()
-        blob = Binary(pickle.dumps(value))
+        blob = Binary(self.serializer.dumps(value))
+        retention = self._retention(timeout)
+        expires = now + datetime.timedelta(seconds=retention) if retention > 0 else None
+        return {'_id': key}, {'$set': {'created': now, 'expires': expires, 'value': blob}}
+
+    def store(self, key, value, timeout=None):
+        self.col.update_one(*self._update(key, value, self._now(), timeout), upsert=True)
 
-        self.col.insert({'created': now, '_id': key, 'value': blob})
+    def store_many(self, items, timeout=None):
+        from pymongo import UpdateOne
+
+        now = self._now()
+        requests = [UpdateOne(*self._update(key, value, now, timeout), upsert=True) for key, value in items]
+        if requests:
+            self.col.bulk_write(requests, ordered=False)
 
     def get(self, key, timeout=None):
-        if timeout:
-            raise NotImplementedError
-        obj = self.col.find_one({'_id': key})
-        if obj:
-            return pickle.loads(obj['value'])
+        return self._load(self.col.find_one({'_id': key}), timeout)
+
+    def get_many(self, keys, timeout=None):
+        keys = list(keys)
+        objs = {obj['_id']: obj for obj in self.col.find({'_id': {'$in': keys}})}
+        return [self._load(objs.get(key), timeout) for key in keys]
 
     def count(self):
-        return self.col.find({}).count()
+        return self.col.count_documents({'$or': [{'expires': None}, {'expires': {'$gt': self._now()}}]})
 
     def delete_entry(self, key):
-        return self.col.remove({'_id': key})
+        return self.col.delete_one({'_id': key})
 
     def cleanup(self):
-        """MongoDB will automatically clear expired keys."""
-        pass
+        """MongoDB will automatically clear expired keys, this clears them
+        without waiting."""
+        self.col.delete_many({'expires': {'$lte': self._now()}})
 
     def flush(self):
         self.col.drop()
-        self.col.create_index('created', expireAfterSeconds=self.timeout)
+        self._create_index()
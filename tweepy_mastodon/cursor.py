@@ -2,10 +2,14 @@
 # Copyright 2009-2023 Joshua Roesslein
 # See LICENSE for details.
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
 from math import inf
 
 from tweepy_mastodon.errors import TweepyException
-from tweepy_mastodon.parsers import ModelParser, RawParser
+from tweepy_mastodon.models import ResultSet
+from tweepy_mastodon.utils import LINK_PARAMS, pagination_params
 
 
 class Cursor:
@@ -20,6 +24,11 @@ class Cursor:
         Positional arguments to pass to ``method``
     kwargs
         Keyword arguments to pass to ``method``
+
+    Methods paginated through Mastodon's ``Link`` header also accept
+    ``prefetch=True``, which fetches the next page in the background while the
+    current one is being processed. Call ``close()`` on the iterator to stop
+    prefetching when it is left before its end.
     """
 
     def __init__(self, method, *args, **kwargs):
@@ -30,6 +39,8 @@ class Cursor:
                 self.iterator = DMCursorIterator(method, *args, **kwargs)
             elif method.pagination_mode == 'id':
                 self.iterator = IdIterator(method, *args, **kwargs)
+            elif method.pagination_mode == 'link':
+                self.iterator = LinkIterator(method, *args, **kwargs)
             elif method.pagination_mode == "next":
                 self.iterator = NextIterator(method, *args, **kwargs)
             elif method.pagination_mode == 'page':
@@ -49,8 +60,8 @@ class Cursor:
 
         Returns
         -------
-        CursorIterator or DMCursorIterator or IdIterator or NextIterator or \
-        PageIterator
+        CursorIterator or DMCursorIterator or IdIterator or LinkIterator or \
+        NextIterator or PageIterator
             Iterator to iterate through pages
         """
         self.iterator.limit = limit
@@ -91,6 +102,10 @@ class BaseIterator:
     def prev(self):
         raise NotImplementedError
 
+    def close(self):
+        """Stop the requests made in the background, if any"""
+        pass
+
     def __iter__(self):
         return self
 
@@ -150,12 +165,15 @@ class DMCursorIterator(BaseIterator):
 
 class IdIterator(BaseIterator):
 
+    #: Number of pages kept for :meth:`prev`
+    history_size = 10
+
     def __init__(self, method, *args, **kwargs):
         BaseIterator.__init__(self, method, *args, **kwargs)
         self.max_id = self.kwargs.pop('max_id', None)
         self.num_tweets = 0
-        self.results = []
-        self.model_results = []
+        self.results = deque(maxlen=self.history_size)
+        self.max_ids = deque(maxlen=self.history_size)
         self.index = 0
 
     def next(self):
@@ -164,33 +182,20 @@ class IdIterator(BaseIterator):
             raise StopIteration
 
         if self.index >= len(self.results) - 1:
-            data = self.method(max_id=self.max_id, parser=RawParser(), *self.args, **self.kwargs)
-
-            model = ModelParser().parse(
-                data, api = self.method.__self__,
-                payload_list=self.method.payload_list,
-                payload_type=self.method.payload_type
-            )
-            result = self.method.__self__.parser.parse(
-                data, api = self.method.__self__,
-                payload_list=self.method.payload_list,
-                payload_type=self.method.payload_type
-            )
-
-            if len(self.results) != 0:
-                self.index += 1
+            result = self.method(max_id=self.max_id, *self.args, **self.kwargs)
+            max_id = self._max_id(result)
+
             self.results.append(result)
-            self.model_results.append(model)
+            self.max_ids.append(max_id)
+            self.index = len(self.results) - 1
         else:
             self.index += 1
             result = self.results[self.index]
-            model = self.model_results[self.index]
+            max_id = self.max_ids[self.index]
 
         if len(result) == 0:
             raise StopIteration
-        # TODO: Make this not dependant on the parser making max_id and
-        # since_id available
-        self.max_id = model.max_id
+        self.max_id = max_id
         self.num_tweets += 1
         return result
 
@@ -202,14 +207,104 @@ class IdIterator(BaseIterator):
         self.index -= 1
         if self.index < 0:
             # There's no way to fetch a set of tweets directly 'above' the
-            # current set
+            # current set, and older pages may have left the history
             raise StopIteration
 
         data = self.results[self.index]
-        self.max_id = self.model_results[self.index].max_id
+        self.max_id = self.max_ids[self.index]
         self.num_tweets += 1
         return data
 
+    @staticmethod
+    def _max_id(result):
+        """Get the max_id for the page after the given result, without parsing
+        it again"""
+        if isinstance(result, ResultSet):
+            return result.max_id
+        if isinstance(result, (str, bytes)):
+            # RawParser was passed by the caller; this is the only decode
+            result = json.loads(result)
+        if isinstance(result, dict):
+            result = result.get('statuses', result.get('results', ()))
+        ids = []
+        for item in result:
+            _id = item.get('id') if isinstance(item, dict) else getattr(item, 'id', None)
+            if _id is not None:
+                ids.append(int(_id))
+        # max_id is always set to the *smallest* id, minus one, in the set
+        return (min(ids) - 1) if ids else None
+
+
+class LinkIterator(BaseIterator):
+
+    def __init__(self, method, *args, **kwargs):
+        BaseIterator.__init__(self, method, *args, **kwargs)
+        self.prefetch = self.kwargs.pop('prefetch', False)
+        # The first page is requested with the caller's own ids, the following
+        # ones with the ids of the server's Link header
+        self.next_params = {
+            key: self.kwargs.pop(key) for key in LINK_PARAMS if key in self.kwargs
+        }
+        self.prev_params = None
+        self.page_count = 0
+        self.executor = None
+        self.pending = None
+
+    def next(self):
+        if self.next_params is None or self.page_count >= self.limit:
+            self.close()
+            raise StopIteration
+
+        if self.pending is not None:
+            data = self.pending.result()
+            self.pending = None
+        else:
+            data = self._fetch(self.next_params)
+        self._follow(data)
+
+        if len(data) == 0:
+            self.close()
+            raise StopIteration
+        self.page_count += 1
+
+        if self.prefetch and self.next_params is not None and self.page_count < self.limit:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.pending = self.executor.submit(self._fetch, self.next_params)
+        return data
+
+    def prev(self):
+        if self.prev_params is None:
+            raise TweepyException('Can not page back more, at first page')
+        # A prefetched next page does not follow the page fetched here
+        self._cancel_pending()
+        data = self._fetch(self.prev_params)
+        self._follow(data)
+        self.page_count -= 1
+        return data
+
+    def _fetch(self, params):
+        return self.method(*self.args, **self.kwargs, **params)
+
+    def _follow(self, data):
+        self.next_params = pagination_params(data, 'next')
+        self.prev_params = pagination_params(data, 'prev')
+
+    def _cancel_pending(self):
+        # A request already in flight is left to finish in the background
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+
+    def close(self):
+        self._cancel_pending()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def __del__(self):
+        self.close()
+
 
 class PageIterator(BaseIterator):
 
@@ -289,6 +384,9 @@ class ItemIterator(BaseIterator):
             self.page_index = -1
         self.page_index += 1
         self.num_tweets += 1
+        if self.num_tweets >= self.limit:
+            # The next page will not be needed
+            self.page_iterator.close()
         return self.current_page[self.page_index]
 
     def prev(self):
@@ -303,3 +401,6 @@ class ItemIterator(BaseIterator):
         self.page_index -= 1
         self.num_tweets -= 1
         return self.current_page[self.page_index]
+
+    def close(self):
+        self.page_iterator.close()
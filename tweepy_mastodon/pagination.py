@@ -7,6 +7,7 @@ from math import inf
 import requests
 
 from tweepy_mastodon.client import Response
+from tweepy_mastodon.utils import pagination_params
 
 
 class Paginator:
@@ -15,7 +16,9 @@ class Paginator:
     )
 
     :class:`Paginator` can be used to paginate for any :class:`Client`
-    methods that support pagination
+    methods that support pagination, and for :class:`API` methods that follow
+    Mastodon's ``Link`` header pagination. For the latter, the pagination
+    tokens are the ``max_id`` and ``min_id`` given by the server.
 
     .. note::
 
@@ -71,6 +74,8 @@ class Paginator:
                 response_data = response.data or []
             elif isinstance(response, dict):
                 response_data = response.get("data", [])
+            elif isinstance(response, list):
+                response_data = response
             else:
                 raise RuntimeError(
                     f"Paginator.flatten does not support the {type(response)} "
@@ -114,6 +119,9 @@ class PaginationIterator:
         if self.count >= self.limit or self.count and pagination_token is None:
             raise StopIteration
 
+        if getattr(self.method, "pagination_mode", None) == "link":
+            return self._next_link_page(pagination_token)
+
         # https://twittercommunity.com/t/why-does-timeline-use-pagination-token-while-search-uses-next-token/150963
         if self.method.__name__ in (
             "search_all_tweets", "search_recent_tweets",
@@ -142,3 +150,23 @@ class PaginationIterator:
         self.count += 1
 
         return response
+
+    def _next_link_page(self, pagination_token):
+        if pagination_token is not None:
+            self.kwargs.pop("max_id", None)
+            self.kwargs.pop("min_id", None)
+            self.kwargs.pop("since_id", None)
+            key = "min_id" if self.reverse else "max_id"
+            self.kwargs[key] = pagination_token
+
+        response = self.method(*self.args, **self.kwargs)
+
+        prev_params = pagination_params(response, "prev") or {}
+        next_params = pagination_params(response, "next") or {}
+        self.previous_token = prev_params.get(
+            "min_id", prev_params.get("since_id")
+        )
+        self.next_token = next_params.get("max_id")
+        self.count += 1
+
+        return response
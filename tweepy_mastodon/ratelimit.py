@@ -0,0 +1,199 @@
+from collections import namedtuple
+import hashlib
+import logging
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+
+from dateutil.parser import parse as parse_datetime
+import requests
+
+log = logging.getLogger(__name__)
+
+# Mastodon's default limit for authenticated requests: 300 requests per 5 minutes.
+DEFAULT_LIMIT = 300
+DEFAULT_PERIOD = 5 * 60
+
+RateLimitBudget = namedtuple('RateLimitBudget', ('limit', 'remaining', 'reset'))
+RateLimitBudget.__doc__ = """Requests left in a rate limit window
+    limit: number of requests allowed per window
+    remaining: number of requests that can still be made without waiting
+    reset: time at which the window resets, or None if unknown
+"""
+
+
+def endpoint_family(method, path):
+    """Get the rate limit bucket a request counts against
+
+    Mastodon limits media uploads and status deletions separately from the
+    other API requests.
+    """
+    if method == 'POST' and path.startswith(('/api/v1/media', '/api/v2/media')):
+        return 'media'
+    if method == 'DELETE' and path.startswith('/api/v1/statuses/'):
+        return 'statuses_delete'
+    return 'api'
+
+
+class _Bucket:
+
+    __slots__ = ('limit', 'period', 'tokens', 'updated', 'reset')
+
+    def __init__(self, limit, period, now):
+        self.limit = limit
+        self.period = period
+        self.tokens = limit
+        self.updated = now
+        self.reset = None
+
+    def refill(self, now):
+        if self.reset is not None:
+            # The server's window is fixed: nothing is refilled before it resets
+            if now < self.reset:
+                return
+            self.tokens = min(self.limit, self.tokens + self.limit)
+            self.reset = None
+            self.updated = now
+            return
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.period)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until the last reserved token is available"""
+        if self.tokens >= 0:
+            return 0
+        if self.reset is not None:
+            windows = math.ceil(-self.tokens / self.limit) - 1
+            return self.reset - now + windows * self.period
+        return -self.tokens * self.period / self.limit
+
+
+class RateLimitScheduler:
+    """Paces requests so they stay within the Mastodon rate limits
+
+    Every (instance, account, endpoint family) has a token bucket, refilled at
+    ``limit`` requests per ``period`` seconds until the server reports its
+    actual budget through the ``X-RateLimit-Limit``, ``X-RateLimit-Remaining``
+    and ``X-RateLimit-Reset`` headers. From then on, the budget follows the
+    server's window. A request which would exceed the budget is delayed until
+    it is available again instead of being rejected with a 429.
+
+    A single scheduler is meant to be shared by all the threads and API
+    instances of a process, see :data:`rate_limit_scheduler`.
+    """
+
+    def __init__(self, limit=DEFAULT_LIMIT, period=DEFAULT_PERIOD):
+        """Initialize the scheduler
+            limit: number of requests assumed to be allowed per period before
+                the server reports its own limit
+            period: length of a rate limit window in seconds
+        """
+        self.limit = limit
+        self.period = period
+        self.lock = threading.Lock()
+        self._buckets = {}
+
+    @staticmethod
+    def key(instance, access_token=None, family='api'):
+        """Get the key of a bucket
+            instance: base URL of the Mastodon instance
+            access_token: access token of the account, None if anonymous
+            family: endpoint family, see :func:`endpoint_family`
+        """
+        if access_token is not None:
+            # Keep the token itself out of memory dumps and logs
+            access_token = hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+        return (instance, access_token, family)
+
+    @classmethod
+    def request_key(cls, method, url, authorization=None):
+        """Get the key of the bucket a request counts against
+            method: HTTP method of the request
+            url: URL of the request
+            authorization: value of the Authorization header, if any
+        """
+        parts = urlsplit(url)
+        access_token = authorization.split(' ', 1)[-1] if authorization else None
+        return cls.key(f'{parts.scheme}://{parts.netloc}', access_token, endpoint_family(method, parts.path))
+
+    def _bucket(self, key, now):
+        # The lock must be held by the caller
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.limit, self.period, now)
+        bucket.refill(now)
+        return bucket
+
+    def reserve(self, key):
+        """Take a request from the budget and return the number of seconds to
+        wait before making it"""
+        now = time.time()
+        with self.lock:
+            bucket = self._bucket(key, now)
+            bucket.tokens -= 1
+            return bucket.delay(now)
+
+    def acquire(self, key):
+        """Take a request from the budget, sleeping until it is available"""
+        delay = self.reserve(key)
+        if delay > 0:
+            log.warning(f"Rate limit budget exhausted. Sleeping for {delay:.0f} seconds.")
+            time.sleep(delay)
+
+    def update(self, key, headers):
+        """Synchronize the budget with the rate limit headers of a response"""
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = parse_datetime(headers['X-RateLimit-Reset']).timestamp()
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return
+        now = time.time()
+        with self.lock:
+            bucket = self._bucket(key, now)
+            bucket.limit = limit
+            if bucket.reset is None or reset > bucket.reset:
+                # A new window: the server's count is authoritative
+                bucket.tokens = remaining
+            else:
+                # Requests still in flight are not counted by the server yet
+                bucket.tokens = min(bucket.tokens, remaining)
+            bucket.reset = reset if reset > now else None
+            bucket.updated = now
+
+    def budget(self, key):
+        """Get the :class:`RateLimitBudget` of a bucket"""
+        now = time.time()
+        with self.lock:
+            bucket = self._bucket(key, now)
+            return RateLimitBudget(bucket.limit, max(0, math.floor(bucket.tokens)), bucket.reset)
+
+    def flush(self):
+        """Forget every budget"""
+        with self.lock:
+            self._buckets.clear()
+
+
+class RateLimitAdapter(requests.adapters.HTTPAdapter):
+    """Transport adapter pacing the requests of a :class:`requests.Session`
+    with a :class:`RateLimitScheduler`
+
+    Mounting it on the session shared by :class:`tweepy_mastodon.API` and its
+    Mastodon client paces the requests of both.
+    """
+
+    def __init__(self, scheduler, **kwargs):
+        self.scheduler = scheduler
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        key = self.scheduler.request_key(request.method, request.url, request.headers.get('Authorization'))
+        self.scheduler.acquire(key)
+        response = super().send(request, **kwargs)
+        self.scheduler.update(key, response.headers)
+        return response
+
+
+# Shared by every API instance in the process
+rate_limit_scheduler = RateLimitScheduler()
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+
+
+class _Call:
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls across threads
+
+    While a call for a key is in flight, other threads calling :meth:`do`
+    with the same key wait for it and share its result, or its exception,
+    instead of making their own call. Once the call returns, the next one
+    for the key is made again.
+
+    A single instance is meant to be shared by all the threads and API
+    instances of a process, see :data:`single_flight`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call ``fn(*args, **kwargs)`` unless a call for ``key`` is already in
+        flight, and return its result along with whether it was shared with
+        other callers
+
+        A shared result is the same object for every caller, so it must be
+        copied before being modified.
+        """
+        with self.lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                # No one can join the call from now on
+                del self._calls[key]
+            call.done.set()
+        return call.result, call.waiters > 0
+
+    def stats(self):
+        """Get the number of calls, of calls which shared the result of
+        another one, and of calls in flight"""
+        with self.lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+class _AsyncCall:
+
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent identical calls of an event loop
+
+    The asyncio counterpart of :class:`SingleFlight`. The shared call runs in
+    its own task, so that it is not cancelled along with the caller which
+    started it while others still wait for it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` unless a call for ``key`` is already in
+        flight, and return its result along with whether it was shared with
+        other callers"""
+        self.calls += 1
+        call = self._calls.get(key)
+        if call is None:
+            async def run():
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    # No one can join the call from now on
+                    del self._calls[key]
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(run()))
+        else:
+            call.waiters += 1
+            self.coalesced += 1
+        result = await asyncio.shield(call.task)
+        return result, call.waiters > 0
+
+    def stats(self):
+        """Get the number of calls, of calls which shared the result of
+        another one, and of calls in flight"""
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+# Shared by every API instance in the process
+single_flight = SingleFlight()
@@ -4,29 +4,38 @@
 
 # Appengine users: https://developers.google.com/appengine/docs/python/sockets/#making_httplib_use_sockets
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import functools
 import json
 import logging
 from math import inf
 from platform import python_version
 import ssl
 import traceback
-from threading import Thread
+from threading import Lock, Thread
 from time import sleep
 from typing import NamedTuple
+from urllib.parse import urlsplit
 
+from mastodon import Mastodon, MastodonError
 import requests
-from requests_oauthlib import OAuth1
 import urllib3
 
 import tweepy_mastodon
 from tweepy_mastodon.client import BaseClient, Response
 from tweepy_mastodon.errors import TweepyException
-from tweepy_mastodon.models import Status
 from tweepy_mastodon.tweet import Tweet
+from tweepy_mastodon.utils import convert_statuses, normalize_id
 
 log = logging.getLogger(__name__)
 
+# Mastodon.py's JSON hooks turn dates into datetimes, numeric IDs into ints and
+# objects into AttribAccessDicts, which is what the converters expect.
+_json_hooks = Mastodon._Mastodon__json_hooks
+_json_loads = functools.partial(json.loads, object_hook=_json_hooks)
+
+BACKFILL_PAGE_SIZE = 40
+
 StreamResponse = namedtuple(
     "StreamResponse", ("data", "includes", "errors", "matching_rules")
 )
@@ -87,13 +96,16 @@ class BaseStream:
                             if not self.running:
                                 break
 
-                            for line in resp.iter_lines(
+                            self._resume()
+
+                            lines = _LineSplitter()
+                            for chunk in resp.iter_content(
                                 chunk_size=self.chunk_size
                             ):
-                                if line:
-                                    self.on_data(line)
-                                else:
-                                    self.on_keep_alive()
+                                for line in lines.feed(chunk):
+                                    self._process_line(line)
+                                    if not self.running:
+                                        break
                                 if not self.running:
                                     break
 
@@ -159,6 +171,15 @@ class BaseStream:
             self.running = False
             self.on_disconnect()
 
+    def _process_line(self, line):
+        if line:
+            self.on_data(bytes(line))
+        else:
+            self.on_keep_alive()
+
+    def _resume(self):
+        pass
+
     def _threaded_connect(self, *args, **kwargs):
         self.thread = Thread(target=self._connect, name="Tweepy Stream",
                              args=args, kwargs=kwargs, daemon=self.daemon)
@@ -217,38 +238,285 @@ class BaseStream:
         log.error("Stream encountered HTTP error: %d", status_code)
 
 
-class Stream(BaseStream):
-    """Filter realtime Tweets with Twitter API v1.1
+class BaseMastodonStream(BaseStream):
+    """Base class of the streams of the Mastodon streaming API
 
-    .. note::
+    Holds the credentials and the Mastodon.py client used to convert the
+    events, and dispatches them to the ``on_*`` methods.
 
-        New Twitter Developer Apps created on or after April 29, 2022 `will not
-        be able to gain access to v1.1 statuses/filter`_, the Twitter API v1.1
-        endpoint that :class:`Stream` uses. Twitter API v2 can be used instead
-        with :class:`StreamingClient`.
+    The statuses posted while the stream is reconnecting are fetched from
+    the matching timeline once it is connected again, after the last one it
+    received, see :attr:`last_ids`. Those also received live are only
+    dispatched once.
 
-    .. versionchanged:: 4.13
-        Removed ``sample``, ``on_delete``, ``on_scrub_geo``,
-        ``on_status_withheld``, and ``on_user_withheld`` methods, as `the
-        Twitter API v1.1 statuses/sample endpoint and compliance messages on
-        the Twitter API v1.1 statuses/filter endpoint have been retired`_
+    The payloads are decoded by ``decoder``, orjson or ujson if installed.
+    With ``raw``, they are passed to the ``on_*`` methods as decoded, which
+    spares building the objects returned by :class:`API` when the statuses
+    are only forwarded.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_token,
+                 access_token_secret=None, *, api_base_url=None,
+                 streaming_base_url=None, resume=True, last_ids=None,
+                 max_backfill=1000, decoder=None, raw=False, **kwargs):
+        if api_base_url is None:
+            raise Exception(
+                'tweepy-mastodon requires the additional parameter `api_base_url` to determine Mastodon API server'
+            )
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = None
+        self.api_base_url = _base_url(api_base_url)
+        self.streaming_base_url = streaming_base_url and _base_url(streaming_base_url)
+        self.resume = resume
+        self.max_backfill = max_backfill
+        self.decoder = decoder or _default_decoder()
+        self.raw = raw
+        self._positions = _StreamPositions(last_ids)
+        self._mastodon = None
+        super().__init__(**kwargs)
+
+    @property
+    def last_ids(self):
+        """The ID of the last status received from each stream, by stream,
+        which can be saved to resume the streams from another instance"""
+        return self._positions.last_ids
+
+    @property
+    def mastodon(self):
+        """The :class:`mastodon.Mastodon` client used to convert statuses,
+        created on first use"""
+        if self._mastodon is None:
+            self._mastodon = Mastodon(
+                self.consumer_key, self.consumer_secret, self.access_token,
+                api_base_url=self.api_base_url
+            )
+        return self._mastodon
+
+    def _get_streaming_base_url(self):
+        if self.streaming_base_url is None:
+            try:
+                self.streaming_base_url = _base_url(self.mastodon._Mastodon__get_streaming_base())
+            except Exception as exc:
+                log.warning(
+                    "Failed to get the streaming server of %s, connecting "
+                    "to the instance itself: %s", self.api_base_url, exc
+                )
+                self.streaming_base_url = self.api_base_url
+        return self.streaming_base_url
+
+    def _is_new(self, key, event, data):
+        # Whether the event is to be dispatched, which it is not if it is a
+        # status already dispatched
+        if event != "update" or key is None:
+            return True
+        return self._positions.track(key, normalize_id(data["id"]))
+
+    def _convert_event(self, event, data):
+        if self.raw or data is None:
+            return data
+        if event == "delete":
+            return normalize_id(data)
+        data = _apply_json_hooks(data)
+        if event in ("update", "status.update"):
+            return convert_statuses(
+                self.mastodon, [data], include_user_status=False
+            )[0]
+        return data
+
+    def _resumed_streams(self):
+        return []
+
+    def _resume(self):
+        if not self.resume:
+            return
+        for key in self._resumed_streams():
+            if key in self.last_ids and self.running:
+                self._backfill(key)
+
+    def _backfill(self, key):
+        timeline = self._timeline(key)
+        if timeline is None:
+            return
+        min_id = self.last_ids[key]
+        count = 0
+        while count < self.max_backfill and self.running:
+            try:
+                page = timeline(min_id=min_id, limit=BACKFILL_PAGE_SIZE)
+            except MastodonError as exc:
+                log.error("Failed to backfill the %s stream: %s", key, exc)
+                return
+            if not page:
+                return
+            # Pages after min_id are sorted from the newest status
+            page = sorted(page, key=lambda status: _id_order(status.id))
+            statuses = page if self.raw else convert_statuses(
+                self.mastodon, page, include_user_status=False
+            )
+            for mastodon_status, status in zip(page, statuses):
+                if self._positions.track(key, mastodon_status.id):
+                    self._dispatch_status(key, status)
+            count += len(page)
+            min_id = page[-1].id
+        if count >= self.max_backfill:
+            log.warning(
+                "Stopped backfilling the %s stream after %d statuses", key,
+                count
+            )
+
+    def _timeline(self, key):
+        stream = key[0]
+        if stream == "user":
+            return self.mastodon.timeline_home
+        if stream.startswith("public"):
+            return functools.partial(
+                self.mastodon.timeline_public, local=":local" in stream,
+                remote=":remote" in stream, only_media=stream.endswith(":media")
+            )
+        if stream.startswith("hashtag"):
+            return functools.partial(
+                self.mastodon.timeline_hashtag, key[1],
+                local=stream == "hashtag:local"
+            )
+        if stream == "list":
+            return functools.partial(self.mastodon.timeline_list, key[1])
+        # Notifications and conversations have no timeline to backfill from
+        return None
+
+    def _dispatch_status(self, key, status):
+        self.on_status(status)
+
+    def on_event(self, event, data):
+        """This is called when an event is received from the stream.
+        This method handles sending the payload to other methods based on the
+        event type.
+
+        Parameters
+        ----------
+        event : str
+            The type of the event
+        data
+            The payload of the event, converted like the argument of the
+            method it is sent to
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#events
+        """
+        if event == "update":
+            return self.on_status(data)
+        if event == "status.update":
+            return self.on_status_update(data)
+        if event == "delete":
+            return self.on_delete(data)
+        if event == "notification":
+            return self.on_notification(data)
+        if event == "conversation":
+            return self.on_conversation(data)
+        if event == "filters_changed":
+            return self.on_filters_changed()
+
+        log.error("Received unknown event type %s: %s", event, data)
+
+    def on_status(self, status):
+        """This is called when a status is received.
+
+        Parameters
+        ----------
+        status : :class:`mastodon.utility.AttribAccessDict` | dict
+            The status received, converted like those returned by
+            :class:`API`, or as decoded with ``raw``
+        """
+        log.debug("Received status: %s", status["id"])
+
+    def on_status_update(self, status):
+        """This is called when an edited status is received.
+
+        Parameters
+        ----------
+        status : :class:`mastodon.utility.AttribAccessDict`
+            The edited status
+        """
+        log.debug("Received status update: %s", status["id"])
+
+    def on_delete(self, status_id):
+        """This is called when a status is deleted.
+
+        Parameters
+        ----------
+        status_id : int | str
+            The ID of the deleted status
+        """
+        log.debug("Received status deletion: %s", status_id)
+
+    def on_notification(self, notification):
+        """This is called when a notification is received.
+
+        Parameters
+        ----------
+        notification : :class:`mastodon.utility.AttribAccessDict`
+            The notification, as returned by Mastodon.py
+        """
+        log.debug("Received notification: %s", notification["id"])
+
+    def on_conversation(self, conversation):
+        """This is called when a direct conversation is updated.
+
+        Parameters
+        ----------
+        conversation : :class:`mastodon.utility.AttribAccessDict`
+            The conversation, as returned by Mastodon.py
+        """
+        log.debug("Received conversation: %s", conversation["id"])
+
+    def on_filters_changed(self):
+        """This is called when the filters of the user have changed."""
+        log.debug("Received filters change")
+
+
+class Stream(BaseMastodonStream):
+    """Stream realtime statuses and notifications from Mastodon
+
+    Connects to one of the streams of the Mastodon streaming API, which
+    pushes its events as `Server-Sent Events`_. Statuses are converted the
+    same way as those returned by :class:`API`, and passed to
+    :meth:`on_status`.
 
     Parameters
     ----------
     consumer_key : str
-        Twitter API Consumer Key
+        Mastodon Client ID
     consumer_secret : str
-        Twitter API Consumer Secret
+        Mastodon Client Secret
     access_token: str
-        Twitter API Access Token
-    access_token_secret : str
-        Twitter API Access Token Secret
+        Mastodon Access Token
+    access_token_secret : str | None
+        Unused, as Mastodon does not need it
+    api_base_url : str
+        Base URL of the Mastodon instance
+    streaming_base_url : str | None
+        Base URL of the streaming server of the instance, if it is not served
+        by the instance itself. By default, it is asked to the instance.
+    resume : bool
+        Whether or not to backfill the statuses posted while the stream was
+        reconnecting from the matching timeline
+    last_ids : dict[tuple, int | str] | None
+        The :attr:`last_ids` of a previous stream, to resume its streams
+        from the first connection
+    max_backfill : int
+        Maximum number of statuses to backfill per stream and reconnection
+    decoder : Callable[[bytes | memoryview | str], Any] | None
+        Decodes the JSON payloads. By default, orjson or ujson if installed,
+        else json.
+    raw : bool
+        Whether or not to pass the payloads to the ``on_*`` methods as
+        decoded, instead of converting them. The statuses backfilled after a
+        reconnection are still decoded by Mastodon.py.
     chunk_size : int
-        The default socket.read size. Default to 512, less than half the size
-        of a Tweet so that it reads Tweets with the minimal latency of 2 reads
-        per Tweet. Values higher than ~1kb will increase latency by waiting for
-        more data to arrive but may also increase throughput by doing fewer
-        socket read calls.
+        The maximum size of the reads from the socket. Mastodon sends each
+        event in its own HTTP chunk, which is returned as soon as it arrives,
+        so large reads only save read calls during bursts.
     daemon : bool
         Whether or not to use a daemon thread when using a thread to run the
         stream
@@ -263,6 +531,8 @@ class Stream(BaseStream):
 
     Attributes
     ----------
+    last_ids : dict[tuple, int | str]
+        The ID of the last status received from each stream, by stream
     running : bool
         Whether there's currently a stream running
     session : :class:`requests.Session`
@@ -272,78 +542,59 @@ class Stream(BaseStream):
     user_agent : str
         User agent used when connecting to the stream
 
-
-    .. _will not be able to gain access to v1.1 statuses/filter: https://twittercommunity.com/t/deprecation-announcement-removing-compliance-messages-from-statuses-filter-and-retiring-statuses-sample-from-the-twitter-api-v1-1/170500
-    .. _the Twitter API v1.1 statuses/sample endpoint and compliance messages
-        on the Twitter API v1.1 statuses/filter endpoint have been retired: https://twittercommunity.com/t/deprecation-announcement-removing-compliance-messages-from-statuses-filter-and-retiring-statuses-sample-from-the-twitter-api-v1-1/170500
+    .. _Server-Sent Events: https://docs.joinmastodon.org/methods/streaming/
     """
 
     def __init__(self, consumer_key, consumer_secret, access_token,
-                 access_token_secret, **kwargs):
+                 access_token_secret=None, *, api_base_url=None,
+                 streaming_base_url=None, chunk_size=65536, **kwargs):
         """__init__( \
-            consumer_key, consumer_secret, access_token, access_token_secret, \
-            chunk_size=512, daemon=False, max_retries=inf, proxy=None, \
-            verify=True \
+            consumer_key, consumer_secret, access_token, \
+            access_token_secret=None, *, api_base_url, \
+            streaming_base_url=None, resume=True, last_ids=None, \
+            max_backfill=1000, decoder=None, raw=False, chunk_size=65536, \
+            daemon=False, max_retries=inf, proxy=None, verify=True \
         )
         """
-        self.consumer_key = consumer_key
-        self.consumer_secret = consumer_secret
-        self.access_token = access_token
-        self.access_token_secret = access_token_secret
-        super().__init__(**kwargs)
+        self._event = None
+        self._data = []
+        self._stream_key = None
+        super().__init__(
+            consumer_key, consumer_secret, access_token, access_token_secret,
+            api_base_url=api_base_url, streaming_base_url=streaming_base_url,
+            chunk_size=chunk_size, **kwargs
+        )
 
-    def _connect(self, method, endpoint, **kwargs):
-        auth = OAuth1(self.consumer_key, self.consumer_secret,
-                      self.access_token, self.access_token_secret)
-        url = f"https://stream.twitter.com/1.1/{endpoint}.json"
-        super()._connect(method, url, auth=auth, timeout=90, **kwargs)
+    def _connect(self, method, endpoint, params=None, **kwargs):
+        self.session.headers["Authorization"] = f"Bearer {self.access_token}"
+        self._event = None
+        self._data = []
+        url = f"{self._get_streaming_base_url()}/api/v1/streaming/{endpoint}"
+        super()._connect(method, url, params=params, timeout=60, **kwargs)
 
-    def filter(self, *, follow=None, track=None, locations=None,
-               filter_level=None, languages=None, stall_warnings=False,
-               threaded=False):
-        """Filter realtime Tweets
+    def _stream(self, endpoint, params=None, threaded=False):
+        if self.running:
+            raise TweepyException("Stream is already connected")
+
+        self._stream_key = _stream_key(endpoint, params)
+        if threaded:
+            return self._threaded_connect("GET", endpoint, params=params)
+        else:
+            self._connect("GET", endpoint, params=params)
 
-        .. deprecated:: 4.9
-            `The delivery of compliance messages through the Twitter API v1.1
-            endpoint this method uses has been deprecated, and they will stop
-            being delivered beginning October 29, 2022.`_ Twitter API v2 can be
-            used instead with :meth:`StreamingClient.filter` and/or
-            :class:`Client` :ref:`batch compliance <Batch compliance>` methods.
+    def user(self, *, threaded=False):
+        """Stream the statuses of the home timeline and the notifications of
+        the authenticating user
 
         Parameters
         ----------
-        follow : list[int | str] | None
-            User IDs, indicating the users to return statuses for in the stream
-        track : list[str] | None
-            Keywords to track
-        locations : list[float] | None
-            Specifies a set of bounding boxes to track
-        filter_level : str | None
-            Setting this parameter to one of none, low, or medium will set the
-            minimum value of the filter_level Tweet attribute required to be
-            included in the stream. The default value is none, which includes
-            all available Tweets.
-
-            When displaying a stream of Tweets to end users (dashboards or live
-            feeds at a presentation or conference, for example) it is suggested
-            that you set this value to medium.
-        languages : list[str] | None
-            Setting this parameter to a comma-separated list of `BCP 47`_
-            language identifiers corresponding to any of the languages listed
-            on Twitter’s `advanced search`_ page will only return Tweets that
-            have been detected as being written in the specified languages. For
-            example, connecting with language=en will only stream Tweets
-            detected to be in the English language.
-        stall_warnings : bool
-            Specifies whether stall warnings should be delivered
         threaded : bool
             Whether or not to use a thread to run the stream
 
         Raises
         ------
         TweepyException
-            When the stream is already connected or when the number of location
-            coordinates is not a multiple of 4
+            When the stream is already connected
 
         Returns
         -------
@@ -352,113 +603,533 @@ class Stream(BaseStream):
 
         References
         ----------
-        https://developer.twitter.com/en/docs/twitter-api/v1/tweets/filter-realtime/api-reference/post-statuses-filter
+        https://docs.joinmastodon.org/methods/streaming/#user
+        """
+        return self._stream("user", threaded=threaded)
+
+    def public(self, *, local=False, remote=False, only_media=False,
+               threaded=False):
+        """Stream the public statuses known to the instance
 
-        .. _BCP 47: https://tools.ietf.org/html/bcp47
-        .. _advanced search: https://twitter.com/search-advanced
-        .. _The delivery of compliance messages through the Twitter API v1.1
-            endpoint this method uses has been deprecated, and they will stop
-            being delivered beginning October 29, 2022.: https://twittercommunity.com/t/deprecation-announcement-removing-compliance-messages-from-statuses-filter-and-retiring-statuses-sample-from-the-twitter-api-v1-1/170500
+        Parameters
+        ----------
+        local : bool
+            Only stream the statuses posted on the instance
+        remote : bool
+            Only stream the statuses posted on other instances
+        only_media : bool
+            Only stream the statuses with media attachments
+        threaded : bool
+            Whether or not to use a thread to run the stream
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
+
+        Returns
+        -------
+        threading.Thread | None
+            The thread if ``threaded`` is set to ``True``, else ``None``
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#public
         """
-        if self.running:
-            raise TweepyException("Stream is already connected")
+        endpoint = "public"
+        if local:
+            endpoint += "/local"
+        elif remote:
+            endpoint += "/remote"
+        params = {"only_media": "true"} if only_media else None
+        return self._stream(endpoint, params=params, threaded=threaded)
 
-        method = "POST"
-        endpoint = "statuses/filter"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-        body = {}
-        if follow:
-            body["follow"] = ','.join(map(str, follow))
-        if track:
-            body["track"] = ','.join(map(str, track))
-        if locations and len(locations) > 0:
-            if len(locations) % 4:
-                raise TweepyException(
-                    "Number of location coordinates should be a multiple of 4"
-                )
-            body["locations"] = ','.join(f"{l:.4f}" for l in locations)
-        if filter_level:
-            body["filter_level"] = filter_level
-        if languages:
-            body["language"] = ','.join(map(str, languages))
-        if stall_warnings:
-            body["stall_warnings"] = stall_warnings
+    def hashtag(self, tag, *, local=False, threaded=False):
+        """Stream the public statuses with a hashtag
 
-        if threaded:
-            return self._threaded_connect(method, endpoint, headers=headers,
-                                          body=body)
-        else:
-            self._connect(method, endpoint, headers=headers, body=body)
+        Parameters
+        ----------
+        tag : str
+            The hashtag, with or without its leading ``#``
+        local : bool
+            Only stream the statuses posted on the instance
+        threaded : bool
+            Whether or not to use a thread to run the stream
 
-    def on_data(self, raw_data):
-        """This is called when raw data is received from the stream.
-        This method handles sending the data to other methods based on the
-        message type.
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
+
+        Returns
+        -------
+        threading.Thread | None
+            The thread if ``threaded`` is set to ``True``, else ``None``
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#hashtag
+        """
+        endpoint = "hashtag/local" if local else "hashtag"
+        return self._stream(
+            endpoint, params={"tag": tag.lstrip("#")}, threaded=threaded
+        )
+
+    def list(self, list_id, *, threaded=False):
+        """Stream the statuses of a list of the authenticating user
 
         Parameters
         ----------
-        raw_data : JSON
-            The raw data from the stream
+        list_id : int | str
+            ID of the list
+        threaded : bool
+            Whether or not to use a thread to run the stream
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected
+
+        Returns
+        -------
+        threading.Thread | None
+            The thread if ``threaded`` is set to ``True``, else ``None``
 
         References
         ----------
-        https://developer.twitter.com/en/docs/twitter-api/v1/tweets/filter-realtime/guides/streaming-message-types
+        https://docs.joinmastodon.org/methods/streaming/#list
         """
-        data = json.loads(raw_data)
+        return self._stream("list", params={"list": list_id}, threaded=threaded)
 
-        if "in_reply_to_status_id" in data:
-            status = Status.parse(None, data)
-            return self.on_status(status)
-        if "disconnect" in data:
-            return self.on_disconnect_message(data["disconnect"])
-        if "limit" in data:
-            return self.on_limit(data["limit"]["track"])
-        if "warning" in data:
-            return self.on_warning(data["warning"])
+    def filter(self, *, track=None, threaded=False, **kwargs):
+        """Stream the public statuses with a hashtag, or all of them
 
-        log.error("Received unknown message type: %s", raw_data)
+        Kept for compatibility with Tweepy. Mastodon streams follow a single
+        hashtag, given as the only keyword of ``track``, and the other
+        parameters of Twitter's filter are not supported.
 
-    def on_status(self, status):
-        """This is called when a status is received.
+        Parameters
+        ----------
+        track : list[str] | None
+            The hashtag to stream
+        threaded : bool
+            Whether or not to use a thread to run the stream
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected or when ``track`` contains
+            more than one keyword
+
+        Returns
+        -------
+        threading.Thread | None
+            The thread if ``threaded`` is set to ``True``, else ``None``
+        """
+        if any(value for value in kwargs.values()):
+            log.warning(
+                '`follow`, `locations`, `filter_level`, `languages` and '
+                '`stall_warnings` are not implemented in tweepy-mastodon yet'
+            )
+        if not track:
+            return self.public(threaded=threaded)
+        if len(track) > 1:
+            raise TweepyException(
+                "Mastodon streams follow a single hashtag"
+            )
+        return self.hashtag(track[0], threaded=threaded)
+
+    def _resumed_streams(self):
+        return [self._stream_key]
+
+    def _process_line(self, line):
+        # https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+        if not line:
+            # A blank line ends the event
+            if self._data:
+                event = self._event or "message"
+                payload = (
+                    self._data[0] if len(self._data) == 1
+                    else b"\n".join(self._data)
+                )
+                data = _decode_payload(self.decoder, event, payload)
+                if self._is_new(self._stream_key, event, data):
+                    self.on_event(event, self._convert_event(event, data))
+            self._event = None
+            self._data = []
+            return
+        field, value = _sse_field(line)
+        if field is None:
+            # Comments are sent as heartbeats
+            self.on_keep_alive()
+        elif field == b"event":
+            self._event = bytes(value).decode("utf-8")
+        elif field == b"data":
+            self._data.append(value)
+
+
+class MultiplexStream(BaseMastodonStream):
+    """Stream many Mastodon streams over a single WebSocket connection
+
+    The WebSocket endpoint of the Mastodon streaming API multiplexes every
+    stream subscribed to with :meth:`subscribe`, so that following hundreds
+    of hashtags takes one connection and one thread. Subscriptions can be
+    changed while the stream is running, and are renewed whenever it
+    reconnects.
+
+    The events of a stream are passed to the handler it was subscribed
+    with, or to the ``on_*`` methods of the instance if it has none.
+
+    Requires `websocket-client`_, which is installed with the ``websocket``
+    extra.
+
+    Parameters
+    ----------
+    consumer_key : str
+        Mastodon Client ID
+    consumer_secret : str
+        Mastodon Client Secret
+    access_token: str
+        Mastodon Access Token
+    access_token_secret : str | None
+        Unused, as Mastodon does not need it
+    api_base_url : str
+        Base URL of the Mastodon instance
+    streaming_base_url : str | None
+        Base URL of the streaming server of the instance, if it is not served
+        by the instance itself. By default, it is asked to the instance.
+    resume : bool
+        Whether or not to backfill the statuses posted while the stream was
+        reconnecting from the matching timeline
+    last_ids : dict[tuple, int | str] | None
+        The :attr:`last_ids` of a previous stream, to resume its streams
+        from the first connection
+    max_backfill : int
+        Maximum number of statuses to backfill per stream and reconnection
+    decoder : Callable[[bytes | memoryview | str], Any] | None
+        Decodes the JSON messages. By default, orjson or ujson if installed,
+        else json.
+    raw : bool
+        Whether or not to pass the payloads to the handlers and the ``on_*``
+        methods as decoded, instead of converting them. The statuses
+        backfilled after a reconnection are still decoded by Mastodon.py.
+    timeout : float
+        Number of seconds without any frame, including the pings sent by the
+        server, after which the connection is considered stalled
+    daemon : bool
+        Whether or not to use a daemon thread when using a thread to run the
+        stream
+    max_retries : int
+        Max number of times to retry connecting the stream
+    proxy : str | None
+        URL of the proxy to use when connecting to the stream
+    verify : bool | str
+        Either a boolean, in which case it controls whether to verify the
+        server’s TLS certificate, or a string, in which case it must be a path
+        to a CA bundle to use.
+
+    Attributes
+    ----------
+    last_ids : dict[tuple, int | str]
+        The ID of the last status received from each stream, by stream
+    running : bool
+        Whether there's currently a stream running
+    subscriptions : dict[tuple, Callable | None]
+        The handler of each subscribed stream, by stream
+    thread : :class:`threading.Thread` | None
+        Thread used to run the stream
+    user_agent : str
+        User agent used when connecting to the stream
+
+    .. _websocket-client: https://pypi.org/project/websocket-client/
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_token,
+                 access_token_secret=None, *, api_base_url=None,
+                 streaming_base_url=None, timeout=90, **kwargs):
+        """__init__( \
+            consumer_key, consumer_secret, access_token, \
+            access_token_secret=None, *, api_base_url, \
+            streaming_base_url=None, resume=True, last_ids=None, \
+            max_backfill=1000, decoder=None, raw=False, timeout=90, \
+            daemon=False, max_retries=inf, proxy=None, verify=True \
+        )
+        """
+        self.timeout = timeout
+        self.subscriptions = {}
+        self._ws = None
+        self._ws_lock = Lock()
+        super().__init__(
+            consumer_key, consumer_secret, access_token, access_token_secret,
+            api_base_url=api_base_url, streaming_base_url=streaming_base_url,
+            **kwargs
+        )
+
+    def subscribe(self, stream, *, tag=None, list_id=None, handler=None):
+        """Subscribe to a stream, or replace the handler of a stream already
+        subscribed to
 
         Parameters
         ----------
-        status : Status
-            The Status received
+        stream : str
+            Name of the stream: ``user``, ``user:notification``, ``public``,
+            ``public:local``, ``public:remote``, ``public:media``,
+            ``hashtag``, ``hashtag:local``, ``list`` or ``direct``
+        tag : str | None
+            The hashtag of the ``hashtag`` streams, with or without its
+            leading ``#``
+        list_id : int | str | None
+            ID of the list of the ``list`` stream
+        handler : Callable[[str, Any], None] | None
+            Called with the type of each event of the stream and its payload,
+            converted like those passed to the ``on_*`` methods. By default,
+            the events are passed to the ``on_*`` methods.
+
+        Returns
+        -------
+        tuple
+            The stream, as found in :attr:`subscriptions`
+
+        References
+        ----------
+        https://docs.joinmastodon.org/methods/streaming/#websocket
+        """
+        key = _subscription_key(stream, tag if tag is not None else list_id)
+        with self._ws_lock:
+            subscribed = key in self.subscriptions
+            self.subscriptions[key] = handler
+            if not subscribed:
+                self._send(_subscription_message("subscribe", key))
+        return key
+
+    def unsubscribe(self, stream, *, tag=None, list_id=None):
+        """Unsubscribe from a stream
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+        tag : str | None
+            The hashtag of the ``hashtag`` streams
+        list_id : int | str | None
+            ID of the list of the ``list`` stream
         """
-        log.debug("Received status: %d", status.id)
+        key = _subscription_key(stream, tag if tag is not None else list_id)
+        with self._ws_lock:
+            if self.subscriptions.pop(key, False) is not False:
+                self._send(_subscription_message("unsubscribe", key))
+
+    def _send(self, message):
+        # Called with _ws_lock held. The subscriptions are sent again on
+        # reconnection, so a message lost with the connection does not matter.
+        if self._ws is None:
+            return
+        try:
+            self._ws.send(message)
+        except Exception as exc:
+            log.debug("Failed to send %s: %s", message, exc)
 
-    def on_disconnect_message(self, message):
-        """This is called when a disconnect message is received.
+    def connect(self, *, threaded=False):
+        """Connect to the streaming API and receive the events of the
+        subscribed streams
 
         Parameters
         ----------
-        message : JSON
-            The disconnect message
+        threaded : bool
+            Whether or not to use a thread to run the stream
+
+        Raises
+        ------
+        TweepyException
+            When the stream is already connected or websocket-client is not
+            installed
+
+        Returns
+        -------
+        threading.Thread | None
+            The thread if ``threaded`` is set to ``True``, else ``None``
         """
-        log.warning("Received disconnect message: %s", message)
+        if self.running:
+            raise TweepyException("Stream is already connected")
+        _import_websocket()
 
-    def on_limit(self, track):
-        """This is called when a limit notice is received.
+        if threaded:
+            return self._threaded_connect()
+        else:
+            self._connect()
+
+    def _connect(self):
+        websocket = _import_websocket()
+        self.running = True
+
+        error_count = 0
+        network_error_wait = 0
+        network_error_wait_step = 0.25
+        network_error_wait_max = 16
+        http_error_wait = http_error_wait_start = 5
+        http_error_wait_max = 320
+        http_429_error_wait_start = 60
+
+        try:
+            url = _websocket_url(self._get_streaming_base_url())
+            header = [
+                f"Authorization: Bearer {self.access_token}",
+                f"User-Agent: {self.user_agent}",
+            ]
+            options = self._connection_options()
+            while self.running and error_count <= self.max_retries:
+                try:
+                    ws = websocket.create_connection(
+                        url, timeout=self.timeout, header=header, **options
+                    )
+                    try:
+                        with self._ws_lock:
+                            self._ws = ws
+                            for key in self.subscriptions:
+                                ws.send(_subscription_message("subscribe", key))
+
+                        error_count = 0
+                        http_error_wait = http_error_wait_start
+                        network_error_wait = 0
+
+                        self.on_connect()
+                        self._resume()
+
+                        while self.running and ws.connected:
+                            message = ws.recv()
+                            if message:
+                                self._process_message(message)
+                    finally:
+                        with self._ws_lock:
+                            self._ws = None
+                        ws.abort()
+
+                    if self.running:
+                        self.on_closed(ws)
+                except websocket.WebSocketBadStatusException as exc:
+                    self.on_request_error(exc.status_code)
+                    if not self.running:
+                        break
+                    log.error("HTTP error response text: %s", exc.resp_body)
+
+                    error_count += 1
+
+                    if exc.status_code in (420, 429):
+                        if http_error_wait < http_429_error_wait_start:
+                            http_error_wait = http_429_error_wait_start
+
+                    sleep(http_error_wait)
+
+                    http_error_wait *= 2
+                    if http_error_wait > http_error_wait_max:
+                        http_error_wait = http_error_wait_max
+                except (OSError, websocket.WebSocketException) as exc:
+                    if not self.running:
+                        # The connection was aborted by disconnect
+                        break
+                    self.on_connection_error()
+                    if not self.running:
+                        break
+                    log.error(
+                        "Connection error: %s",
+                        "".join(
+                            traceback.format_exception_only(type(exc), exc)
+                        ).rstrip()
+                    )
+
+                    sleep(network_error_wait)
+
+                    network_error_wait += network_error_wait_step
+                    if network_error_wait > network_error_wait_max:
+                        network_error_wait = network_error_wait_max
+        except Exception as exc:
+            self.on_exception(exc)
+        finally:
+            self.running = False
+            self.on_disconnect()
+
+    def _connection_options(self):
+        options = {}
+        if self.verify is False:
+            options["sslopt"] = {
+                "cert_reqs": ssl.CERT_NONE, "check_hostname": False
+            }
+        elif isinstance(self.verify, str):
+            options["sslopt"] = {"ca_certs": self.verify}
+        proxy = self.proxies.get("https")
+        if proxy:
+            proxy = urlsplit(proxy)
+            options["http_proxy_host"] = proxy.hostname
+            options["http_proxy_port"] = proxy.port
+            options["proxy_type"] = (
+                "http" if proxy.scheme == "https" else proxy.scheme
+            )
+            if proxy.username:
+                options["http_proxy_auth"] = (proxy.username, proxy.password)
+        return options
+
+    def _process_message(self, message):
+        message = self.decoder(message)
+        if "error" in message:
+            log.error("Received error from the streaming API: %s", message["error"])
+            return
+        stream = tuple(message.get("stream") or ())
+        event = message.get("event")
+        data = _decode_payload(self.decoder, event, message.get("payload"))
+        key = _subscription_key(*stream) if stream else None
+        if self._is_new(key, event, data):
+            self.on_message(stream, event, self._convert_event(event, data))
+
+    def _resumed_streams(self):
+        return list(self.subscriptions)
+
+    def _dispatch_status(self, key, status):
+        handler = self.subscriptions.get(key)
+        if handler is None:
+            self.on_status(status)
+        else:
+            handler("update", status)
+
+    def disconnect(self):
+        """Disconnect the stream"""
+        self.running = False
+        with self._ws_lock:
+            if self._ws is not None:
+                # Wakes up the thread waiting for the next message
+                self._ws.abort()
+
+    def on_message(self, stream, event, data):
+        """This is called when an event is received from the stream.
+        This method handles sending the event to the handler of the stream
+        it belongs to, or to :meth:`on_event`.
 
         Parameters
         ----------
-        track : int
-            Total count of the number of undelivered Tweets since the
-            connection was opened
+        stream : tuple[str, ...]
+            The stream of the event, as sent by Mastodon, such as
+            ``("hashtag", "python")``
+        event : str
+            The type of the event
+        data
+            The payload of the event, converted like the argument of the
+            ``on_*`` method it is sent to by default
         """
-        log.debug("Received limit notice: %d", track)
+        handler = None
+        if stream:
+            handler = self.subscriptions.get(_subscription_key(*stream))
+        if handler is None:
+            return self.on_event(event, data)
+        handler(event, data)
 
-    def on_warning(self, warning):
-        """This is called when a stall warning message is received.
+    def on_closed(self, connection):
+        """This is called when the stream has been closed by Mastodon.
 
         Parameters
         ----------
-        warning : JSON
-            The stall warning
+        connection : websocket.WebSocket
+            The closed connection
         """
-        log.warning("Received stall warning: %s", warning)
+        log.error("Stream connection closed by Mastodon")
 
 
 class StreamingClient(BaseClient, BaseStream):
@@ -931,3 +1602,239 @@ class StreamRule(NamedTuple):
     value: str = None
     tag: str = None
     id: str = None
+
+
+def _base_url(url):
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url.rstrip('/')
+
+
+def _import_websocket():
+    try:
+        import websocket
+    except ModuleNotFoundError:
+        raise TweepyException(
+            "MultiplexStream requires websocket-client to be installed"
+        )
+    return websocket
+
+
+def _websocket_url(streaming_base_url):
+    # http:// and https:// become ws:// and wss://
+    return "ws" + streaming_base_url[len("http"):] + "/api/v1/streaming"
+
+
+def _subscription_key(stream, param=None):
+    """Identify a stream the way the streaming API names it in its events."""
+    if stream in ("hashtag", "hashtag:local"):
+        if param is None:
+            raise TweepyException(f"The {stream} stream requires a tag")
+        # Hashtags are case-insensitive
+        return (stream, str(param).lstrip("#").lower())
+    if stream == "list":
+        if param is None:
+            raise TweepyException("The list stream requires a list_id")
+        return (stream, str(param))
+    return (stream,)
+
+
+def _subscription_message(message_type, key):
+    message = {"type": message_type, "stream": key[0]}
+    if key[0] == "list":
+        message["list"] = key[1]
+    elif len(key) > 1:
+        message["tag"] = key[1]
+    return json.dumps(message)
+
+
+def _stream_key(endpoint, params=None):
+    """Identify the stream of a streaming endpoint like the WebSocket API."""
+    params = params or {}
+    stream = endpoint.replace("/", ":")
+    if params.get("only_media"):
+        stream += ":media"
+    return _subscription_key(stream, params.get("tag", params.get("list")))
+
+
+def _id_order(status_id):
+    # Mastodon IDs are numbers, and the IDs of other implementations are
+    # strings of a fixed length, so longer IDs are newer either way
+    status_id = str(status_id)
+    return len(status_id), status_id
+
+
+class _StreamPositions:
+    """The last statuses received from each stream, to resume them without
+    dispatching a status twice
+
+    A status is deduplicated when it is received, but the position of its
+    stream only moves past it once it is complete, that is handled or dropped
+    on purpose, along with the statuses received before it. A status
+    abandoned before being handled holds the position back until it is
+    received again from the timeline, or given up.
+    """
+
+    def __init__(self, last_ids=None, size=1000):
+        self.last_ids = dict(last_ids or {})
+        self.size = size
+        self.recent_ids = {}
+        self.pending_ids = {}
+        self.abandoned_ids = {}
+        self.complete_ids = {}
+
+    def track(self, key, status_id):
+        """Remember a status handled as soon as it is received, and tell
+        whether it is new"""
+        if not self.receive(key, status_id):
+            return False
+        self.complete(key, status_id)
+        return True
+
+    def receive(self, key, status_id):
+        """Remember a status of a stream, and tell whether it is new"""
+        recent_ids = self.recent_ids.setdefault(key, OrderedDict())
+        if status_id in recent_ids:
+            return False
+        recent_ids[status_id] = None
+        if len(recent_ids) > self.size:
+            recent_ids.popitem(last=False)
+        self.abandoned_ids.get(key, set()).discard(status_id)
+        self.pending_ids.setdefault(key, set()).add(status_id)
+        return True
+
+    def complete(self, key, status_id):
+        """Move the position of a stream past a status, once the statuses
+        received before it are complete as well"""
+        self.pending_ids[key].discard(status_id)
+        self.complete_ids.setdefault(key, []).append(status_id)
+        self._advance(key)
+
+    def abandon(self, key, status_id):
+        """Forget a status received but not handled, so that it is received
+        again when the stream is resumed"""
+        self.recent_ids[key].pop(status_id, None)
+        self.pending_ids[key].discard(status_id)
+        self.abandoned_ids.setdefault(key, set()).add(status_id)
+        if isinstance(status_id, int):
+            # Resume from it even if no status of the stream is complete
+            # yet, as min_id is exclusive
+            last_id = self.last_ids.get(key)
+            if last_id is None or _id_order(status_id - 1) < _id_order(last_id):
+                self.last_ids[key] = status_id - 1
+
+    def give_up(self, key):
+        """Stop waiting for the abandoned statuses of a stream that were not
+        received again"""
+        self.abandoned_ids.pop(key, None)
+        self._advance(key)
+
+    def _advance(self, key):
+        waiting = self.pending_ids.get(key, set()) | self.abandoned_ids.get(key, set())
+        oldest = min(map(_id_order, waiting), default=None)
+        complete_ids = self.complete_ids.get(key, [])
+        ready = [
+            status_id for status_id in complete_ids
+            if oldest is None or _id_order(status_id) < oldest
+        ]
+        if not ready:
+            return
+        self.complete_ids[key] = [
+            status_id for status_id in complete_ids
+            if oldest is not None and _id_order(status_id) >= oldest
+        ]
+        newest = max(ready, key=_id_order)
+        last_id = self.last_ids.get(key)
+        if last_id is None or _id_order(newest) > _id_order(last_id):
+            self.last_ids[key] = newest
+
+
+class _LineSplitter:
+    """Splits the chunks of a stream into lines as they arrive
+
+    The lines found within a chunk are memoryview slices of it, so that only
+    the lines spanning several chunks are copied.
+    """
+
+    def __init__(self):
+        self.pending = b""
+
+    def feed(self, chunk):
+        """Yield the lines the chunk completes, without their line ending"""
+        view = memoryview(chunk)
+        start = 0
+        end = chunk.find(b"\n")
+        while end >= 0:
+            if self.pending:
+                line = self.pending + view[start:end]
+                self.pending = b""
+            else:
+                line = view[start:end]
+            if line[-1:] == b"\r":
+                line = line[:-1]
+            yield line
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if start < len(chunk):
+            self.pending += view[start:]
+
+
+def _sse_field(line):
+    """Split a line of Server-Sent Events into its field and value, or None
+    for comments."""
+    if line[:1] == b":":
+        return None, None
+    for field in (b"data", b"event", b"id", b"retry"):
+        size = len(field)
+        if line[:size] == field and line[size:size + 1] in (b":", b""):
+            value = line[size + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+            return field, value
+    return b"", line
+
+
+def _default_decoder():
+    try:
+        import orjson
+    except ModuleNotFoundError:
+        pass
+    else:
+        # orjson decodes memoryviews and strings as well
+        return orjson.loads
+    try:
+        import ujson
+    except ModuleNotFoundError:
+        loads = json.loads
+    else:
+        loads = ujson.loads
+
+    def decode(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return loads(data)
+
+    return decode
+
+
+def _decode_payload(decoder, event, payload):
+    if payload is None or event == "filters_changed":
+        return None
+    if event == "delete":
+        # The ID of the deleted status, which is not JSON
+        if isinstance(payload, str):
+            return payload
+        return bytes(payload).decode("utf-8")
+    return decoder(payload)
+
+
+def _apply_json_hooks(value):
+    """Apply Mastodon.py's JSON hooks to a decoded JSON value, the way
+    json.loads applies them to the objects it decodes."""
+    if isinstance(value, dict):
+        return _json_hooks({
+            key: _apply_json_hooks(item) for key, item in value.items()
+        })
+    if isinstance(value, list):
+        return [_apply_json_hooks(item) for item in value]
+    return value
@@ -82,6 +82,18 @@ class API:
         The URL of the upload server
     wait_on_rate_limit
         Whether or not to automatically wait for rate limits to replenish
+    pool_connections
+        The number of hosts to keep connection pools for
+    pool_maxsize
+        The maximum number of connections to keep open per host
+    pool_block
+        Whether or not to wait for a free connection instead of opening an
+        extra one when ``pool_maxsize`` connections to a host are in use
+    keep_alive
+        Whether or not to keep connections open between requests. When
+        ``False``, the session is closed after every request. Use
+        :meth:`close` or the API as a context manager to release the
+        connections otherwise.
 
     Raises
     ------
@@ -97,7 +109,8 @@ class API:
         self, auth=None, *, cache=None, host='api.twitter.com', parser=None,
         proxy=None, retry_count=0, retry_delay=0, retry_errors=None,
         timeout=60, upload_host='upload.twitter.com', user_agent=None,
-        wait_on_rate_limit=False
+        wait_on_rate_limit=False, pool_connections=10, pool_maxsize=10,
+        pool_block=False, keep_alive=True
     ):
         self.auth = auth
         self.cache = cache
@@ -136,7 +149,24 @@ class API:
                 str(type(self.parser))
             )
 
+        self.keep_alive = keep_alive
         self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the pooled connections of the session"""
+        self.session.close()
 
     def request(
         self, method, endpoint, *, endpoint_parameters=(), params=None,
@@ -285,7 +315,8 @@ class API:
 
             return result
         finally:
-            self.session.close()
+            if not self.keep_alive:
+                self.session.close()
 
     # Premium Search APIs
 
@@ -1,20 +1,356 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
+import imghdr
 import mimetypes
 
-from mastodon import Mastodon
+from mastodon import Mastodon, MastodonNotFoundError
 from mastodon.utility import AttribAccessDict
 
+from tweepy_mastodon.cache import account_cache
+from tweepy_mastodon.models import ResultSet
+
+# The multi-ID `GET /api/v1/accounts?id[]=` and `GET /api/v1/statuses?id[]=`
+# endpoints were added in Mastodon 4.3.0.
+BULK_LOOKUP_VERSION = '4.3.0'
+# Maximum number of IDs the server accepts in a single multi-ID account lookup.
+BULK_ACCOUNTS_LIMIT = 40
+# Maximum number of IDs the server accepts in a single multi-ID status lookup.
+BULK_STATUSES_LIMIT = 20
+# Maximum number of concurrent requests used to enrich a page of statuses.
+MAX_WORKERS = 8
+# Parameters Mastodon uses in the `Link` header to point at neighbouring pages.
+LINK_PARAMS = ('max_id', 'min_id', 'since_id')
+
+# Placeholder for an embedded `status` which has not been fetched yet.
+_UNLOADED = object()
+
+
+class LazyAccount(AttribAccessDict):
+    """Converted account whose embedded `status` is only fetched on first access.
+
+    The latest status of an account costs an extra request, and most callers never
+    look at it. `status_loader` is called the first time `status` is read, and its
+    result is memoized on the object. Accounts that have never posted have no
+    `status`, like users without Tweets on Twitter.
+    """
+
+    def __init__(self, mastodon_account, status_loader):
+        super().__init__(mastodon_account)
+        dict.__setitem__(self, 'status', _UNLOADED)
+        self._status_loader = status_loader
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if value is _UNLOADED:
+            status = self._status_loader()
+            if status is None:
+                dict.__delitem__(self, key)
+                raise KeyError(key)
+            dict.__setitem__(self, key, status)
+            return status
+        return value
+
+    def __getattr__(self, attr):
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(f"Attribute not found: {attr}") from None
+
+    def __contains__(self, key):
+        # Agrees with attribute access, which loads `status` to know whether it exists
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    # Overriding __iter__ makes dict(), dict.update() and friends go through
+    # keys() and __getitem__ instead of copying the placeholder out of the storage.
+    def __iter__(self):
+        return super().__iter__()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        items = []
+        for key in list(self.keys()):
+            try:
+                items.append((key, self[key]))
+            except KeyError:
+                # `status` of an account which has never posted
+                pass
+        return items
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def __reduce__(self):
+        # The loader holds on to the Mastodon client, so pickle as a plain dict of
+        # the fields already loaded.
+        return AttribAccessDict, (self._loaded_fields(),)
+
+    def __copy__(self):
+        return self._with_fields(dict(dict.items(self)))
+
+    def __deepcopy__(self, memo):
+        fields = {key: copy.deepcopy(value, memo) for key, value in self._loaded_fields().items()}
+        if dict.get(self, 'status') is _UNLOADED:
+            fields['status'] = _UNLOADED
+        return self._with_fields(fields)
+
+    def _loaded_fields(self):
+        return {key: value for key, value in dict.items(self) if value is not _UNLOADED}
+
+    def _with_fields(self, fields):
+        # Copies share the loader, so that they stay lazy
+        account = LazyAccount.__new__(LazyAccount)
+        dict.update(account, fields)
+        account._status_loader = self._status_loader
+        return account
+
+
+def convert_statuses(
+        mastodon_api: Mastodon,
+        mastodon_statuses: list,
+        include_user_status=True,
+        account_usernames=None,
+) -> ResultSet:
+    """Convert a page of statuses, resolving the accounts it refers to in one batch.
+
+    Converting statuses one by one issues an `account()` call for every reply. This
+    collects the lookups across the whole page first, deduplicates them and resolves
+    them together, so the cost of a page does not grow with its size. The embedded
+    `user.status` of each author is loaded lazily and at most once per page.
+
+    Callers which resolved the usernames of the page themselves, see `page_usernames()`,
+    pass them as `account_usernames` and no account is fetched.
+
+    The `Link` header pagination that Mastodon.py attaches to the page is kept on the
+    returned `ResultSet`, see `pagination_params()`.
+    """
+    pagination_next = getattr(mastodon_statuses, '_pagination_next', None)
+    pagination_prev = getattr(mastodon_statuses, '_pagination_prev', None)
+    mastodon_statuses = list(mastodon_statuses)
+
+    for mastodon_status in mastodon_statuses:
+        account_cache.store(mastodon_api.api_base_url, mastodon_status['account'])
+    if account_usernames is None:
+        account_usernames, missing_account_ids = page_usernames(mastodon_statuses)
+        accounts = fetch_accounts(mastodon_api, missing_account_ids)
+        for account_id in missing_account_ids:
+            # Deleted or suspended accounts are not fetched again one by one
+            account = accounts.get(account_id)
+            account_usernames[account_id] = account.username if account is not None else None
+
+    # Shared by every author on the page so that a `user.status` fetched through one
+    # status is reused by the others.
+    latest_statuses = {}
+    statuses = ResultSet(max_id=(pagination_next or {}).get('max_id'))
+    statuses._pagination_next = pagination_next
+    statuses._pagination_prev = pagination_prev
+    statuses.extend(
+        convert_status(
+            mastodon_api,
+            mastodon_status,
+            include_user_status=include_user_status,
+            account_usernames=account_usernames,
+            latest_statuses=latest_statuses,
+        )
+        for mastodon_status in mastodon_statuses
+    )
+    return statuses
+
+
+def page_usernames(mastodon_statuses) -> tuple:
+    """Collect the usernames a page of statuses already carries.
+
+    Returns a mapping of account ID to username, and the IDs of the accounts replied
+    to whose username still has to be fetched.
+    """
+    account_usernames = {}
+    for mastodon_status in mastodon_statuses:
+        account_usernames.update(_known_usernames(mastodon_status))
+    missing_account_ids = [
+        mastodon_status['in_reply_to_account_id']
+        for mastodon_status in mastodon_statuses
+        if mastodon_status['in_reply_to_account_id']
+        and mastodon_status['in_reply_to_account_id'] not in account_usernames
+    ]
+    return account_usernames, missing_account_ids
+
+
+def pagination_params(page, rel='next'):
+    """Get the parameters that fetch the `rel` ('next' or 'prev') page of `page`.
+
+    These are the `max_id`, `min_id` or `since_id` taken from the `Link` header of
+    the response, or None if the server did not link to such a page.
+    """
+    params = getattr(page, f'_pagination_{rel}', None)
+    if not params:
+        return None
+    return {key: params[key] for key in LINK_PARAMS if key in params}
+
+
+def fetch_account(mastodon_api: Mastodon, account_id) -> AttribAccessDict:
+    """Fetch an account by ID, going through the process-wide account cache."""
+    account = account_cache.get(mastodon_api.api_base_url, account_id)
+    if account is None:
+        account = mastodon_api.account(account_id)
+        account_cache.store(mastodon_api.api_base_url, account)
+    return account
+
+
+def lookup_account(mastodon_api: Mastodon, acct) -> AttribAccessDict:
+    """Fetch an account by `acct`, going through the process-wide account cache."""
+    account = account_cache.get_by_acct(mastodon_api.api_base_url, acct)
+    if account is None:
+        account = mastodon_api.account_lookup(acct)
+        account_cache.store(mastodon_api.api_base_url, account)
+    return account
+
+
+def fetch_accounts(mastodon_api: Mastodon, account_ids, max_workers=MAX_WORKERS) -> dict:
+    """Fetch accounts by ID with as few round trips as possible.
+
+    Cached accounts are not requested again and duplicate IDs are requested once.
+    Servers supporting the multi-ID endpoint are queried in bulk, others one account
+    per request on a bounded thread pool. Accounts that cannot be found are left out
+    of the returned mapping.
+    """
+    cached_accounts = {}
+    for account_id in dict.fromkeys(account_ids):
+        cached_accounts[account_id] = account_cache.get(mastodon_api.api_base_url, account_id)
+    account_ids = [account_id for account_id, account in cached_accounts.items() if account is None]
+    if not account_ids:
+        return cached_accounts
+
+    accounts = _fetch_many(
+        mastodon_api, account_ids, '/api/v1/accounts', BULK_ACCOUNTS_LIMIT, mastodon_api.account, max_workers
+    )
+
+    accounts_by_id = {account_id: account for account_id, account in cached_accounts.items() if account is not None}
+    for account in accounts:
+        if account is not None:
+            account_cache.store(mastodon_api.api_base_url, account)
+            accounts_by_id[account['id']] = account
+    return accounts_by_id
+
+
+def fetch_statuses(mastodon_api: Mastodon, status_ids, max_workers=MAX_WORKERS) -> dict:
+    """Fetch statuses by ID with as few round trips as possible.
+
+    Like `fetch_accounts()`, servers supporting the multi-ID endpoint are queried in
+    bulk and others on a bounded thread pool. Statuses that cannot be found are left
+    out of the returned mapping.
+    """
+    status_ids = list(dict.fromkeys(status_ids))
+    statuses = _fetch_many(
+        mastodon_api, status_ids, '/api/v1/statuses', BULK_STATUSES_LIMIT, mastodon_api.status, max_workers
+    )
+    return {status['id']: status for status in statuses if status is not None}
+
+
+def lookup_accounts(mastodon_api: Mastodon, accts, max_workers=MAX_WORKERS) -> dict:
+    """Fetch accounts by `acct` on a bounded thread pool, going through the account cache.
+
+    Mastodon has no multi-account lookup by name. Accounts that cannot be found are
+    left out of the returned mapping.
+    """
+    accts = list(dict.fromkeys(accts))
+    accounts = _map_concurrently(
+        lambda acct: _fetch_or_none(functools.partial(lookup_account, mastodon_api), acct), accts, max_workers
+    )
+    return {acct: account for acct, account in zip(accts, accounts) if account is not None}
+
+
+def normalize_id(resource_id):
+    """Return IDs the way Mastodon.py decodes them, with numeric strings as ints."""
+    if isinstance(resource_id, str) and resource_id.isdigit():
+        return int(resource_id)
+    return resource_id
+
+
+def _load_latest_status(mastodon_api: Mastodon, account_id, account_usernames=None, latest_statuses=None):
+    if latest_statuses is not None and account_id in latest_statuses:
+        return latest_statuses[account_id]
+    latest_status = next(iter(mastodon_api.account_statuses(account_id, limit=1)), None)
+    if latest_status is not None:
+        latest_status = convert_status(
+            mastodon_api,
+            latest_status,
+            is_user_embedded=True,
+            account_usernames=account_usernames,
+        )
+    if latest_statuses is not None:
+        latest_statuses[account_id] = latest_status
+    return latest_status
+
+
+def _api_request(mastodon_api: Mastodon, method, endpoint, params):
+    # Mastodon.py does not wrap every endpoint the server offers, so go through its
+    # request helper to keep authentication, rate limiting and JSON decoding.
+    return mastodon_api._Mastodon__api_request(method, endpoint, params)
+
+
+def _fetch_many(mastodon_api: Mastodon, resource_ids, endpoint, bulk_limit, fetch, max_workers):
+    if not resource_ids:
+        return []
+    if mastodon_api.verify_minimum_version(BULK_LOOKUP_VERSION, cached=True):
+        resources = []
+        for i in range(0, len(resource_ids), bulk_limit):
+            resources.extend(_api_request(
+                mastodon_api, 'GET', endpoint, {'id[]': resource_ids[i:i + bulk_limit]}
+            ))
+        return resources
+    return _map_concurrently(
+        lambda resource_id: _fetch_or_none(fetch, resource_id), resource_ids, max_workers
+    )
+
+
+def _fetch_or_none(fetch, resource_id):
+    try:
+        return fetch(resource_id)
+    except MastodonNotFoundError:
+        return None
+
+
+def _map_concurrently(function, items, max_workers):
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def _known_usernames(mastodon_status: AttribAccessDict) -> dict:
+    # A reply almost always mentions the account it replies to, and a self-reply
+    # refers to the author, so most `in_reply_to_screen_name` values need no request.
+    usernames = {mention['id']: mention['username'] for mention in mastodon_status.get('mentions') or []}
+    account = mastodon_status.get('account')
+    if account:
+        usernames[account['id']] = account['username']
+    return usernames
+
 
 def convert_status(
         mastodon_api: Mastodon,
         mastodon_status: AttribAccessDict,
         is_user_embedded=False,
         include_user_status=True,
+        account_usernames=None,
+        latest_statuses=None,
 ) -> AttribAccessDict:
     if not is_user_embedded:
         mastodon_status['author'] = convert_user(
             mastodon_api,
             AttribAccessDict(mastodon_status['account']),
-            include_status=include_user_status
+            include_status=include_user_status,
+            account_usernames=account_usernames,
+            latest_statuses=latest_statuses,
         )
     mastodon_status['contributors'] = None
     mastodon_status['coordinates'] = None
@@ -27,7 +363,11 @@ def convert_status(
     mastodon_status['id_str'] = str(mastodon_status['id'])
     in_reply_to_account_id = mastodon_status['in_reply_to_account_id']
     if in_reply_to_account_id:
-        mastodon_status['in_reply_to_screen_name'] = mastodon_api.account(in_reply_to_account_id).username
+        usernames = {**(account_usernames or {}), **_known_usernames(mastodon_status)}
+        if in_reply_to_account_id in usernames:
+            mastodon_status['in_reply_to_screen_name'] = usernames[in_reply_to_account_id]
+        else:
+            mastodon_status['in_reply_to_screen_name'] = fetch_account(mastodon_api, in_reply_to_account_id).username
     else:
         mastodon_status['in_reply_to_screen_name'] = None
     mastodon_status['in_reply_to_status_id'] = mastodon_status['in_reply_to_id']
@@ -69,6 +409,8 @@ def convert_user(
         verified_credentials=False,
         get_user=None,
         include_status=True,
+        account_usernames=None,
+        latest_statuses=None,
 ) -> AttribAccessDict:
     mastodon_account['contributors_enabled'] = False  # tentative. what's this?
     mastodon_account['default_profile'] = True  # tentative. what's this?
@@ -111,12 +453,6 @@ def convert_user(
     mastodon_account['profile_use_background_image'] = True  # tentative
     mastodon_account['protected'] = mastodon_account.locked
     mastodon_account['screen_name'] = mastodon_account.acct
-    if include_status:
-        mastodon_account['status'] = convert_status(
-            mastodon_api,
-            mastodon_api.account_statuses(mastodon_account.id, limit=1)[0],
-            is_user_embedded=True
-        )
     mastodon_account['statuses_count'] = mastodon_account.statuses_count
     mastodon_account['suspended'] = False  # tentative
     mastodon_account['time_zone'] = None  # no corresponding attribute
@@ -137,9 +473,28 @@ def convert_user(
     if get_user:
         mastodon_account['profile_location'] = None
 
+    if include_status:
+        status_loader = functools.partial(
+            _load_latest_status, mastodon_api, mastodon_account.id, account_usernames, latest_statuses
+        )
+        return LazyAccount(mastodon_account, status_loader)
+
     return mastodon_account
 
 
+def guess_mime_type(filename, file=None):
+    """Guess the MIME type of a media file from its content, or else from its name."""
+    h = None
+    if file is not None:
+        location = file.tell()
+        h = file.read(32)
+        file.seek(location)
+    mime_type = imghdr.what(filename, h=h)
+    if mime_type is not None:
+        return 'image/' + mime_type
+    return mimetypes.guess_type(filename)[0]
+
+
 def convert_media(mastodon_media: AttribAccessDict) -> AttribAccessDict:
     mastodon_media['media_id'] = mastodon_media.id
     mastodon_media['media_id_string'] = str(mastodon_media.id)